@@ -6,6 +6,9 @@ class Expense(models.Model):
     category = models.CharField(max_length=100) # e.g., Rent, Bills
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     note = models.TextField(blank=True)
-    
+
+    class Meta:
+        indexes = [models.Index(fields=['date'], name='expense_date_idx')]
+
     def __str__(self):
         return f"{self.category} - {self.amount}"
@@ -2,9 +2,10 @@ from django.shortcuts import render, redirect
 from django.db.models import Sum
 from django.utils.dateparse import parse_date, parse_datetime
 from django.utils import timezone
+from core.utils.dates import on_day
 from .models import Expense
 from sales.models import SalesInvoice, SalesReturn
-from purchases.models import PurchaseInvoice, PurchaseItem
+from purchases.models import PurchaseInvoice
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -32,16 +33,16 @@ def cash_summary(request):
 
     # 1. Cash In (Sales - Assuming all Sales are Cash for "Cash In" simplicity, or filter by payment_mode='CASH')
     # User said "Sales vs purchase cash flow".
-    sales_total = SalesInvoice.objects.filter(date__date=today).aggregate(total=Sum('grand_total'))['total'] or 0
+    sales_total = SalesInvoice.objects.filter(**on_day('date', today)).aggregate(total=Sum('grand_total'))['total'] or 0
 
     # 2. Cash Out (Purchases)
-    purchases_total = PurchaseItem.objects.filter(invoice__date=today).aggregate(total=Sum('total_amount'))['total'] or 0
+    purchases_total = PurchaseInvoice.objects.filter(date=today).aggregate(total=Sum('grand_total'))['total'] or 0
 
     # 3. Expenses
     expenses_total = Expense.objects.filter(date=today).aggregate(total=Sum('amount'))['total'] or 0
 
     # 4. Returns (Refunds)
-    returns_total = SalesReturn.objects.filter(date__date=today).aggregate(total=Sum('refund_amount'))['total'] or 0
+    returns_total = SalesReturn.objects.filter(**on_day('date', today)).aggregate(total=Sum('refund_amount'))['total'] or 0
     
     net_cash = sales_total - (purchases_total + expenses_total + returns_total)
 
@@ -59,7 +60,6 @@ def cash_summary(request):
     today_purchases = (
         PurchaseInvoice.objects.filter(date=today)
         .select_related('supplier')
-        .annotate(total_amount=Sum('items__total_amount'))
         .order_by('-id')
     )
 
@@ -115,11 +115,12 @@ def cash_summary(request):
         ensure_day(day_key)['sales_total'] += amount
         ensure_month(day_key.replace(day=1))['sales_total'] += amount
 
-    for row in PurchaseItem.objects.values('invoice__date', 'total_amount'):
-        day_key = normalize_day(row['invoice__date'])
+    # Invoices store their grand total; one row per day
+    for row in PurchaseInvoice.objects.values('date').annotate(total=Sum('grand_total')).order_by():
+        day_key = normalize_day(row['date'])
         if not day_key:
             continue
-        amount = row['total_amount'] or 0
+        amount = row['total'] or 0
         ensure_day(day_key)['purchases_total'] += amount
         ensure_month(day_key.replace(day=1))['purchases_total'] += amount
 
@@ -220,11 +221,12 @@ def _build_monthly_summaries():
         ensure_day(day_key)['sales_total'] += amount
         ensure_month(day_key.replace(day=1))['sales_total'] += amount
 
-    for row in PurchaseItem.objects.values('invoice__date', 'total_amount'):
-        day_key = normalize_day(row['invoice__date'])
+    # Invoices store their grand total; one row per day
+    for row in PurchaseInvoice.objects.values('date').annotate(total=Sum('grand_total')).order_by():
+        day_key = normalize_day(row['date'])
         if not day_key:
             continue
-        amount = row['total_amount'] or 0
+        amount = row['total'] or 0
         ensure_day(day_key)['purchases_total'] += amount
         ensure_month(day_key.replace(day=1))['purchases_total'] += amount
 
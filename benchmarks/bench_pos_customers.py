@@ -0,0 +1,106 @@
+"""Benchmark the POS page with many customers.
+
+Seeds a throwaway test database with N customers and compares the old page,
+which embedded every customer as JSON, with the new page plus the
+``/sales/api/customers/`` typeahead it queries instead.
+
+    python benchmarks/bench_pos_customers.py                 # 1k, 10k and 50k customers
+    python benchmarks/bench_pos_customers.py --sizes 5000 --queries 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the project root
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pharmacy_project.settings')
+django.setup()
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from sales.models import Customer
+from sales.utils.customer_index import customer_index
+
+FIRST = ["Ali", "Ahmed", "Sara", "Ayesha", "Bilal", "Usman", "Fatima", "Hina", "Imran", "Zainab", "Hamza", "Noor"]
+LAST = ["Khan", "Malik", "Shah", "Butt", "Qureshi", "Raza", "Iqbal", "Siddiqui", "Chaudhry", "Hussain"]
+
+
+def seed(total, rng, chunk=5000):
+    created = Customer.objects.count()
+    while created < total:
+        batch = [
+            Customer(
+                name=f"{rng.choice(FIRST)} {rng.choice(LAST)}",
+                phone=f"03{rng.randint(0, 49):02d}{rng.randint(0, 9999999):07d}",
+                address="",
+            )
+            for _ in range(min(chunk, total - created))
+        ]
+        Customer.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, samples
+
+
+def old_page(client):
+    # What pos_view used to add to every page: the whole Customer table as JSON.
+    page = client.get("/sales/pos/").content
+    embedded = json.dumps(list(Customer.objects.values("id", "name", "phone")))
+    return len(page) + len(embedded)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--loads", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    setup_test_environment()
+    client = Client()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        print(f"{'customers':>10} {'old KB':>8} {'old ms':>8} {'new KB':>8} {'new ms':>8} "
+              f"{'build ms':>9} {'api p50':>8} {'api p95':>8}")
+        for size in sorted(args.sizes):
+            seed(size, rng)
+            old_size, old_ms = timed(lambda: old_page(client), args.loads)
+            new_size, new_ms = timed(lambda: len(client.get("/sales/pos/").content), args.loads)
+            _, build_ms = timed(customer_index.build, 1)
+            queries = [
+                rng.choice([f"03{rng.randint(0, 49):02d}"[:rng.randint(2, 4)], rng.choice(FIRST)[:rng.randint(2, 4)]])
+                for _ in range(args.queries)
+            ]
+            api_ms = []
+            for query in queries:
+                start = time.perf_counter()
+                client.get("/sales/api/customers/", {"q": query})
+                api_ms.append((time.perf_counter() - start) * 1000)
+            print(f"{size:>10} {old_size / 1024:>8.1f} {statistics.median(old_ms):>8.2f} "
+                  f"{new_size / 1024:>8.1f} {statistics.median(new_ms):>8.2f} {build_ms[0]:>9.2f} "
+                  f"{statistics.median(api_ms):>8.2f} {percentile(api_ms, 95):>8.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
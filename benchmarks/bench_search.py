@@ -0,0 +1,90 @@
+"""Benchmark POS product search latency.
+
+Seeds a throwaway test database with N products and reports p50/p95 latency
+of the FTS5 index against the old ``icontains`` scan.
+
+    python benchmarks/bench_search.py                 # 1k, 50k and 500k products
+    python benchmarks/bench_search.py --sizes 1000 5000 --queries 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the project root
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pharmacy_project.settings')
+django.setup()
+
+from django.db import connection
+from inventory.models import Brand, Category, Product
+from inventory.utils.search_index import legacy_filter, search_products
+
+SYLLABLES = [c + v for c in "bcdfglmnprstvz" for v in "aeiou"] + ["dol", "mol", "lin", "met", "cin", "xin"]
+
+
+def make_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def seed(total, rng, chunk=5000):
+    brands = Brand.objects.bulk_create([Brand(name=make_word(rng).title()) for _ in range(500)])
+    categories = Category.objects.bulk_create([Category(name=make_word(rng).title()) for _ in range(40)])
+    words = set()
+    created = Product.objects.count()
+    while created < total:
+        batch = []
+        for _ in range(min(chunk, total - created)):
+            name = f"{make_word(rng)} {rng.choice([50, 100, 250, 500])}mg"
+            words.add(name.split()[0])
+            batch.append(Product(
+                brand=rng.choice(brands),
+                category=rng.choice(categories),
+                name=name,
+                company=make_word(rng).title(),
+            ))
+        Product.objects.bulk_create(batch)
+        created += len(batch)
+    return sorted(words)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def measure(fn, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), percentile(samples, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 50000, 500000])
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        print(f"{'products':>10} {'fts p50':>9} {'fts p95':>9} {'scan p50':>9} {'scan p95':>9}  (ms)")
+        words = []
+        for size in sorted(args.sizes):
+            words = seed(size, rng) or words
+            queries = [rng.choice(words)[:rng.randint(2, 5)] for _ in range(args.queries)]
+            fts = measure(lambda q: search_products(q, limit=20), queries)
+            scan = measure(lambda q: list(legacy_filter(Product.objects.all(), q)[:20]), queries)
+            print(f"{size:>10} {fts[0]:>9.2f} {fts[1]:>9.2f} {scan[0]:>9.2f} {scan[1]:>9.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,245 @@
-from django.test import TestCase
+import random
+import re
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Expense
+from core.utils.dates import on_day
+from core.utils.pricing import apply_pricing, price_line
+from core.utils.transactions import write_atomic
+from inventory.models import Batch, Brand, Category, Product, ProductBarcode, StockMovement
+from purchases.models import PurchaseInvoice, PurchaseItem, Supplier
+from reports.utils.expiry_alerts import get_expiry_alert_counts, get_expiry_alert_querysets
+from sales.models import SaleItem, SalesInvoice, SalesReturn
+from sales.utils.allocation import load_batches, lock_planned
+
+FULL_SCAN = re.compile(r'^SCAN (?!sqlite_)\w+$')  # sqlite_master: one-time schema checks
+PRICED_FIELDS = ('quantity', 'unit_price', 'discount_percentage', 'discount_amount', 'tax_amount', 'total_amount')
+
+
+def money(rng, high):
+    return Decimal(rng.randint(0, int(high * 100))) / 100
+
+
+def old_sale_item_save(row):
+    """``SaleItem.save()`` before pricing moved to core.utils.pricing, written out."""
+    qty = Decimal(row['quantity'])
+    u_price = Decimal(row['unit_price'])
+    d_perc = Decimal(row['discount_percentage'])
+    d_amt = Decimal(row['discount_amount'])
+    t_amt = Decimal(row['tax_amount'] or 0)
+    gross = qty * u_price
+    if d_amt == 0 and d_perc > 0:
+        d_amt = gross * (d_perc / Decimal(100))
+    return dict(row, discount_amount=d_amt, tax_amount=t_amt, total_amount=gross - d_amt + t_amt)
+
+
+def old_purchase_item_save(row):
+    """``PurchaseItem.save()`` before pricing moved to core.utils.pricing, written out."""
+    qty = Decimal(row['quantity'] or 0)
+    u_price = Decimal(row['unit_price'] or 0)
+    d_perc = Decimal(row['discount_percentage'] or 0)
+    d_amt = Decimal(row['discount_amount'] or 0)
+    t_perc = Decimal(row['tax_percentage'] or 0)
+    t_amt = Decimal(row['tax_amount'] or 0)
+    gross = qty * u_price
+    if d_amt == 0 and d_perc > 0:
+        d_amt = gross * (d_perc / Decimal(100))
+    taxable_amount = gross - d_amt
+    if t_amt == 0 and t_perc > 0:
+        t_amt = taxable_amount * (t_perc / Decimal(100))
+    return dict(
+        row, discount_percentage=d_perc, discount_amount=d_amt,
+        tax_percentage=t_perc, tax_amount=t_amt, total_amount=taxable_amount + t_amt,
+    )
+
+
+class PricingPropertyTests(TestCase):
+    """Bulk pricing and ``save()`` must store exactly what the old per-row arithmetic stored."""
+
+    cases = 150
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(
+            brand=Brand.objects.create(name='Brand'),
+            category=Category.objects.create(name='Category'),
+            name='Generic',
+        )
+        cls.product = product
+        cls.sales_invoice = SalesInvoice.objects.create()
+        cls.purchase_invoice = PurchaseInvoice.objects.create(
+            supplier=Supplier.objects.create(name='Supplier'), invoice_number='P-1',
+        )
+
+    def random_line(self, rng, with_tax_percentage):
+        line = {
+            'quantity': rng.randint(1, 500),
+            'unit_price': money(rng, 9999),
+            'discount_percentage': rng.choice([Decimal('0'), money(rng, 100)]),
+            'discount_amount': rng.choice([Decimal('0'), Decimal('0'), money(rng, 500)]),
+            'tax_amount': rng.choice([Decimal('0'), Decimal('0'), money(rng, 500)]),
+        }
+        if with_tax_percentage:
+            line['tax_percentage'] = rng.choice([Decimal('0'), money(rng, 30)])
+        return line
+
+    def stored(self, model, invoice, fields):
+        rows = list(model.objects.filter(invoice=invoice).order_by('id').values_list(*fields))
+        model.objects.filter(invoice=invoice).delete()
+        return rows
+
+    def assert_matches_old_save(self, model, invoice, rows, old_save):
+        fields = PRICED_FIELDS + (('tax_percentage',) if model is PurchaseItem else ())
+        # The old amounts go in as they are, so they are rounded by the database just like ours
+        model.objects.bulk_create([model(**old_save(row)) for row in rows])
+        expected = self.stored(model, invoice, fields)
+        self.assertEqual(len(expected), len(rows))
+
+        model.objects.bulk_create([apply_pricing(model(**row)) for row in rows])
+        self.assertEqual(self.stored(model, invoice, fields), expected)
+        for row in rows:
+            model.objects.create(**row)
+        self.assertEqual(self.stored(model, invoice, fields), expected)
+
+    def test_sale_items(self):
+        rng = random.Random(7)
+        rows = [
+            dict(self.random_line(rng, False), invoice=self.sales_invoice, product=self.product, item_name='Generic')
+            for _ in range(self.cases)
+        ]
+        self.assert_matches_old_save(SaleItem, self.sales_invoice, rows, old_sale_item_save)
+
+    def test_purchase_items(self):
+        rng = random.Random(11)
+        rows = [
+            dict(
+                self.random_line(rng, True),
+                invoice=self.purchase_invoice, product=self.product,
+                batch_number='B1', expiry_date='2030-01-01',
+            )
+            for _ in range(self.cases)
+        ]
+        self.assert_matches_old_save(PurchaseItem, self.purchase_invoice, rows, old_purchase_item_save)
+
+    def test_total_is_gross_less_discount_plus_tax(self):
+        rng = random.Random(3)
+        for line in (self.random_line(rng, True) for _ in range(self.cases)):
+            price = price_line(**line)
+            self.assertEqual(price.total_amount, price.gross - price.discount_amount + price.tax_amount)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class QueryPlanTests(TestCase):
+    """Hot queries must be served by an index, never by a full table scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        cls.products = [
+            Product.objects.create(brand=brand, category=category, name=f'Paracetamol {i}') for i in range(3)
+        ]
+        for i, product in enumerate(cls.products):
+            Batch.objects.create(
+                product=product, batch_number=f'B{i}', expiry_date=date.today() + timedelta(days=30 * i),
+                purchase_price=Decimal('5'), sale_price=Decimal('8'), quantity=5,
+            )
+        ProductBarcode.objects.create(product=cls.products[0], code='9501101530003')
+        invoice = SalesInvoice.objects.create(grand_total=Decimal('10'))
+        SalesReturn.objects.create(invoice=invoice, refund_amount=Decimal('1'))
+        Expense.objects.create(category='Rent', amount=Decimal('100'))
+        cls.supplier = Supplier.objects.create(name='Alpha Pharma')
+        purchase = PurchaseInvoice.objects.create(supplier=cls.supplier, invoice_number='P-1')
+        PurchaseItem.objects.create(
+            invoice=purchase, product=cls.products[0], batch_number='B0',
+            expiry_date=date.today() + timedelta(days=365), quantity=5, unit_price=Decimal('5'),
+        )
+
+    def plans(self, run):
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                if query['sql'].lstrip().upper().startswith('SELECT'):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        self.assertTrue(plans)
+        return plans
+
+    def assert_indexed(self, run, *indexes):
+        plans = self.plans(run)
+        for sql, plan in plans:
+            scans = [step for step in plan if FULL_SCAN.match(step)]
+            self.assertFalse(scans, f'{scans} in {sql}')
+        steps = ' | '.join(step for _, plan in plans for step in plan)
+        for index in indexes:
+            self.assertIn(f'INDEX {index}', steps)
+
+    def test_fefo_allocation(self):
+        self.assert_indexed(lambda: load_batches([p.id for p in self.products]), 'batch_fefo_idx')
+        movements = [
+            StockMovement(batch=batch, product_id=batch.product_id, quantity=-1)
+            for batch in Batch.objects.filter(product__in=self.products[:2])
+        ]
+        self.assert_indexed(lambda: lock_planned([], movements), 'batch_fefo_idx')
+
+    def test_product_search_and_scan(self):
+        self.assert_indexed(lambda: self.client.get(reverse('product_search_api'), {'q': 'para'}), 'batch_fefo_idx')
+        self.assert_indexed(
+            lambda: self.client.get(reverse('scan_api'), {'code': '9501101530003'}), 'batch_fefo_idx',
+        )
+
+    def test_expiry_alerts(self):
+        def run():
+            for queryset in get_expiry_alert_querysets().values():
+                list(queryset)
+            get_expiry_alert_counts(cache_seconds=0)
+        self.assert_indexed(run, 'batch_expiry_in_stock_idx')
+
+    def test_daily_reports(self):
+        today = timezone.localdate()
+        self.assert_indexed(lambda: self.client.get(reverse('daily_sales')), 'sales_invoice_date_idx', 'sales_return_date_idx')
+        self.assert_indexed(
+            lambda: (list(Expense.objects.filter(date=today)), list(PurchaseInvoice.objects.filter(date=today))),
+            'expense_date_idx', 'purchase_invoice_date_idx',
+        )
+        self.assert_indexed(
+            lambda: SalesInvoice.objects.filter(**on_day('date', today)).count(), 'sales_invoice_date_idx',
+        )
+
+    def test_dashboard(self):
+        self.assert_indexed(lambda: self.client.get(reverse('dashboard')), 'sales_invoice_date_idx')
+
+    def test_price_history(self):
+        url = reverse('price_history', args=[self.products[0].id])
+        self.assert_indexed(lambda: self.client.get(url), 'purchase_item_history_idx')
+        self.assert_indexed(lambda: self.client.get(url, {'supplier': self.supplier.id}), 'purchase_item_history_idx')
+
+    def test_purchase_list(self):
+        url = reverse('purchase_list_api')  # the page adds only the small supplier list
+        self.assert_indexed(lambda: self.client.get(url), 'purchase_invoice_date_idx')
+        self.assert_indexed(lambda: self.client.get(url, {'supplier': self.supplier.id}), 'purchase_invoice_supplier_idx')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'BEGIN IMMEDIATE is SQLite syntax')
+class WriteAtomicTests(TransactionTestCase):
+    def begins(self, block):
+        with CaptureQueriesContext(connection) as ctx:
+            with block():
+                Brand.objects.count()
+        return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('BEGIN')]
+
+    def test_only_write_transactions_take_the_lock_up_front(self):
+        self.assertEqual(self.begins(write_atomic), ['BEGIN IMMEDIATE'])
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN'])
+        with transaction.atomic():
+            self.assertEqual(self.begins(write_atomic), [])  # a savepoint of the outer transaction
@@ -0,0 +1,24 @@
+"""Local-day boundaries for filtering ``DateTimeField`` columns.
+
+``date__date=day`` wraps the column in a timezone conversion, which no
+index can serve. Filtering on ``[start, end)`` of the local day keeps the
+same rows and lets the database seek the date index instead.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def day_bounds(first, last=None):
+    """Aware ``(start, end)`` covering local days ``first`` through ``last``; ``end`` is exclusive."""
+    last = last or first
+    return (
+        timezone.make_aware(datetime.combine(first, time.min)),
+        timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min)),
+    )
+
+
+def on_day(field, first, last=None):
+    """Filter kwargs for ``field`` within ``day_bounds``."""
+    start, end = day_bounds(first, last)
+    return {f"{field}__gte": start, f"{field}__lt": end}
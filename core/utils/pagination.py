@@ -0,0 +1,112 @@
+"""Keyset (cursor) pagination.
+
+Pages are cut with a ``WHERE`` on the ordering key instead of ``OFFSET``,
+so every page costs one indexed range scan however deep it is. The
+ordering must end with a unique field (usually ``id``) to be stable.
+Cursors are opaque URL-safe tokens holding the key of a page's first or
+last row; decoded values are checked against the ordering fields, so a
+hand-edited cursor raises ``ValueError`` rather than a database error.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+KeysetPage = namedtuple("KeysetPage", ["items", "next_cursor", "previous_cursor"])
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Key values stored in ``token``; raises ``ValueError`` for a malformed cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid page cursor.")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid page cursor.")
+    return values
+
+
+def _cursor_values(model, ordering, token):
+    """``decode_cursor`` values converted by the model field of each ordering key."""
+    converted = []
+    for field, value in zip(ordering, decode_cursor(token, len(ordering))):
+        *relations, name = field.lstrip("-").split("__")
+        opts = model._meta
+        for relation in relations:
+            opts = opts.get_field(relation).related_model._meta
+        try:
+            value = opts.get_field(name).to_python(value)
+        except (ValidationError, TypeError):
+            value = None
+        if value is None:
+            raise ValueError("Invalid page cursor.")
+        converted.append(value)
+    return converted
+
+
+def _key(obj, ordering):
+    values = []
+    for field in ordering:
+        value = obj
+        for part in field.lstrip("-").split("__"):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+def _beyond(ordering, values, backwards):
+    """``Q`` for rows strictly after ``values`` in ``ordering`` (before, if ``backwards``)."""
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip("-")
+        descending = field.startswith("-") != backwards
+        step = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[index]})
+        for prior, value in zip(ordering[:index], values[:index]):
+            step &= Q(**{prior.lstrip("-"): value})
+        condition |= step
+    return condition
+
+
+def keyset_page(queryset, ordering, after=None, before=None, per_page=50):
+    """Return the ``KeysetPage`` after the ``after`` cursor, or before ``before``."""
+    ordering = list(ordering)
+    if before:
+        flipped = [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+        rows = list(
+            queryset.filter(_beyond(ordering, _cursor_values(queryset.model, ordering, before), True))
+            .order_by(*flipped)[:per_page + 1]
+        )
+        has_previous = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after:
+            queryset = queryset.filter(_beyond(ordering, _cursor_values(queryset.model, ordering, after), False))
+        rows = list(queryset.order_by(*ordering)[:per_page + 1])
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_previous = bool(after)
+    return KeysetPage(
+        items=items,
+        next_cursor=encode_cursor(_key(items[-1], ordering)) if items and has_next else None,
+        previous_cursor=encode_cursor(_key(items[0], ordering)) if items and has_previous else None,
+    )
+
+
+def cached_count(key, queryset, timeout=None):
+    """``queryset.count()`` cached under ``key`` until the caller deletes it."""
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
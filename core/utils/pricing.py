@@ -0,0 +1,64 @@
+"""Line pricing shared by sale and purchase items.
+
+The math used to live in ``SaleItem.save()`` and ``PurchaseItem.save()``,
+which forced row-by-row inserts. It is now a pure function of the line's
+inputs, so whole invoices can be priced in memory and written with one
+``bulk_create``; the models' ``save()`` delegate here too.
+
+    gross    = quantity * unit_price
+    discount = discount_amount, or gross * discount_percentage / 100 when no amount is given
+    tax      = tax_amount, or (gross - discount) * tax_percentage / 100 when no amount is given
+    total    = gross - discount + tax
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+LinePrice = namedtuple(
+    "LinePrice",
+    ["gross", "discount_percentage", "discount_amount", "tax_percentage", "tax_amount", "total_amount"],
+)
+
+HUNDRED = Decimal(100)
+
+
+def _decimal(value):
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value or 0))
+
+
+def price_line(quantity, unit_price, discount_percentage=0, discount_amount=0, tax_percentage=0, tax_amount=0):
+    qty = _decimal(quantity)
+    d_perc = _decimal(discount_percentage)
+    d_amt = _decimal(discount_amount)
+    t_perc = _decimal(tax_percentage)
+    t_amt = _decimal(tax_amount)
+
+    gross = qty * _decimal(unit_price)
+    # Priority: if amount is set manually, use it. Else calc from percent.
+    if d_amt == 0 and d_perc > 0:
+        d_amt = gross * (d_perc / HUNDRED)
+    taxable_amount = gross - d_amt
+    if t_amt == 0 and t_perc > 0:
+        t_amt = taxable_amount * (t_perc / HUNDRED)
+    return LinePrice(gross, d_perc, d_amt, t_perc, t_amt, taxable_amount + t_amt)
+
+
+def apply_pricing(item):
+    """Write the computed amounts onto a SaleItem or PurchaseItem instance and return it."""
+    has_tax_percentage = hasattr(item, "tax_percentage")
+    price = price_line(
+        item.quantity,
+        item.unit_price,
+        item.discount_percentage,
+        item.discount_amount,
+        item.tax_percentage if has_tax_percentage else 0,
+        item.tax_amount,
+    )
+    item.discount_percentage = price.discount_percentage
+    item.discount_amount = price.discount_amount
+    if has_tax_percentage:
+        item.tax_percentage = price.tax_percentage
+    item.tax_amount = price.tax_amount
+    item.total_amount = price.total_amount
+    return item
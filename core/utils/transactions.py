@@ -0,0 +1,33 @@
+"""Write transactions that take SQLite's write lock when they start.
+
+SQLite transactions are deferred: they take the write lock at their first
+write. A transaction that reads stock and then writes it cannot take the
+lock if another connection wrote in between, and fails with "database is
+locked" without waiting for the busy timeout. The paths that read and
+then write stock (sales, returns, receiving, imports, stock takes) open
+their transaction with ``BEGIN IMMEDIATE`` instead and queue for the
+lock, like ``select_for_update`` rows do on other databases. Everything
+else keeps deferred transactions, so reports and lists never wait on it.
+"""
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+@contextmanager
+def write_atomic(using=DEFAULT_DB_ALIAS):
+    """``transaction.atomic`` that starts with ``BEGIN IMMEDIATE`` on SQLite when it is the outermost block."""
+    connection = connections[using]
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    connection.ensure_connection()  # connecting resets transaction_mode from the settings
+    mode = connection.transaction_mode
+    connection.transaction_mode = "IMMEDIATE"
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Brand, Product, Batch
+from .models import Category, Brand, Product, ProductBarcode, Batch, StockMovement
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -11,14 +11,32 @@ class BrandAdmin(admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name',)
 
+class ProductBarcodeInline(admin.TabularInline):
+    model = ProductBarcode
+    extra = 1
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'brand', 'category', 'company', 'tax_percentage')
     list_filter = ('category', 'brand', 'company')
-    search_fields = ('name', 'brand__name', 'company')
+    search_fields = ('name', 'brand__name', 'company', 'barcodes__code')
+    inlines = [ProductBarcodeInline]
 
 @admin.register(Batch)
 class BatchAdmin(admin.ModelAdmin):
     list_display = ('product', 'batch_number', 'expiry_date', 'quantity', 'purchase_price', 'sale_price')
     list_filter = ('expiry_date',)
     search_fields = ('product__name', 'batch_number')
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'product', 'batch', 'movement_type', 'quantity', 'reference')
+    list_filter = ('movement_type',)
+    search_fields = ('product__name', 'batch__batch_number', 'reference')
+
+    # The ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -1,7 +1,16 @@
+import re
+
 from django import forms
-from .models import Product, Batch, Category, Brand
+from .models import Product, ProductBarcode, Batch, Category, Brand, StockTake
+from .utils.gs1 import barcode_key
 
 class ProductForm(forms.ModelForm):
+    barcodes = forms.CharField(
+        required=False,
+        help_text="Comma-separated; add *N for a pack of N units, e.g. 5012345678900, 15012345678907*10",
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Scan or type barcodes'}),
+    )
+
     class Meta:
         model = Product
         fields = ['name', 'brand', 'category', 'company', 'tax_percentage', 'description']
@@ -14,6 +23,42 @@ class ProductForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['barcodes'].initial = ', '.join(
+                code if pack == 1 else f'{code}*{pack}'
+                for code, pack in self.instance.barcodes.order_by('id').values_list('code', 'pack_quantity')
+            )
+
+    def clean_barcodes(self):
+        codes = {}
+        for entry in re.split(r'[,\s]+', self.cleaned_data['barcodes']):
+            if not entry:
+                continue
+            code, _, pack = entry.partition('*')
+            if pack and not (pack.isdigit() and int(pack) > 0):
+                raise forms.ValidationError(f'{entry}: the pack size after * must be a whole number.')
+            code = barcode_key(code)
+            if not code or len(code) > 64:
+                raise forms.ValidationError(f'{entry} is not a valid barcode.')
+            codes[code] = int(pack or 1)
+        taken = (
+            ProductBarcode.objects.filter(code__in=codes).exclude(product_id=self.instance.pk)
+            .select_related('product').first()
+        )
+        if taken:
+            raise forms.ValidationError(f'{taken.code} already belongs to {taken.product.name}.')
+        return codes
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        codes = self.cleaned_data.get('barcodes', {})
+        self.instance.barcodes.all().delete()
+        ProductBarcode.objects.bulk_create([
+            ProductBarcode(product=self.instance, code=code, pack_quantity=pack) for code, pack in codes.items()
+        ])
+
 class BatchForm(forms.ModelForm):
     class Meta:
         model = Batch
@@ -25,3 +70,12 @@ class BatchForm(forms.ModelForm):
             'sale_price': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),
         }
+
+class StockTakeForm(forms.ModelForm):
+    class Meta:
+        model = StockTake
+        fields = ['name', 'category']
+        widgets = {
+            'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g. Shelf A - Analgesics'}),
+            'category': forms.Select(attrs={'class': 'form-control'}),
+        }
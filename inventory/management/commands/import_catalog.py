@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.utils.catalog_import import CHUNK_SIZE, import_catalog, read_rows
+
+
+class Command(BaseCommand):
+    help = "Import products, brands, categories and opening batches from a CSV or XLSX file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="A .csv or .xlsx file with a header row.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows written per transaction.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        try:
+            with open(path, "rb") as file:
+                result = import_catalog(
+                    read_rows(file, path),
+                    reference=f"Import: {os.path.basename(path)}",
+                    chunk_size=options["chunk_size"],
+                    progress=lambda result: self.stdout.write(result.summary()),
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        for line, message in result.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more errors.")
+        self.stdout.write(self.style.SUCCESS(f"Imported {result.summary()}."))
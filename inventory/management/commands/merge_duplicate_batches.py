@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from inventory.utils.batch_merge import find_duplicates, merge_duplicates
+
+
+class Command(BaseCommand):
+    help = "Merge batches that repeat an older one (same product, batch number and expiry) into it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report the duplicates.")
+
+    def handle(self, *args, **options):
+        duplicates = find_duplicates()
+        if not duplicates:
+            self.stdout.write(self.style.SUCCESS("No duplicate batches."))
+            return
+        kept = {kept for _, kept, _, _ in duplicates}
+        if options["dry_run"]:
+            for pk, kept_id, product_id, quantity in duplicates:
+                self.stdout.write(f"Batch {pk} (product {product_id}, {quantity} units) -> batch {kept_id}")
+            self.stdout.write(self.style.WARNING(
+                f"{len(duplicates)} duplicates of {len(kept)} batches; rerun without --dry-run to merge."
+            ))
+            return
+        merge_duplicates(duplicates)
+        self.stdout.write(self.style.SUCCESS(f"Merged {len(duplicates)} duplicates into {len(kept)} batches."))
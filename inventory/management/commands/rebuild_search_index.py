@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.utils.search_index import index_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index from the catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        if not index_available(using):
+            raise CommandError(
+                "The product search index needs SQLite with FTS5; run migrations first."
+            )
+        count = rebuild_index(using)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from inventory.utils.ledger import take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Compact the stock movement ledger into a per-batch snapshot (run periodically, e.g. nightly)."
+
+    def handle(self, *args, **options):
+        snapshot = take_snapshot()
+        if snapshot is None:
+            self.stdout.write("No stock movements since the last snapshot.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot at {snapshot.taken_at:%Y-%m-%d %H:%M} through movement {snapshot.through_movement_id}: "
+            f"{snapshot.lines.count()} batches in stock."
+        ))
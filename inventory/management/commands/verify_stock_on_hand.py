@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.models import Product
+from inventory.utils.stock import batch_total, stock_drift
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.stock_on_hand from batch quantities and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Write the recomputed values back.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = stock_drift()
+            for product_id, stored, actual in drift:
+                self.stdout.write(f"Product {product_id}: stored {stored}, batches {actual} ({actual - stored:+d})")
+            if not drift:
+                self.stdout.write(self.style.SUCCESS("stock_on_hand matches batch quantities for every product."))
+                return
+            if options["fix"]:
+                Product.objects.filter(pk__in=[row[0] for row in drift]).update(stock_on_hand=batch_total())
+                self.stdout.write(self.style.SUCCESS(f"Fixed {len(drift)} products."))
+            else:
+                self.stdout.write(self.style.WARNING(f"{len(drift)} products drifted; rerun with --fix to repair."))
@@ -0,0 +1,76 @@
+# Generated by Django 6.0 on 2026-10-18 09:12
+
+from django.db import migrations
+
+COLUMNS = "name, brand, category, company"
+
+INDEX_TABLES = {
+    'inventory_product_fts': "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'",
+    'inventory_product_fts_trigram': "tokenize = 'trigram'",
+}
+
+
+def _product_row(alias):
+    return (
+        f"SELECT {alias}.id, {alias}.name, b.name, c.name, {alias}.company "
+        f"FROM inventory_brand b, inventory_category c "
+        f"WHERE b.id = {alias}.brand_id AND c.id = {alias}.category_id"
+    )
+
+
+def _statements():
+    for table, options in INDEX_TABLES.items():
+        yield f"CREATE VIRTUAL TABLE {table} USING fts5({COLUMNS}, {options})"
+        yield (
+            f"CREATE TRIGGER {table}_product_ai AFTER INSERT ON inventory_product BEGIN "
+            f"INSERT INTO {table}(rowid, {COLUMNS}) {_product_row('new')}; END"
+        )
+        yield (
+            f"CREATE TRIGGER {table}_product_au AFTER UPDATE OF name, brand_id, category_id, company "
+            f"ON inventory_product BEGIN "
+            f"DELETE FROM {table} WHERE rowid = old.id; "
+            f"INSERT INTO {table}(rowid, {COLUMNS}) {_product_row('new')}; END"
+        )
+        yield (
+            f"CREATE TRIGGER {table}_product_ad AFTER DELETE ON inventory_product BEGIN "
+            f"DELETE FROM {table} WHERE rowid = old.id; END"
+        )
+        for column, source in (('brand', 'inventory_brand'), ('category', 'inventory_category')):
+            yield (
+                f"CREATE TRIGGER {table}_{column}_au AFTER UPDATE OF name ON {source} BEGIN "
+                f"UPDATE {table} SET {column} = new.name WHERE rowid IN "
+                f"(SELECT id FROM inventory_product WHERE {column}_id = new.id); END"
+            )
+        yield (
+            f"INSERT INTO {table}(rowid, {COLUMNS}) "
+            f"SELECT p.id, p.name, b.name, c.name, p.company FROM inventory_product p "
+            f"JOIN inventory_brand b ON b.id = p.brand_id "
+            f"JOIN inventory_category c ON c.id = p.category_id"
+        )
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in _statements():
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in INDEX_TABLES:
+        for trigger in ('product_ai', 'product_au', 'product_ad', 'brand_au', 'category_au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_{trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 16:20
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_stock_on_hand(apps, schema_editor):
+    Product = apps.get_model('inventory', 'Product')
+    Batch = apps.get_model('inventory', 'Batch')
+    total = (
+        Batch.objects.filter(product=OuterRef('pk')).order_by()
+        .values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    Product.objects.update(stock_on_hand=Coalesce(Subquery(total), 0))
+
+
+# SQLite adds a NOT NULL column by rebuilding inventory_product, which the
+# search index triggers from 0002 do not survive; drop and recreate them.
+search_index = import_module('inventory.migrations.0002_product_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(search_index.drop_search_index, search_index.create_search_index),
+        migrations.AddField(
+            model_name='product',
+            name='stock_on_hand',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_stock_on_hand, migrations.RunPython.noop),
+        migrations.RunPython(search_index.create_search_index, search_index.drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 15:40
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_product_name_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Lower('name'), models.F('brand'), name='product_lower_name_idx'),
+        ),
+    ]
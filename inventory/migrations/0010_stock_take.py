@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 15:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='movement_type',
+            field=models.CharField(choices=[('OPENING', 'Opening balance'), ('PURCHASE', 'Purchase'), ('SALE', 'Sale'), ('RETURN', 'Sales return'), ('MANUAL', 'Manual stock entry'), ('ADJUSTMENT', 'Adjustment'), ('STOCK_TAKE', 'Stock take')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='StockTake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('OPEN', 'Open'), ('APPLIED', 'Applied')], default='OPEN', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+                ('category', models.ForeignKey(blank=True, help_text='Only batches of this category are counted; leave empty for the whole store', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_takes', to='inventory.category')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockTakeLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expected_quantity', models.PositiveIntegerField()),
+                ('counted_quantity', models.PositiveIntegerField()),
+                ('counted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_take_lines', to='inventory.batch')),
+                ('stock_take', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.stocktake')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stock_take', 'batch'), name='unique_stock_take_batch')],
+            },
+        ),
+    ]
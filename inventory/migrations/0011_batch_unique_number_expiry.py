@@ -0,0 +1,75 @@
+# Generated by Django 6.0 on 2026-10-18 22:40
+
+from django.db import migrations, models
+from django.db.models import Case, F, IntegerField, Min, Q, Value, When, Window
+from django.utils import timezone
+
+CHUNK_SIZE = 500
+
+
+def _remap(field, remap):
+    return Case(*[When(**{field: old}, then=Value(new)) for old, new in remap.items()], output_field=IntegerField())
+
+
+def _merge_lines(model, parent, summed, remap):
+    """Fold the lines of the same parent and (remapped) batch into one, adding up ``summed``."""
+    lines = model.objects.filter(batch_id__in=[*remap, *set(remap.values())])
+    merged = {}
+    for line in lines:
+        key = (getattr(line, f"{parent}_id"), remap.get(line.batch_id, line.batch_id))
+        if key in merged:
+            for field in summed:
+                setattr(merged[key], field, getattr(merged[key], field) + getattr(line, field))
+        else:
+            line.pk = None
+            line.batch_id = key[1]
+            merged[key] = line
+    lines.delete()
+    model.objects.bulk_create(merged.values())
+
+
+def merge_duplicate_batches(apps, schema_editor):
+    """The constraint below cannot be added while duplicates exist: fold each into its oldest batch."""
+    Batch = apps.get_model("inventory", "Batch")
+    oldest = Window(Min("id"), partition_by=[F("product_id"), F("batch_number"), F("expiry_date")])
+    duplicates = list(
+        Batch.objects.annotate(kept=oldest).filter(~Q(kept=F("id")))
+        .order_by("id").values_list("id", "kept", "quantity")
+    )
+    for start in range(0, len(duplicates), CHUNK_SIZE):
+        chunk = duplicates[start:start + CHUNK_SIZE]
+        remap = {pk: kept for pk, kept, _ in chunk}
+        added = {}
+        for _, kept, quantity in chunk:
+            added[kept] = added.get(kept, 0) + quantity
+        # A new updated_at makes POS catalog deltas resend the kept batches
+        Batch.objects.filter(pk__in=added).update(
+            quantity=F("quantity") + _remap("pk", added), updated_at=timezone.now(),
+        )
+        for app_label, name in [("inventory", "StockMovement"), ("purchases", "PurchaseItem"), ("sales", "SaleItem")]:
+            apps.get_model(app_label, name).objects.filter(batch_id__in=remap).update(
+                batch_id=_remap("batch_id", remap),
+            )
+        _merge_lines(apps.get_model("inventory", "StockSnapshotLine"), "snapshot", ["quantity"], remap)
+        _merge_lines(
+            apps.get_model("inventory", "StockTakeLine"), "stock_take",
+            ["expected_quantity", "counted_quantity"], remap,
+        )
+        Batch.objects.filter(pk__in=remap).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_stock_take'),
+        ('purchases', '0002_purchase_invoice_date_index'),
+        ('sales', '0006_date_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_batches, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='batch',
+            constraint=models.UniqueConstraint(fields=('product', 'batch_number', 'expiry_date'), name='unique_product_batch_expiry'),
+        ),
+    ]
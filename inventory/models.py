@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -26,9 +28,22 @@ class Product(models.Model):
     # Tax rules: Apply only if product has tax.
     tax_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0.0, help_text="Tax percentage (0 to 100)")
 
+    # Sum of the product's batch quantities, kept in step by Batch.save and
+    # inventory.utils.stock; `manage.py verify_stock_on_hand` checks for drift.
+    stock_on_hand = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='product_updated_at_idx'),
+            # Keyset pagination order of the product list
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            # Case-insensitive brand + name lookups of the catalog import
+            models.Index(Lower('name'), 'brand', name='product_lower_name_idx'),
+        ]
+
     def __str__(self):
         return f"{self.brand.name} ({self.name})"
 
@@ -46,6 +61,168 @@ class Batch(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    class Meta:
+        constraints = [
+            # One row per physical batch; deliveries of it add to the quantity (see receive_batches)
+            models.UniqueConstraint(fields=['product', 'batch_number', 'expiry_date'], name='unique_product_batch_expiry'),
+        ]
+        indexes = [
+            models.Index(fields=['updated_at'], name='batch_updated_at_idx'),
+            # FEFO: a product's in-stock batches by expiry (allocation, search, scan)
+            models.Index(
+                fields=['product', 'expiry_date', 'id'], name='batch_fefo_idx',
+                condition=models.Q(quantity__gt=0),
+            ),
+            # Expiry alerts: in-stock batches by expiry date
+            models.Index(fields=['expiry_date'], name='batch_expiry_in_stock_idx', condition=models.Q(quantity__gt=0)),
+        ]
+
+    def save(self, *args, movement_type=None, reference='', **kwargs):
+        """Save and record the quantity change as a StockMovement (``ADJUSTMENT`` unless given)."""
+        from .utils import batch_cache
+        from .utils.stock import adjust_stock_on_hand
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Batch.objects.filter(pk=self.pk).values_list('product_id', 'quantity').first()
+            super().save(*args, **kwargs)
+            changes = {self.product_id: self.quantity}
+            if previous:
+                changes[previous[0]] = changes.get(previous[0], 0) - previous[1]
+            adjust_stock_on_hand(changes)
+            batch_cache.invalidate(changes)
+            StockMovement.objects.bulk_create([
+                StockMovement(
+                    batch=self, product_id=product_id, quantity=quantity,
+                    movement_type=movement_type or StockMovement.ADJUSTMENT, reference=reference,
+                )
+                for product_id, quantity in changes.items() if quantity
+            ])
+
     def __str__(self):
         return f"{self.product} - {self.batch_number}"
+
+class ProductBarcode(models.Model):
+    """A scannable code of a product; a product can have one per pack size."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='barcodes')
+    # GTINs are stored as 14 digits (see inventory.utils.gs1.barcode_key)
+    code = models.CharField(max_length=64, unique=True)
+    pack_quantity = models.PositiveIntegerField(default=1, help_text="Units added to the cart per scan")
+
+    def clean(self):
+        from .utils.gs1 import barcode_key
+        self.code = barcode_key(self.code)
+
+    def save(self, *args, **kwargs):
+        self.clean()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.code} ({self.product.name})"
+
+class ProductTombstone(models.Model):
+    """Marks a deleted product so POS catalogs synced before the delete can drop it."""
+    product_id = models.PositiveBigIntegerField(unique=True)
+    deleted_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Deleted product {self.product_id}"
+
+
+class StockMovement(models.Model):
+    """Append-only ledger row: one signed change to one batch's quantity."""
+    OPENING = 'OPENING'
+    PURCHASE = 'PURCHASE'
+    SALE = 'SALE'
+    RETURN = 'RETURN'
+    MANUAL = 'MANUAL'
+    ADJUSTMENT = 'ADJUSTMENT'
+    STOCK_TAKE = 'STOCK_TAKE'
+    MOVEMENT_TYPES = (
+        (OPENING, 'Opening balance'),
+        (PURCHASE, 'Purchase'),
+        (SALE, 'Sale'),
+        (RETURN, 'Sales return'),
+        (MANUAL, 'Manual stock entry'),
+        (ADJUSTMENT, 'Adjustment'),
+        (STOCK_TAKE, 'Stock take'),
+    )
+
+    # The ledger is history: a batch or product with movements cannot be deleted
+    batch = models.ForeignKey(Batch, on_delete=models.PROTECT, related_name='movements')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='stock_movements')
+    movement_type = models.CharField(max_length=10, choices=MOVEMENT_TYPES)
+    quantity = models.IntegerField(help_text="Positive into stock, negative out of stock")
+    reference = models.CharField(max_length=100, blank=True, help_text="Invoice, return or purchase number")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='movement_product_time_idx'),
+            models.Index(fields=['created_at'], name='movement_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_movement_type_display()} {self.quantity:+d} {self.batch}"
+
+
+class StockSnapshot(models.Model):
+    """Batch quantities compacted from the ledger up to ``through_movement_id``."""
+    taken_at = models.DateTimeField(unique=True)
+    through_movement_id = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Stock snapshot {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey(StockSnapshot, on_delete=models.CASCADE, related_name='lines')
+    batch = models.ForeignKey(Batch, on_delete=models.PROTECT, related_name='snapshot_lines')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='snapshot_lines')
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['snapshot', 'batch'], name='unique_snapshot_batch')]
+        indexes = [models.Index(fields=['snapshot', 'product'], name='snapshot_line_product_idx')]
+
+
+class StockTake(models.Model):
+    """A physical count of one section of the store (a category, or everything).
+
+    Counts are recorded as lines over as many sessions as needed and only
+    change batch quantities when the stock take is applied.
+    """
+    OPEN = 'OPEN'
+    APPLIED = 'APPLIED'
+    STATUSES = (
+        (OPEN, 'Open'),
+        (APPLIED, 'Applied'),
+    )
+
+    name = models.CharField(max_length=100)
+    category = models.ForeignKey(
+        Category, on_delete=models.PROTECT, null=True, blank=True, related_name='stock_takes',
+        help_text="Only batches of this category are counted; leave empty for the whole store",
+    )
+    status = models.CharField(max_length=10, choices=STATUSES, default=OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class StockTakeLine(models.Model):
+    """The counted quantity of one batch, next to the system quantity when it was counted."""
+    stock_take = models.ForeignKey(StockTake, on_delete=models.CASCADE, related_name='lines')
+    batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name='stock_take_lines')
+    expected_quantity = models.PositiveIntegerField()
+    counted_quantity = models.PositiveIntegerField()
+    counted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['stock_take', 'batch'], name='unique_stock_take_batch')]
+
+    def __str__(self):
+        return f"{self.batch}: {self.counted_quantity} counted"
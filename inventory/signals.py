@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Batch, Brand, Category, Product, ProductTombstone
+from .utils import batch_cache
+from .utils.catalog import bump_catalog_version
+
+
+@receiver(post_delete, sender=Product)
+def record_product_tombstone(sender, instance, **kwargs):
+    ProductTombstone.objects.update_or_create(product_id=instance.pk)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    # A product restored with its old id (fixture load, backup restore) is live again.
+    if created:
+        ProductTombstone.objects.filter(product_id=instance.pk).delete()
+        batch_cache.invalidate([instance.pk])
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Brand)
+def touch_brand_products(sender, instance, created, **kwargs):
+    # Catalog rows carry the brand name, so a rename has to reach synced clients.
+    if not created:
+        Product.objects.filter(brand=instance).update(updated_at=timezone.now())
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Category)
+def category_renamed(sender, instance, created, **kwargs):
+    # Product list searches match category names.
+    if not created:
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=Batch)
+def release_batch_stock(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(
+        stock_on_hand=Greatest(F('stock_on_hand') - instance.quantity, 0),
+        updated_at=timezone.now(),
+    )
+    batch_cache.invalidate([instance.product_id])
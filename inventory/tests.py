@@ -1,3 +1,703 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import ProtectedError
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from core.utils.pagination import encode_cursor
+from sales.models import SaleItem, SalesInvoice
+from . import views
+from .forms import ProductForm
+from .models import (
+    Batch, Brand, Category, Product, ProductBarcode, StockMovement, StockSnapshot, StockSnapshotLine, StockTake,
+)
+from .utils import batch_cache
+from .utils.batch_merge import find_duplicates, merge_duplicates
+from .utils.catalog_import import import_catalog, read_rows
+from .utils import search_index
+from .utils.gs1 import parse_scan
+from .utils.ledger import stock_at, take_snapshot
+from .utils.stock import apply_batch_deltas, stock_drift
+from .utils.stock_take import apply_stock_take, import_counts, record_counts, record_scan, summary
+
+
+class StockOnHandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+
+    def add_batch(self, number, quantity, expiry=date(2030, 1, 1)):
+        return Batch.objects.create(
+            product=self.product, batch_number=number, expiry_date=expiry,
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=quantity,
+        )
+
+    def assert_stock(self, expected):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_on_hand, expected)
+        self.assertEqual(sum(self.product.batches.values_list('quantity', flat=True)), expected)
+
+    def test_add_stock_and_batch_edits(self):
+        self.client.post(reverse('add_stock', args=[self.product.pk]), {
+            'batch_number': 'B1', 'expiry_date': '2030-01-01', 'purchase_price': '5.00',
+            'sale_price': '8.00', 'quantity': 12,
+        })
+        self.assert_stock(12)
+        batch = self.product.batches.get()
+        batch.quantity = 7
+        batch.save()
+        self.assert_stock(7)
+        batch.quantity = 0
+        batch.save()
+        self.assert_stock(0)
+
+    def test_sale_and_return(self):
+        self.add_batch('SOON', 3, date(2029, 1, 1))
+        self.add_batch('LATE', 10)
+        response = self.client.post(reverse('create_sale_api'), json.dumps({
+            'items': [{'product_id': self.product.id, 'quantity': 5, 'price': '8.00'}],
+        }), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'success')
+        self.assert_stock(8)
+
+        item = SaleItem.objects.filter(invoice_id=response.json()['invoice_id']).order_by('id').last()
+        self.client.post(reverse('sales_return_create', args=[item.invoice_id]), {f'return_qty_{item.id}': 2})
+        self.assert_stock(10)
+
+    def test_verify_command_reports_and_fixes_drift(self):
+        self.add_batch('B1', 6)
+        Product.objects.filter(pk=self.product.pk).update(stock_on_hand=9)
+        out = StringIO()
+        call_command('verify_stock_on_hand', stdout=out)
+        self.assertIn('stored 9, batches 6 (-3)', out.getvalue())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_on_hand, 9)
+
+        call_command('verify_stock_on_hand', '--fix', stdout=StringIO())
+        self.assert_stock(6)
+
+
+class ProductListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Generic')
+        category = Category.objects.create(name='Tablets')
+        # Duplicate names check that the id tie-breaker keeps pages stable
+        Product.objects.bulk_create([
+            Product(brand=brand, category=category, name=f'Drug {i % 40:02d}') for i in range(120)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.per_page = views.PRODUCTS_PER_PAGE
+        views.PRODUCTS_PER_PAGE = 25
+
+    def tearDown(self):
+        views.PRODUCTS_PER_PAGE = self.per_page
+
+    def get(self, **params):
+        return self.client.get(reverse('product_list'), params).context
+
+    def test_pages_walk_the_catalog_in_order(self):
+        expected = list(Product.objects.order_by('name', 'id').values_list('id', flat=True))
+        seen, pages, context = [], [], self.get()
+        while True:
+            pages.append(context['page'])
+            seen += [p.id for p in context['products']]
+            if not context['page'].next_cursor:
+                break
+            context = self.get(after=context['page'].next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 5)
+        self.assertIsNone(pages[0].previous_cursor)
+
+        back = self.get(before=pages[2].previous_cursor)
+        self.assertEqual([p.id for p in back['products']], expected[25:50])
+        self.assertEqual(back['page'].previous_cursor, pages[1].previous_cursor)
+
+    def test_count_is_cached_until_the_catalog_changes(self):
+        self.assertEqual(self.get()['total_count'], 120)
+        with CaptureQueriesContext(connection) as ctx:
+            self.get(after=self.get()['page'].next_cursor)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.first().delete()
+        self.assertEqual(self.get()['total_count'], 119)
+
+    def test_search_and_bad_cursor(self):
+        context = self.get(q='drug 07')
+        self.assertEqual(context['total_count'], 3)
+        self.assertEqual({p.name for p in context['products']}, {'Drug 07'})
+        self.assertEqual(len(self.get(after='not-a-cursor')['products']), 25)
+        # Well-formed but the wrong types: the first page, not a server error
+        for values in (['Drug 07', 'x'], [None, 1], ['Drug 07', [1]]):
+            self.assertEqual(self.get(after=encode_cursor(values))['page'].previous_cursor, None)
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name='Getz')
+        cls.category = Category.objects.create(name='Antibiotic')
+        other = Category.objects.create(name='Tablets')
+        cls.moxi = Product.objects.create(brand=cls.brand, category=cls.category, name='Moxifloxacin')
+        cls.amoxi = Product.objects.create(brand=cls.brand, category=cls.category, name='Amoxicillin')
+        cls.panacea = Product.objects.create(brand=cls.brand, category=other, name='Panacea')
+        cls.tablet = Product.objects.create(brand=cls.brand, category=Category.objects.create(name='Panacid'), name='Tablet X')
+
+    def setUp(self):
+        if not search_index.index_available():
+            self.skipTest('SQLite without FTS5')
+
+    def names(self, query):
+        return [p.name for p in search_index.search_products(query)]
+
+    def test_name_hits_rank_before_category_hits(self):
+        self.assertEqual(self.names('pana'), ['Panacea', 'Tablet X'])
+
+    def test_word_prefix_hits_come_before_substring_hits(self):
+        self.assertEqual(self.names('moxi'), ['Moxifloxacin', 'Amoxicillin'])
+        self.assertEqual(self.names('cillin'), ['Amoxicillin'])
+        self.assertEqual(
+            set(search_index.filter_products(Product.objects.all(), 'moxi')), {self.moxi, self.amoxi},
+        )
+
+    def test_renames_update_the_index(self):
+        Product.objects.filter(pk=self.moxi.pk).update(name='Levofloxacin')
+        self.assertEqual(self.names('moxif'), [])
+        self.assertEqual(self.names('levo'), ['Levofloxacin'])
+
+        Brand.objects.filter(pk=self.brand.pk).update(name='Searle')
+        self.assertEqual(len(self.names('searle')), 4)
+        self.assertEqual(self.names('getz'), [])
+
+        Category.objects.filter(pk=self.category.pk).update(name='Quinolone')
+        self.assertEqual(self.names('quinol'), ['Levofloxacin', 'Amoxicillin'])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            for table in (search_index.PREFIX_TABLE, search_index.TRIGRAM_TABLE):
+                cursor.execute(f'DELETE FROM {table}')
+        self.assertEqual(self.names('moxi'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 4 products.', out.getvalue())
+        self.assertEqual(self.names('moxi'), ['Moxifloxacin', 'Amoxicillin'])
+
+    def test_failed_search_checks_the_index_again(self):
+        with mock.patch.object(search_index, '_ranked_ids', side_effect=OperationalError('no such table')):
+            self.assertIsNone(search_index.search_product_ids('moxi'))
+        self.assertNotIn('default', search_index._available)
+        self.assertEqual(self.names('moxi'), ['Moxifloxacin', 'Amoxicillin'])
+        self.assertTrue(search_index._available['default'])
+
+
+class StockLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+
+    def sell(self, quantity):
+        response = self.client.post(reverse('create_sale_api'), json.dumps({
+            'items': [{'product_id': self.product.id, 'quantity': quantity, 'price': '8.00'}],
+        }), content_type='application/json')
+        return SaleItem.objects.filter(invoice_id=response.json()['invoice_id']).get()
+
+    def test_every_path_records_movements(self):
+        self.client.post(reverse('add_stock', args=[self.product.pk]), {
+            'batch_number': 'B1', 'expiry_date': '2030-01-01', 'purchase_price': '5.00',
+            'sale_price': '8.00', 'quantity': 10,
+        })
+        item = self.sell(4)
+        self.client.post(reverse('sales_return_create', args=[item.invoice_id]), {f'return_qty_{item.id}': 1})
+
+        movements = list(StockMovement.objects.order_by('id').values_list('movement_type', 'quantity', 'reference'))
+        self.assertEqual(movements, [
+            ('MANUAL', 10, 'Manual: B1'),
+            ('SALE', -4, item.invoice.invoice_number),
+            ('RETURN', 1, f'RET-{item.return_items.get().sales_return_id}'),
+        ])
+        batch = Batch.objects.get()
+        self.assertEqual(sum(q for _, q, _ in movements), batch.quantity)
+
+    def test_ledger_protects_its_batches_and_products(self):
+        batch = Batch.objects.create(
+            product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=5,
+        )
+        with self.assertRaises(ProtectedError):
+            batch.delete()
+        response = self.client.post(reverse('product_delete', args=[self.product.pk]))
+        self.assertRedirects(response, reverse('product_list'))
+        self.assertTrue(Product.objects.filter(pk=self.product.pk).exists())
+        self.assertEqual(StockMovement.objects.filter(batch=batch).count(), 1)
+
+    def test_point_in_time_stock_with_and_without_snapshots(self):
+        batch = Batch.objects.create(
+            product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=20,
+        )
+        start = timezone.now()
+        StockMovement.objects.update(created_at=start - timedelta(days=3))
+        sale = self.sell(5)
+        StockMovement.objects.filter(reference=sale.invoice.invoice_number).update(created_at=start - timedelta(days=2))
+        self.sell(3)
+
+        one_day_back = start - timedelta(days=1)
+        expected = {
+            start - timedelta(days=4): {},
+            start - timedelta(days=3): {self.product.id: 20},
+            one_day_back: {self.product.id: 15},
+            timezone.now(): {self.product.id: 12},
+        }
+        for when, stock in expected.items():
+            self.assertEqual(stock_at(when), stock)
+
+        take_snapshot(now=start - timedelta(days=2) + timedelta(hours=1))
+        take_snapshot(lag=timedelta(0))
+        self.assertEqual(StockSnapshot.objects.count(), 2)
+        for when, stock in expected.items():
+            self.assertEqual(stock_at(when), stock)
+        self.assertEqual(stock_at(timezone.now(), by_batch=True), {batch.id: 12})
+        self.assertIsNone(take_snapshot())
+
+    def test_stock_on_date_report(self):
+        Batch.objects.create(
+            product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=7,
+        )
+        response = self.client.get(reverse('stock_on_date'))
+        self.assertEqual(response.context['total_units'], 7)
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+        response = self.client.get(reverse('stock_on_date'), {'date': yesterday})
+        self.assertEqual(response.context['rows'], [])
+
+
+class CatalogImportTests(TestCase):
+    header = 'Name,Brand,Category,Company,Tax %,Batch Number,Expiry Date,Purchase Price,Sale Price,Quantity\n'
+
+    def setUp(self):
+        self.brand = Brand.objects.create(name='Panadol')
+        self.existing = Product.objects.create(
+            brand=self.brand, category=Category.objects.create(name='Analgesic'), name='Paracetamol',
+        )
+
+    def csv_file(self, body):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as file:
+            file.write(self.header + body)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_command_creates_products_batches_and_opening_stock(self):
+        path = self.csv_file(
+            'paracetamol,PANADOL,Analgesic,GSK,0,P1,2030-01-31,10,12.50,40\n'
+            'Ibuprofen,Brufen,NSAID,Abbott,5,B1,2029-06-30,20,25,10\n'
+            'Ibuprofen,Brufen,NSAID,Abbott,5,B2,2029-12-31,20,25,5\n'
+            'Cetirizine,Zyrtec,Antihistamine,,,,,,,\n'
+            ',Brufen,NSAID,,,,,,,\n'
+            'Aspirin,Disprin,NSAID,,0,D1,31/12/2030,3,4,5\n'
+        )
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--chunk-size', '2', stdout=out, stderr=err)
+
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(Brand.objects.count(), 3)
+        self.assertEqual(Category.objects.count(), 3)
+        ibuprofen = Product.objects.get(name='Ibuprofen')
+        self.assertEqual(ibuprofen.tax_percentage, Decimal('5.00'))
+        self.assertEqual(ibuprofen.stock_on_hand, 15)
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.stock_on_hand, 40)
+        self.assertEqual(Product.objects.get(name='Cetirizine').batches.count(), 0)
+        self.assertEqual(
+            StockMovement.objects.filter(movement_type=StockMovement.OPENING).count(), 3,
+        )
+        self.assertEqual(StockMovement.objects.get(batch__batch_number='P1').reference, f'Import: {os.path.basename(path)}')
+        self.assertIn('Line 6: name is required.', err.getvalue())
+        self.assertIn('Line 7: expiry_date must be a date', err.getvalue())
+        self.assertIn('6 rows: 2 products, 3 batches', out.getvalue())
+        self.assertIn('0 batch rows added to existing batches', out.getvalue())
+        call_command('verify_stock_on_hand', stdout=out)
+        self.assertIn('matches batch quantities', out.getvalue())
+
+        # A rerun adds to the batches it created the first time
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=StringIO())
+        self.assertIn('6 rows: 0 products, 0 batches', out.getvalue())
+        self.assertIn('3 batch rows added to existing batches', out.getvalue())
+        self.assertEqual(Batch.objects.count(), 3)
+        self.assertEqual(Product.objects.get(name='Ibuprofen').stock_on_hand, 30)
+
+    def test_xlsx_upload(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Generic Name', 'Brand', 'Category', 'Batch', 'Expiry', 'Purchase Price', 'Qty'])
+        sheet.append(['Amoxicillin', 'Amoxil', 'Antibiotic', 'A1', date(2031, 5, 1), 30, 12])
+        sheet.append(['Amoxicillin', 'Amoxil', 'Antibiotic', 'A2', date(2031, 6, 1), 30, -1])
+        stream = BytesIO()
+        workbook.save(stream)
+
+        upload = SimpleUploadedFile('stock.xlsx', stream.getvalue())
+        response = self.client.post(reverse('catalog_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].errors, [(3, 'quantity must not be negative.')])
+        product = Product.objects.get(name='Amoxicillin')
+        self.assertEqual(product.stock_on_hand, 12)
+        self.assertEqual(product.batches.get().expiry_date, date(2031, 5, 1))
+
+    def test_missing_columns_and_bad_extension(self):
+        with self.assertRaisesMessage(ValueError, 'Missing columns: category.'):
+            import_catalog(read_rows(BytesIO(b'name,brand\nA,B\n'), 'x.csv'))
+        response = self.client.post(
+            reverse('catalog_import'), {'file': SimpleUploadedFile('x.txt', b'name')}, follow=True,
+        )
+        self.assertContains(response, 'Upload a .csv or .xlsx file.')
+        self.assertEqual(Product.objects.count(), 1)
+
+
+class BarcodeTests(TestCase):
+    def test_parse_scan(self):
+        self.assertEqual(parse_scan(' 036000291452 ').code, '00036000291452')
+        self.assertEqual(parse_scan('036000291453').code, '036000291453')  # bad check digit: kept as typed
+        self.assertEqual(parse_scan('STORE-42').code, 'STORE-42')
+        scan = parse_scan('0109501101530003172602001012345')
+        self.assertEqual((scan.code, scan.lot, scan.expiry), ('09501101530003', '12345', date(2026, 2, 28)))
+        scan = parse_scan('(01)09501101530003(10)L1(21)S9')
+        self.assertEqual((scan.lot, scan.expiry, scan.serial), ('L1', None, 'S9'))
+
+    def test_product_form_barcodes(self):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        data = {'name': 'Paracetamol', 'brand': brand.pk, 'category': category.pk, 'tax_percentage': '0'}
+        form = ProductForm(dict(data, barcodes='9501101530003, 19501101530000*10'))
+        self.assertTrue(form.is_valid(), form.errors)
+        product = form.save()
+        self.assertEqual(
+            dict(product.barcodes.values_list('code', 'pack_quantity')),
+            {'09501101530003': 1, '19501101530000': 10},
+        )
+        self.assertEqual(ProductForm(instance=product)['barcodes'].initial, '09501101530003, 19501101530000*10')
+
+        form = ProductForm(dict(data, name='Other', barcodes='09501101530003'))
+        self.assertFalse(form.is_valid())
+        self.assertIn('already belongs to Paracetamol', form.errors['barcodes'][0])
+
+        form = ProductForm(dict(data, barcodes='19501101530000*12'), instance=product)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(list(ProductBarcode.objects.values_list('code', 'pack_quantity')), [('19501101530000', 12)])
+
+
+class BatchCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        cls.products = [
+            Product.objects.create(brand=brand, category=category, name=f'Paracetamol {i}') for i in range(3)
+        ]
+        cls.product = cls.products[0]
+        cls.late = cls.add_batch('LATE', 10, date(2031, 1, 1))
+        cls.soon = cls.add_batch('SOON', 3, date(2030, 1, 1))
+
+    @classmethod
+    def add_batch(cls, number, quantity, expiry):
+        return Batch.objects.create(
+            product=cls.product, batch_number=number, expiry_date=expiry,
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=quantity,
+        )
+
+    def setUp(self):
+        batch_cache.clear()
+
+    def cached(self):
+        entry = batch_cache.get_many([self.product.pk])[self.product.pk]
+        return list(zip(entry.ids, entry.quantity))
+
+    def test_hits_and_patches_in_place(self):
+        self.assertEqual(self.cached(), [(self.soon.pk, 3), (self.late.pk, 10)])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cached(), [(self.soon.pk, 3), (self.late.pk, 10)])
+        self.assertEqual(batch_cache.get_many([self.product.pk])[self.product.pk].fefo(),
+                         (self.soon.pk, date(2030, 1, 1), Decimal('8.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_batch_deltas({self.soon.pk: -3, self.late.pk: -1})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cached(), [(self.late.pk, 9)])
+        stats = batch_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['patches']), (3, 1, 1))
+
+        # Back in stock: the batch is not cached any more, so the product reloads.
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_batch_deltas({self.soon.pk: 2})
+        self.assertEqual(self.cached(), [(self.soon.pk, 2), (self.late.pk, 9)])
+
+    def test_other_batch_writes_invalidate(self):
+        self.cached()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_batch('EARLY', 4, date(2029, 1, 1))
+        self.assertEqual(self.cached()[0][1], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soon.quantity = 0
+            self.soon.save()
+        self.assertEqual(len(self.cached()), 2)
+        self.assertEqual(batch_cache.stats()['misses'], 3)
+
+    @override_settings(BATCH_CACHE_SIZE=2)
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = (p.pk for p in self.products)
+        batch_cache.get_many([first])
+        batch_cache.get_many([second])
+        batch_cache.get_many([first])
+        batch_cache.get_many([third])
+        stats = batch_cache.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+        with self.assertNumQueries(0):
+            batch_cache.get_many([first, third])
+
+    def test_sale_plans_against_cache_and_rechecks_locked_rows(self):
+        def sell(quantity):
+            response = self.client.post(reverse('create_sale_api'), json.dumps({
+                'items': [{'product_id': self.product.id, 'quantity': quantity, 'price': '8.00'}],
+            }), content_type='application/json')
+            return list(SaleItem.objects.filter(invoice_id=response.json()['invoice_id'])
+                        .order_by('id').values_list('batch__batch_number', 'quantity'))
+
+        self.cached()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sell(4), [('SOON', 3), ('LATE', 1)])
+        self.assertEqual(self.cached(), [(self.late.pk, 9)])
+
+        # Changed behind the cache's back: the plan fails the locked re-check and is redone.
+        Batch.objects.filter(pk=self.late.pk).update(quantity=2)
+        self.assertEqual(sell(5), [('LATE', 2), (None, 3)])
+        self.late.refresh_from_db()
+        self.assertEqual(self.late.quantity, 0)
+
+    def test_plan_must_match_the_fefo_head(self):
+        def sell(quantity):
+            response = self.client.post(reverse('create_sale_api'), json.dumps({
+                'items': [{'product_id': self.product.id, 'quantity': quantity, 'price': '8.00'}],
+            }), content_type='application/json')
+            return list(SaleItem.objects.filter(invoice_id=response.json()['invoice_id'])
+                        .order_by('id').values_list('batch__batch_number', 'quantity'))
+
+        self.cached()
+        # Received by another worker: no invalidation reaches this process's cache.
+        Batch.objects.bulk_create([Batch(
+            product=self.product, batch_number='EARLY', expiry_date=date(2029, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('7.00'), quantity=2,
+        )])
+        self.assertEqual(sell(2), [('EARLY', 2)])
+
+        # The first batch holds more than the cache says: FEFO takes it all from there.
+        batch_cache.clear()
+        self.cached()
+        Batch.objects.filter(pk=self.soon.pk).update(quantity=6)
+        self.assertEqual(sell(4), [('SOON', 4)])
+
+    def test_entries_expire(self):
+        self.cached()
+        with self.assertNumQueries(0):
+            self.cached()
+        with override_settings(BATCH_CACHE_SECONDS=0), self.assertNumQueries(1):
+            self.cached()
+
+    def test_versions_in_a_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with override_settings(CACHES={'default': backend}):
+                self.cached()
+                with self.assertNumQueries(0):
+                    self.cached()
+                cache.incr(batch_cache.VERSION_KEY.format(self.product.pk))  # a write in another worker
+                self.assertEqual(len(self.cached()), 2)
+                self.assertEqual(batch_cache.stats()['stale'], 1)
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    apply_batch_deltas({self.late.pk: -4})
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.cached(), [(self.soon.pk, 3), (self.late.pk, 6)])
+
+    def test_stats_page_is_staff_only(self):
+        url = reverse('batch_cache_stats')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertIn('hit_rate', self.client.get(url).json())
+
+
+class StockTakeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        cls.category = Category.objects.create(name='Analgesic')
+        cls.product = Product.objects.create(brand=brand, category=cls.category, name='Paracetamol')
+        ProductBarcode.objects.create(product=cls.product, code='09501101530003', pack_quantity=10)
+        other = Product.objects.create(brand=brand, category=Category.objects.create(name='Antibiotic'), name='Amoxil')
+        cls.soon = cls.add_batch(cls.product, 'SOON', 20)
+        cls.late = cls.add_batch(cls.product, 'LATE', 30)
+        cls.other = cls.add_batch(other, 'AMX', 5)
+
+    @classmethod
+    def add_batch(cls, product, number, quantity):
+        return Batch.objects.create(
+            product=product, batch_number=number, expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=quantity,
+        )
+
+    def setUp(self):
+        self.stock_take = StockTake.objects.create(name='Shelf A', category=self.category)
+
+    def quantities(self):
+        return dict(Batch.objects.values_list('batch_number', 'quantity'))
+
+    def test_counts_variances_and_apply(self):
+        self.assertEqual(record_counts(self.stock_take, {self.soon.pk: 18, self.late.pk: 30, self.other.pk: 5}),
+                         [self.other.pk])
+        # Sold while the count goes on: not a variance.
+        apply_batch_deltas({self.soon.pk: -4}, StockMovement.SALE)
+        with self.assertNumQueries(2):
+            totals = summary(self.stock_take)
+        self.assertEqual((totals['counted'], totals['changed'], totals['in_scope']), (2, 1, 2))
+        self.assertEqual((totals['units_short'], totals['value_short']), (-2, Decimal('-10.00')))
+
+        self.assertEqual(apply_stock_take(self.stock_take), 1)
+        self.assertEqual(self.quantities(), {'SOON': 14, 'LATE': 30, 'AMX': 5})
+        movement = StockMovement.objects.get(movement_type=StockMovement.STOCK_TAKE)
+        self.assertEqual((movement.batch_id, movement.quantity), (self.soon.pk, -2))
+        self.assertEqual(stock_drift(), [])
+        with self.assertRaises(ValueError):
+            apply_stock_take(self.stock_take)
+        with self.assertRaises(ValueError):
+            record_counts(self.stock_take, {self.late.pk: 1})
+
+    def test_import_and_scan(self):
+        upload = SimpleUploadedFile('counts.csv', (
+            'batch_id,batch_number,counted\n'
+            f'{self.soon.pk},,25\n'
+            ',LATE,12\n'
+            ',AMX,1\n'
+            ',NOPE,1\n'
+            ',SOON,x\n'
+            ',,\n'
+        ).encode())
+        saved, errors = import_counts(self.stock_take, upload, upload.name)
+        self.assertEqual(saved, 2)
+        self.assertEqual([line for line, _ in errors], [4, 5, 6])
+
+        self.assertEqual(record_scan(self.stock_take, '(01)09501101530003(10)LATE', packs=2), (self.late.pk, 20))
+        with self.assertRaises(ValueError):
+            record_scan(self.stock_take, '09501101530003')  # two batches, no lot
+        counted = dict(self.stock_take.lines.values_list('batch_id', 'counted_quantity'))
+        self.assertEqual(counted, {self.soon.pk: 25, self.late.pk: 32})
+
+    def test_pages(self):
+        self.assertEqual(self.client.post(reverse('stock_take_list'), {'name': 'Whole store'}).status_code, 302)
+        url = reverse('stock_take_detail', args=[self.stock_take.pk])
+        response = self.client.post(url, {'action': 'sheet', f'count_{self.soon.pk}': '21', f'count_{self.late.pk}': ''})
+        self.assertEqual(response.status_code, 302)
+        self.assertContains(self.client.get(url), 'value="21"')
+
+        sheet = b''.join(self.client.get(reverse('stock_take_sheet', args=[self.stock_take.pk])).streaming_content)
+        self.assertEqual(sheet.decode().splitlines()[1:], [
+            f'{self.soon.pk},Paracetamol,Panadol,SOON,2030-01-01,21',
+            f'{self.late.pk},Paracetamol,Panadol,LATE,2030-01-01,',
+        ])
+        preview = reverse('stock_take_preview', args=[self.stock_take.pk])
+        self.assertContains(self.client.get(preview), 'SOON')
+        self.client.post(preview)
+        self.assertEqual(self.quantities()['SOON'], 21)
+
+
+class BatchMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'), category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+
+    def add_stock(self, number, expiry, quantity):
+        return self.client.post(reverse('add_stock', args=[self.product.pk]), {
+            'batch_number': number, 'expiry_date': expiry, 'purchase_price': '5.00',
+            'sale_price': '8.00', 'quantity': quantity,
+        })
+
+    def test_deliveries_add_to_the_existing_batch(self):
+        self.add_stock('B1', '2030-01-01', 10)
+        self.add_stock('B1', '2030-01-01', 5)
+        self.add_stock('B1', '2031-01-01', 2)  # same number, other expiry: another batch
+        self.assertEqual(
+            list(self.product.batches.order_by('id').values_list('expiry_date', 'quantity')),
+            [(date(2030, 1, 1), 15), (date(2031, 1, 1), 2)],
+        )
+        self.assertEqual(StockMovement.objects.filter(movement_type=StockMovement.MANUAL).count(), 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_on_hand, 17)
+        self.assertEqual(find_duplicates(), [])
+        out = StringIO()
+        call_command('merge_duplicate_batches', '--dry-run', stdout=out)
+        self.assertIn('No duplicate batches.', out.getvalue())
+
+    def test_redelivery_takes_the_new_prices(self):
+        self.add_stock('B1', '2030-01-01', 10)
+        batch_cache.get_many([self.product.pk])
+        self.client.post(reverse('add_stock', args=[self.product.pk]), {
+            'batch_number': 'B1', 'expiry_date': '2030-01-01', 'purchase_price': '6.00',
+            'sale_price': '9.50', 'quantity': 5,
+        })
+        batch = self.product.batches.get()
+        self.assertEqual((batch.purchase_price, batch.sale_price, batch.quantity), (Decimal('6.00'), Decimal('9.50'), 15))
+        self.assertEqual(batch_cache.get_many([self.product.pk])[self.product.pk].fefo()[2], Decimal('9.50'))
+
+    def test_merge_repoints_references(self):
+        # The constraint keeps real duplicates out, so merge a batch that differs only by expiry.
+        kept = Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 1, 1),
+                                    purchase_price=Decimal('5.00'), quantity=10)
+        extra = Batch.objects.create(product=self.product, batch_number='B1', expiry_date=date(2030, 2, 1),
+                                     purchase_price=Decimal('5.00'), quantity=4)
+        sale = SaleItem.objects.create(invoice=SalesInvoice.objects.create(), product=self.product, batch=extra,
+                                       quantity=1, unit_price=Decimal('8.00'))
+        stock_take = StockTake.objects.create(name='Shelf A')
+        record_counts(stock_take, {kept.pk: 9, extra.pk: 4})
+        snapshot = take_snapshot(now=timezone.now() + timedelta(hours=1))
+
+        before = kept.updated_at
+        self.assertEqual(merge_duplicates([(extra.pk, kept.pk, self.product.pk, 4)]), {self.product.pk})
+        kept.refresh_from_db()
+        self.assertEqual(kept.quantity, 14)
+        self.assertGreater(kept.updated_at, before)
+        self.assertFalse(Batch.objects.filter(pk=extra.pk).exists())
+        sale.refresh_from_db()
+        self.assertEqual(sale.batch_id, kept.pk)
+        self.assertEqual(StockMovement.objects.filter(batch=kept).count(), 2)
+        self.assertEqual(list(stock_take.lines.values_list('batch_id', 'expected_quantity', 'counted_quantity')),
+                         [(kept.pk, 14, 13)])
+        self.assertEqual(list(StockSnapshotLine.objects.filter(snapshot=snapshot).values_list('batch_id', 'quantity')),
+                         [(kept.pk, 14)])
+        self.assertEqual(stock_drift(), [])
@@ -3,8 +3,15 @@ from . import views
 
 urlpatterns = [
     path('products/', views.product_list, name='product_list'),
+    path('products/autocomplete/', views.product_autocomplete, name='product_autocomplete'),
+    path('products/import/', views.catalog_import, name='catalog_import'),
     path('products/add/', views.product_create, name='product_create'),
     path('products/<int:pk>/edit/', views.product_edit, name='product_edit'),
     path('products/<int:pk>/add-stock/', views.add_stock, name='add_stock'),
     path('products/<int:pk>/delete/', views.product_delete, name='product_delete'),
+    path('stock-takes/', views.stock_take_list, name='stock_take_list'),
+    path('stock-takes/<int:pk>/', views.stock_take_detail, name='stock_take_detail'),
+    path('stock-takes/<int:pk>/sheet.csv', views.stock_take_sheet, name='stock_take_sheet'),
+    path('stock-takes/<int:pk>/variances/', views.stock_take_preview, name='stock_take_preview'),
+    path('batch-cache/', views.batch_cache_stats, name='batch_cache_stats'),
 ]
@@ -0,0 +1,280 @@
+"""Per-process cache of each product's sellable (FEFO ordered) batches.
+
+Sale allocation, product search and the POS scan all need a product's
+in-stock batches by expiry. This keeps that list per product as compact
+arrays (batch id, expiry ordinal, quantity, sale price in cents) in a
+bounded LRU, so hot products are read from memory instead of queried on
+every request.
+
+Every entry carries the product's version at the time it was loaded.
+Writes that go through ``apply_movements`` patch the cached quantities in
+place once they commit and bump the version; any other batch write
+(``Batch.save``, deletes, bulk imports) calls ``invalidate``. With a
+shared cache backend (Redis, Memcached, database) the versions live there,
+so a write in one worker makes the other workers reload; with the default
+in-memory backend they are kept per process, and a write in another
+worker is only seen when the entry expires, ``BATCH_CACHE_SECONDS``
+(default 30) after it was loaded.
+
+The database stays the source of truth: allocation plans against the
+cache, then locks the product's FEFO head in the database and accepts
+the plan only if it is exactly what the database would have chosen (see
+``sales.utils.allocation.lock_planned``), falling back to a locked query
+otherwise. A stale entry can therefore only show an out-of-date FEFO
+price or stock in search, for at most ``BATCH_CACHE_SECONDS``.
+"""
+import random
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from inventory.models import Batch
+
+VERSION_KEY = "inventory:batches:version:{}"
+NO_PRICE = -1
+
+_lock = threading.RLock()
+_entries = OrderedDict()
+_local_versions = {}
+_stats = Counter()
+
+
+def capacity():
+    return getattr(settings, "BATCH_CACHE_SIZE", 10000)
+
+
+def max_age():
+    return getattr(settings, "BATCH_CACHE_SECONDS", 30)
+
+
+class BatchList:
+    """A product's in-stock batches in FEFO order, as parallel arrays."""
+
+    __slots__ = ("version", "loaded_at", "ids", "expiry", "quantity", "price")
+
+    def __init__(self, version, rows=(), loaded_at=None):
+        self.version = version
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        self.ids = array("q")
+        self.expiry = array("l")
+        self.quantity = array("q")
+        self.price = array("q")
+        for pk, expiry, quantity, price in rows:
+            self.ids.append(pk)
+            self.expiry.append(expiry)
+            self.quantity.append(quantity)
+            self.price.append(price)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def stock(self):
+        return sum(self.quantity)
+
+    def fefo(self):
+        """``(batch_id, expiry_date, sale_price)`` of the first batch to sell, or ``None``."""
+        if not self.ids:
+            return None
+        price = self.price[0]
+        return self.ids[0], date.fromordinal(self.expiry[0]), None if price == NO_PRICE else Decimal(price) / 100
+
+    def batches(self, product_id):
+        """Fresh unsaved ``Batch`` objects for allocation planning, which may change their quantities."""
+        return [
+            Batch(
+                id=pk, product_id=product_id, expiry_date=date.fromordinal(expiry), quantity=quantity,
+                sale_price=None if price == NO_PRICE else Decimal(price) / 100,
+            )
+            for pk, expiry, quantity, price in zip(self.ids, self.expiry, self.quantity, self.price)
+        ]
+
+    def patched(self, version, deltas):
+        """A copy with ``{batch_id: delta}`` applied, or ``None`` if a batch is not in the list."""
+        rows = list(zip(self.ids, self.expiry, self.quantity, self.price))
+        index = {pk: i for i, pk in enumerate(self.ids)}
+        for pk, delta in deltas.items():
+            if pk not in index:
+                return None  # back in stock: its expiry and price are not cached
+            row = rows[index[pk]]
+            rows[index[pk]] = (row[0], row[1], row[2] + delta, row[3])
+        # Still as old as the load: writes of other processes are not in the deltas.
+        return BatchList(version, [row for row in rows if row[2] > 0], self.loaded_at)
+
+
+def _shared():
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def _read_versions(product_ids):
+    if not _shared():
+        with _lock:
+            return {pk: _local_versions.get(pk, 0) for pk in product_ids}
+    keys = {VERSION_KEY.format(pk): pk for pk in product_ids}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        # Random start, so an evicted version never comes back with an old number.
+        cache.add(key, random.getrandbits(48), None)
+        found[key] = cache.get(key)
+    return {pk: found[key] for key, pk in keys.items()}
+
+
+def _bump_versions(product_ids):
+    """Increment the versions; ``{pk: new version or None}`` (``None``: no previous version)."""
+    versions = {}
+    if not _shared():
+        with _lock:
+            for pk in product_ids:
+                versions[pk] = _local_versions[pk] = _local_versions.get(pk, 0) + 1
+        return versions
+    for pk in product_ids:
+        try:
+            versions[pk] = cache.incr(VERSION_KEY.format(pk))
+        except ValueError:
+            versions[pk] = None
+    return versions
+
+
+def _load(product_ids, versions):
+    rows = {pk: [] for pk in product_ids}
+    queryset = (
+        Batch.objects.filter(product_id__in=product_ids, quantity__gt=0)
+        .order_by("product_id", "expiry_date", "id")
+        .values_list("product_id", "id", "expiry_date", "quantity", "sale_price")
+    )
+    for product_id, pk, expiry, quantity, price in queryset:
+        rows[product_id].append((pk, expiry.toordinal(), quantity, NO_PRICE if price is None else int(price * 100)))
+    return {pk: BatchList(versions[pk], product_rows) for pk, product_rows in rows.items()}
+
+
+def _store(pk, entry):
+    _entries[pk] = entry
+    _entries.move_to_end(pk)
+    while len(_entries) > capacity():
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def get_many(product_ids):
+    """``{product_id: BatchList}`` for every id, loading the missing or stale ones in one query."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    versions = _read_versions(product_ids)  # before loading, so a concurrent write reads as stale
+    expired = time.monotonic() - max_age()
+    found = {}
+    missing = []
+    with _lock:
+        for pk in product_ids:
+            entry = _entries.get(pk)
+            if entry is not None and entry.version == versions[pk] and entry.loaded_at > expired:
+                _entries.move_to_end(pk)
+                found[pk] = entry
+                _stats["hits"] += 1
+            else:
+                missing.append(pk)
+                _stats["misses"] += 1
+                if entry is not None:
+                    _stats["stale"] += 1
+    if missing:
+        loaded = _load(missing, versions)
+        with _lock:
+            for pk, entry in loaded.items():
+                _store(pk, entry)
+        found.update(loaded)
+    return found
+
+
+def _apply_deltas(batch_deltas, batch_products):
+    by_product = {}
+    for pk, delta in batch_deltas.items():
+        by_product.setdefault(batch_products[pk], {})[pk] = delta
+    versions = _bump_versions(by_product)
+    with _lock:
+        for product_id, deltas in by_product.items():
+            entry = _entries.get(product_id)
+            if entry is None:
+                continue
+            version = versions[product_id]
+            patched = None
+            if version is not None and entry.version == version - 1:
+                patched = entry.patched(version, deltas)
+            if patched is None:
+                del _entries[product_id]
+                _stats["invalidations"] += 1
+            else:
+                _entries[product_id] = patched
+                _stats["patches"] += 1
+
+
+def apply_deltas(batch_deltas, batch_products):
+    """Patch cached quantities by ``{batch_id: delta}`` once the current transaction commits.
+
+    ``batch_products`` maps each batch id to its product id.
+    """
+    batch_deltas = {pk: delta for pk, delta in batch_deltas.items() if delta}
+    if batch_deltas:
+        transaction.on_commit(lambda: _apply_deltas(batch_deltas, batch_products))
+
+
+def _drop(product_ids):
+    with _lock:
+        for pk in product_ids:
+            if _entries.pop(pk, None) is not None:
+                _stats["invalidations"] += 1
+
+
+def invalidate(product_ids):
+    """Forget the products' batches now and make every process reload them after commit."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    _drop(product_ids)
+    # Rows a read reloads before the commit carry the old version.
+    transaction.on_commit(lambda: _bump_versions(product_ids))
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _stats.clear()
+
+
+def stats():
+    """Hit/miss counters of this process."""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "size": len(_entries),
+            "capacity": capacity(),
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "stale": _stats["stale"],
+            "patches": _stats["patches"],
+            "invalidations": _stats["invalidations"],
+            "evictions": _stats["evictions"],
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+def annotate(products):
+    """Set ``stock``, ``fefo_batch``, ``fefo_expiry`` and ``fefo_price`` on ``products`` from the cache.
+
+    The same attributes ``with_stock_summary`` annotates, without its
+    per-row subqueries; ``stock`` stays the stored ``stock_on_hand``.
+    """
+    entries = get_many(product.pk for product in products)
+    for product in products:
+        fefo = entries[product.pk].fefo() or (None, None, None)
+        product.stock = product.stock_on_hand
+        product.fefo_batch, product.fefo_expiry, product.fefo_price = fefo
+    return products
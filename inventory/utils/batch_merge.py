@@ -0,0 +1,84 @@
+"""Merging duplicate batches: rows with the same product, batch number and expiry.
+
+Before receiving upserted into existing batches, every delivery of a
+batch created a new row. Each group of duplicates is folded into its
+oldest row: the quantities are added to it, every reference to the
+duplicates (stock movements, purchase and sale items, snapshot and stock
+take lines) is repointed to it in bulk, and the duplicates are deleted.
+Stock on hand does not change, and the ledger of the kept batch still
+adds up to its quantity. The kept batches get a new ``updated_at``, so POS
+catalog deltas resend their products, and the products' cached batch
+lists are invalidated.
+
+Migration 0011 did the same once, on its historical models, before adding
+the uniqueness constraint; keep the two in step.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Min, Q, Value, When, Window
+from django.utils import timezone
+
+from inventory.models import Batch, StockMovement, StockSnapshotLine, StockTakeLine
+from inventory.utils import batch_cache
+from purchases.models import PurchaseItem
+from sales.models import SaleItem
+
+CHUNK_SIZE = 500
+REFERENCES = [StockMovement, PurchaseItem, SaleItem]
+# Models with one line per (parent, batch): merged lines add up these fields.
+LINES = [
+    (StockSnapshotLine, "snapshot", ["quantity"]),
+    (StockTakeLine, "stock_take", ["expected_quantity", "counted_quantity"]),
+]
+
+
+def find_duplicates():
+    """``[(duplicate_id, kept_id, product_id, quantity)]`` for every batch that repeats an older one."""
+    oldest = Window(Min("id"), partition_by=[F("product_id"), F("batch_number"), F("expiry_date")])
+    return list(
+        Batch.objects.annotate(kept=oldest).filter(~Q(kept=F("id")))
+        .order_by("id").values_list("id", "kept", "product_id", "quantity")
+    )
+
+
+def _remap(field, remap):
+    return Case(*[When(**{field: old}, then=Value(new)) for old, new in remap.items()], output_field=IntegerField())
+
+
+def _merge_lines(model, parent, summed, remap):
+    lines = model.objects.filter(batch_id__in=[*remap, *set(remap.values())])
+    merged = {}
+    for line in lines:
+        key = (getattr(line, f"{parent}_id"), remap.get(line.batch_id, line.batch_id))
+        if key in merged:
+            for field in summed:
+                setattr(merged[key], field, getattr(merged[key], field) + getattr(line, field))
+        else:
+            line.pk = None
+            line.batch_id = key[1]
+            merged[key] = line
+    lines.delete()
+    model.objects.bulk_create(merged.values())
+
+
+def merge_duplicates(duplicates):
+    """Fold ``find_duplicates`` rows into their kept batches; returns the product ids touched."""
+    with transaction.atomic():
+        for start in range(0, len(duplicates), CHUNK_SIZE):
+            chunk = duplicates[start:start + CHUNK_SIZE]
+            remap = {pk: kept for pk, kept, _, _ in chunk}
+            added = {}
+            for _, kept, _, quantity in chunk:
+                added[kept] = added.get(kept, 0) + quantity
+            Batch.objects.filter(pk__in=added).update(
+                quantity=F("quantity") + _remap("pk", added), updated_at=timezone.now(),
+            )
+            for model in REFERENCES:
+                model.objects.filter(batch_id__in=remap).update(batch_id=_remap("batch_id", remap))
+            for model, parent, summed in LINES:
+                _merge_lines(model, parent, summed, remap)
+            # Emptied first, so deleting them releases no stock
+            Batch.objects.filter(pk__in=remap).update(quantity=0)
+            Batch.objects.filter(pk__in=remap).delete()
+        products = {product_id for _, _, product_id, _ in duplicates}
+        batch_cache.invalidate(products)
+    return products
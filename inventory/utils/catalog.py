@@ -0,0 +1,126 @@
+"""Delta feed of the sellable catalog for POS terminals.
+
+A terminal keeps the catalog in browser storage and asks only for what
+changed since its cursor. A product has changed when its own
+``updated_at`` or one of its batches' moved past the cursor, because stock
+and the FEFO price live on batches. Deleted products come back as
+tombstones.
+
+The cursor handed out is the sync start time minus ``CURSOR_OVERLAP``, so
+a write that committed after the sync started but carries an older
+``updated_at`` is still picked up next time. Rows sent twice are simply
+upserted again by the client.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from inventory.models import Batch, Product, ProductTombstone
+from core.utils.pagination import cached_count
+from inventory.utils.stock import with_stock_summary
+
+CATALOG_FIELDS = ["id", "name", "brand", "stock", "price", "expiry", "tax"]
+CURSOR_OVERLAP = timedelta(seconds=30)
+PAGE_SIZE = 1000
+PURGE_INTERVAL_SECONDS = 3600
+VERSION_KEY = "inventory:catalog:version"
+
+
+def _retention():
+    return timedelta(days=getattr(settings, "POS_CATALOG_TOMBSTONE_DAYS", 30))
+
+
+def catalog_version():
+    cache.add(VERSION_KEY, 1, None)
+    return cache.get(VERSION_KEY) or 1
+
+
+def bump_catalog_version():
+    """Invalidate cached product counts; called by the Product, Brand and Category signals.
+
+    Bulk writes that skip signals (``bulk_create``, ``QuerySet.update`` of
+    names) must call this themselves.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def product_count(queryset, query=""):
+    """Count of ``queryset`` for the product list, cached until the catalog changes.
+
+    The version only reaches other workers with a shared cache backend, so
+    a count is also kept for at most ``PRODUCT_COUNT_CACHE_SECONDS`` (default 60).
+    """
+    digest = hashlib.md5(query.strip().lower().encode()).hexdigest()
+    timeout = getattr(settings, "PRODUCT_COUNT_CACHE_SECONDS", 60)
+    return cached_count(f"inventory:product_count:{catalog_version()}:{digest}", queryset, timeout)
+
+
+def parse_cursor(value):
+    if not value:
+        return None
+    cursor = parse_datetime(value)
+    if cursor is None:
+        raise ValueError("Invalid catalog cursor.")
+    return cursor if timezone.is_aware(cursor) else timezone.make_aware(cursor)
+
+
+def purge_tombstones(force=False):
+    """Drop tombstones older than the retention window; at most once an hour unless ``force``."""
+    if force or cache.add("inventory:catalog:purge", 1, PURGE_INTERVAL_SECONDS):
+        cutoff = timezone.now() - _retention()
+        return ProductTombstone.objects.filter(deleted_at__lt=cutoff).delete()[0]
+    return 0
+
+
+def catalog_row(product):
+    """One product as a list in ``CATALOG_FIELDS`` order; needs ``with_stock_summary``."""
+    return [
+        product.id,
+        product.name,
+        product.brand.name,
+        product.stock,
+        float(product.fefo_price or 0),
+        product.fefo_expiry.isoformat() if product.fefo_expiry else None,
+        float(product.tax_percentage),
+    ]
+
+
+def catalog_page(since=None, after=0, limit=PAGE_SIZE):
+    """Return one page of the catalog changes since ``since``, in id order after ``after``.
+
+    Without ``since``, or with one older than the tombstone retention, the
+    page is part of a full reload (``reset``) and the client must drop
+    products it does not receive. ``cursor`` is only set on the first page
+    (``after == 0``); the client stores it once ``next_after`` is ``None``.
+    """
+    started = timezone.now()
+    reset = since is None or since < started - _retention()
+    queryset = Product.objects.select_related("brand")
+    if not reset:
+        changed_batches = Batch.objects.filter(updated_at__gt=since).values("product_id")
+        queryset = queryset.filter(Q(updated_at__gt=since) | Q(id__in=changed_batches))
+    products = list(with_stock_summary(queryset.filter(id__gt=after).order_by("id"))[:limit + 1])
+    has_more = len(products) > limit
+    products = products[:limit]
+
+    deleted = []
+    if not reset and not after:
+        deleted = list(
+            ProductTombstone.objects.filter(deleted_at__gt=since).values_list("product_id", flat=True)
+        )
+    return {
+        "reset": reset,
+        "fields": CATALOG_FIELDS,
+        "products": [catalog_row(product) for product in products],
+        "deleted": deleted,
+        "next_after": products[-1].id if has_more else None,
+        "cursor": None if after else (started - CURSOR_OVERLAP).isoformat(),
+    }
@@ -0,0 +1,304 @@
+"""Streaming import of products, brands, categories and opening stock.
+
+Rows are read one at a time from a CSV file or an XLSX sheet (openpyxl in
+read-only mode) and written in chunks of ``CHUNK_SIZE``, each chunk in its
+own transaction: one lookup query for the chunk's existing products and
+one ``bulk_create`` each for new products, batches (an upsert, see
+``receive_batches``) and their ``OPENING`` stock movements. Brands and categories are resolved through an in-memory
+name cache. Only the current chunk and the first ``MAX_ERRORS`` errors are
+kept in memory, so memory use stays flat however long the file is.
+
+A product is identified by its brand and generic name (case-insensitive);
+rows naming an existing product only add a batch to it, and rows naming
+a batch that exists add to its quantity. Bad rows are reported with their
+line number and skipped.
+"""
+import codecs
+import csv
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils.dateparse import parse_date
+from openpyxl import load_workbook
+
+from core.utils.transactions import write_atomic
+from inventory.models import Batch, Brand, Category, Product, StockMovement
+from inventory.utils.catalog import bump_catalog_version
+from inventory.utils.stock import receive_batches
+
+CENT = Decimal("0.01")
+CHUNK_SIZE = 1000
+MAX_ERRORS = 1000
+REQUIRED_COLUMNS = ("name", "brand", "category")
+BATCH_COLUMNS = ("batch_number", "expiry_date", "purchase_price", "sale_price", "quantity")
+COLUMN_ALIASES = {
+    "generic_name": "name",
+    "tax": "tax_percentage",
+    "tax_%": "tax_percentage",
+    "batch": "batch_number",
+    "expiry": "expiry_date",
+    "qty": "quantity",
+}
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.products_created = 0
+        self.batches_created = 0
+        self.batches_merged = 0
+        self.brands_created = 0
+        self.categories_created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return (
+            f"{self.rows} rows: {self.products_created} products, {self.batches_created} batches, "
+            f"{self.brands_created} brands and {self.categories_created} categories created, "
+            f"{self.batches_merged} batch rows added to existing batches, {self.error_count} rows skipped"
+        )
+
+
+class NameCache:
+    """Case-insensitive ``name -> id`` map of the Brand or Category table."""
+
+    def __init__(self, model):
+        self.model = model
+        self.created = 0
+        self.ids = {}
+        for pk, name in model.objects.order_by("id").values_list("id", "name"):
+            self.ids.setdefault(name.strip().lower(), pk)
+
+    def resolve(self, names):
+        """Create the names not seen yet; returns the full map."""
+        missing = {}
+        for name in names:
+            missing.setdefault(name.lower(), name)
+        missing = {key: name for key, name in missing.items() if key not in self.ids}
+        if missing:
+            created = self.model.objects.bulk_create([self.model(name=name) for name in missing.values()])
+            self.ids.update((key, obj.pk) for key, obj in zip(missing, created))
+            self.created += len(created)
+        return self.ids
+
+
+def _column(header):
+    key = "_".join(str(header or "").strip().lower().split())
+    return COLUMN_ALIASES.get(key, key)
+
+
+def _header(values, required):
+    header = [_column(value) for value in values]
+    missing = [column for column in required if column not in header]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}.")
+    return header
+
+
+def _csv_rows(file, required):
+    reader = csv.reader(codecs.iterdecode(file, "utf-8-sig"))
+    header = _header(next(reader, []), required)
+    for line, values in enumerate(reader, start=2):
+        if any(value.strip() for value in values):
+            yield line, dict(zip(header, values))
+
+
+def _xlsx_rows(file, required):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = _header(next(rows, ()), required)
+        for line, values in enumerate(rows, start=2):
+            if any(value not in (None, "") for value in values):
+                yield line, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_rows(file, filename, required=REQUIRED_COLUMNS):
+    """Yield ``(line_number, {column: value})`` from a binary CSV or XLSX file."""
+    if filename.lower().endswith(".xlsx"):
+        return _xlsx_rows(file, required)
+    if filename.lower().endswith(".csv"):
+        return _csv_rows(file, required)
+    raise ValueError("Upload a .csv or .xlsx file.")
+
+
+def _text(row, column, max_length):
+    value = row.get(column)
+    value = "" if value is None else str(value).strip()
+    if len(value) > max_length:
+        raise ValueError(f"{column} is longer than {max_length} characters.")
+    return value
+
+
+def _decimal(row, column, default=None):
+    value = row.get(column)
+    if value is None or str(value).strip() == "":
+        return default
+    try:
+        value = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"{column} must be a number.")
+    if not value.is_finite():
+        raise ValueError(f"{column} must be a number.")
+    if value < 0:
+        raise ValueError(f"{column} must not be negative.")
+    return value
+
+
+def _money(row, column, default=None):
+    value = _decimal(row, column, default)
+    return value if value is None else value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _date(row, column):
+    value = row.get(column)
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        parsed = parse_date(str(value or "").strip())
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"{column} must be a date (YYYY-MM-DD).")
+    return parsed
+
+
+def clean_row(row):
+    """Validate one row; returns ``(product_fields, batch_fields or None)``."""
+    product = {
+        "name": _text(row, "name", 200),
+        "brand": _text(row, "brand", 100),
+        "category": _text(row, "category", 100),
+        "company": _text(row, "company", 100),
+        "description": _text(row, "description", 10000),
+        "tax_percentage": _money(row, "tax_percentage", Decimal("0")),
+    }
+    for column in REQUIRED_COLUMNS:
+        if not product[column]:
+            raise ValueError(f"{column} is required.")
+    if product["tax_percentage"] > 100:
+        raise ValueError("tax_percentage must be between 0 and 100.")
+    if not any(str(row.get(column) or "").strip() for column in BATCH_COLUMNS):
+        return product, None
+
+    quantity = _decimal(row, "quantity", Decimal("0"))
+    if quantity != quantity.to_integral_value():
+        raise ValueError("quantity must be a whole number.")
+    batch = {
+        "batch_number": _text(row, "batch_number", 50),
+        "expiry_date": _date(row, "expiry_date"),
+        "purchase_price": _money(row, "purchase_price"),
+        "sale_price": _money(row, "sale_price"),
+        "quantity": int(quantity),
+    }
+    if not batch["batch_number"]:
+        raise ValueError("batch_number is required for opening stock.")
+    if batch["purchase_price"] is None:
+        raise ValueError("purchase_price is required for opening stock.")
+    for column in ("purchase_price", "sale_price"):
+        if batch[column] is not None and batch[column] >= 10 ** 8:
+            raise ValueError(f"{column} is too large.")
+    return product, batch
+
+
+def _write_chunk(chunk, brands, categories, result, reference):
+    brand_ids = brands.resolve({product["brand"] for product, _ in chunk})
+    category_ids = categories.resolve({product["category"] for product, _ in chunk})
+    rows = [
+        ((brand_ids[product["brand"].lower()], product["name"].lower()), product, batch)
+        for product, batch in chunk
+    ]
+
+    product_ids = {}
+    existing = (
+        Product.objects.annotate(key=Lower("name"))
+        .filter(brand_id__in={key[0] for key, _, _ in rows}, key__in={key[1] for key, _, _ in rows})
+        .order_by("id")
+        .values_list("id", "brand_id", "key")
+    )
+    for pk, brand_id, name in existing:
+        product_ids.setdefault((brand_id, name), pk)
+
+    stock = {}
+    for key, _, batch in rows:
+        if batch:
+            stock[key] = stock.get(key, 0) + batch["quantity"]
+
+    # New products start with this chunk's stock; existing ones are adjusted below.
+    new_products = {}
+    for key, product, _ in rows:
+        if key not in product_ids and key not in new_products:
+            new_products[key] = Product(
+                brand_id=key[0],
+                category_id=category_ids[product["category"].lower()],
+                name=product["name"],
+                company=product["company"],
+                description=product["description"],
+                tax_percentage=product["tax_percentage"],
+                stock_on_hand=stock.get(key, 0),
+            )
+    Product.objects.bulk_create(new_products.values())
+    product_ids.update((key, product.pk) for key, product in new_products.items())
+
+    # A batch already in stock (an earlier file, a rerun) gets the quantity added.
+    created = set()
+    batches = receive_batches(
+        [Batch(product_id=product_ids[key], **batch) for key, _, batch in rows if batch],
+        StockMovement.OPENING,
+        reference,
+        stocked_products={product.pk for product in new_products.values()},
+        created=created,
+    )
+
+    result.products_created += len(new_products)
+    result.batches_created += len(created)
+    result.batches_merged += len(batches) - len(created)
+    result.brands_created = brands.created
+    result.categories_created = categories.created
+
+
+def import_catalog(rows, reference="Import", chunk_size=CHUNK_SIZE, progress=None):
+    """Import ``(line, row)`` pairs from ``read_rows``; ``progress(result)`` runs after each chunk.
+
+    Chunks already written stay written if a later one fails; rerunning the
+    same file then finds the products and batches again but adds their
+    quantities twice.
+    """
+    result = ImportResult()
+    brands = NameCache(Brand)
+    categories = NameCache(Category)
+    chunk = []
+
+    def flush():
+        with write_atomic():
+            _write_chunk(chunk, brands, categories, result, reference[:100])
+            transaction.on_commit(bump_catalog_version)
+        chunk.clear()
+        if progress:
+            progress(result)
+
+    for line, row in rows:
+        result.rows += 1
+        try:
+            product, batch = clean_row(row)
+        except ValueError as exc:
+            result.add_error(line, str(exc))
+            continue
+        chunk.append((product, batch))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return result
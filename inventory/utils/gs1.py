@@ -0,0 +1,108 @@
+"""Parsing of scanned barcodes: plain GTINs and GS1 element strings.
+
+A plain EAN-8, UPC-A, EAN-13 or GTIN-14 is normalized to 14 digits, so the
+same trade item matches however the pack is labelled. GS1-128, GS1
+DataMatrix and GS1 QR codes carry application identifiers (AIs) after the
+GTIN; the ones a pharmacy needs are read here: ``01`` GTIN, ``10`` lot,
+``17`` expiry and ``21`` serial number. Both the raw form (variable-length
+fields ended by the ASCII group separator) and the bracketed human-readable
+form ``(01)...(17)...(10)...`` are accepted.
+"""
+import calendar
+import re
+from collections import namedtuple
+from datetime import date
+
+GROUP_SEPARATOR = "\x1d"
+
+# Fixed lengths of the AIs that can precede a variable-length field.
+FIXED_LENGTHS = {"00": 18, "01": 14, "02": 14, "11": 6, "12": 6, "13": 6, "15": 6, "16": 6, "17": 6, "20": 2}
+VARIABLE_AIS = {"10": 20, "21": 20, "22": 20, "30": 8, "37": 8, "240": 30, "241": 30}
+
+_SYMBOLOGY_PREFIX = re.compile(r"^\][A-Za-z]\d")
+_BRACKETED = re.compile(r"\((\d{2,4})\)([^(]*)")
+
+Scan = namedtuple("Scan", ["code", "gtin", "lot", "expiry", "serial"])
+
+
+def check_digit_ok(digits):
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+
+def normalize_gtin(code):
+    """GTIN-14 for an 8, 12, 13 or 14 digit code with a valid check digit, else ``None``."""
+    if code.isdigit() and len(code) in (8, 12, 13, 14) and check_digit_ok(code):
+        return code.zfill(14)
+    return None
+
+
+def barcode_key(code):
+    """The form barcodes are stored and looked up in."""
+    code = (code or "").strip()
+    return normalize_gtin(code) or code
+
+
+def parse_expiry(value):
+    """``YYMMDD``; day ``00`` means the last day of the month."""
+    if not (len(value) == 6 and value.isdigit()):
+        return None
+    year, month, day = 2000 + int(value[:2]), int(value[2:4]), int(value[4:])
+    if not 1 <= month <= 12:
+        return None
+    if day == 0:
+        day = calendar.monthrange(year, month)[1]
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _raw_elements(data):
+    elements = {}
+    while data:
+        ai = data[:2]
+        if ai in FIXED_LENGTHS:
+            length = FIXED_LENGTHS[ai]
+            elements[ai] = data[2:2 + length]
+            data = data[2 + length:].lstrip(GROUP_SEPARATOR)
+            continue
+        ai = next((key for key in (data[:3], data[:2]) if key in VARIABLE_AIS), None)
+        if ai is None:
+            break  # an AI we do not know the length of; keep what was read
+        value, _, data = data[len(ai):].partition(GROUP_SEPARATOR)
+        elements[ai] = value[:VARIABLE_AIS[ai]]
+    return elements
+
+
+def parse_elements(data):
+    """``{ai: value}`` of a GS1 element string, raw or bracketed."""
+    data = _SYMBOLOGY_PREFIX.sub("", data.strip())
+    if data.startswith("("):
+        return {ai: value.strip(GROUP_SEPARATOR) for ai, value in _BRACKETED.findall(data)}
+    return _raw_elements(data)
+
+
+def is_element_string(code):
+    code = _SYMBOLOGY_PREFIX.sub("", code.strip())
+    return code.startswith("(01)") or (code.startswith("01") and len(code) > 16)
+
+
+def parse_scan(code):
+    """Split what a scanner sent into ``Scan(code, gtin, lot, expiry, serial)``.
+
+    ``code`` is the lookup key: the GTIN-14 when there is one, otherwise the
+    scanned text as is (an in-store code).
+    """
+    code = (code or "").strip()
+    if not is_element_string(code):
+        return Scan(barcode_key(code), normalize_gtin(code), None, None, None)
+    elements = parse_elements(code)
+    gtin = normalize_gtin(elements.get("01", ""))
+    return Scan(
+        gtin or barcode_key(elements.get("01", code)),
+        gtin,
+        elements.get("10") or None,
+        parse_expiry(elements.get("17", "")),
+        elements.get("21") or None,
+    )
@@ -0,0 +1,40 @@
+"""Resolving a barcode scan to a product, its FEFO batch and price.
+
+The lookup is a single query: the barcode's unique index finds the row,
+the product and brand are joined and the FEFO batch (price, expiry) and the
+scanned lot come from correlated subqueries on the product's batches.
+"""
+from django.db.models import F, OuterRef, Subquery
+
+from inventory.models import Batch, Product
+from inventory.utils.gs1 import parse_scan
+from inventory.utils.stock import with_stock_summary
+
+
+def resolve_scan(raw):
+    """Return ``(scan, product)``; ``product`` is ``None`` for an unknown code.
+
+    The product is annotated like ``with_stock_summary`` plus
+    ``pack_quantity`` of the scanned barcode, ``fefo_batch`` and, when the
+    code carries a lot, ``lot_batch`` / ``lot_quantity`` / ``lot_expiry``.
+    """
+    scan = parse_scan(raw)
+    if not scan.code:
+        return scan, None
+    fefo = Batch.objects.filter(product=OuterRef("pk"), quantity__gt=0).order_by("expiry_date", "id")
+    queryset = (
+        with_stock_summary(Product.objects.select_related("brand"))
+        .filter(barcodes__code=scan.code)
+        .annotate(pack_quantity=F("barcodes__pack_quantity"), fefo_batch=Subquery(fefo.values("id")[:1]))
+    )
+    if scan.lot:
+        lot = Batch.objects.filter(product=OuterRef("pk"), batch_number=scan.lot)
+        if scan.expiry:
+            lot = lot.filter(expiry_date=scan.expiry)
+        lot = lot.order_by("-quantity", "id")
+        queryset = queryset.annotate(
+            lot_batch=Subquery(lot.values("id")[:1]),
+            lot_quantity=Subquery(lot.values("quantity")[:1]),
+            lot_expiry=Subquery(lot.values("expiry_date")[:1]),
+        )
+    return scan, queryset.first()
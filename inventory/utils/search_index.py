@@ -0,0 +1,155 @@
+"""Full-text product search backed by SQLite FTS5 shadow tables.
+
+The tables are created by ``inventory/migrations/0002_product_search_index.py``
+and kept in sync by triggers on the product, brand and category tables, so
+every write path (forms, admin, ``bulk_create``, raw updates) updates the
+index. On databases without FTS5 the search falls back to ``icontains``.
+Whether the tables exist is checked once per process, and again after a
+search against them fails.
+"""
+import re
+
+from django.db import OperationalError, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from inventory.models import Product
+
+PREFIX_TABLE = "inventory_product_fts"
+TRIGRAM_TABLE = "inventory_product_fts_trigram"
+
+# bm25() weights for the indexed columns: name, brand, category, company.
+COLUMN_WEIGHTS = (10.0, 8.0, 2.0, 2.0)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_available = {}
+
+
+def index_available(using="default"):
+    if using not in _available:
+        connection = connections[using]
+        if connection.vendor != "sqlite":
+            _available[using] = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)",
+                    [PREFIX_TABLE, TRIGRAM_TABLE],
+                )
+                _available[using] = cursor.fetchone()[0] == 2
+    return _available[using]
+
+
+def _tokens(query):
+    return _TOKEN_RE.findall((query or "").lower())
+
+
+def prefix_match_expression(query):
+    """Every token must match the start of a word: ``pana 500`` -> ``"pana"* "500"*``."""
+    return " ".join(f'"{token}"*' for token in _tokens(query))
+
+
+def trigram_match_expression(query):
+    """Substring match for tokens of three or more characters."""
+    return " ".join(f'"{token}"' for token in _tokens(query) if len(token) >= 3)
+
+
+def _ranked_ids(cursor, table, expression, limit, exclude=()):
+    weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+    sql = f"SELECT rowid FROM {table} WHERE {table} MATCH %s"
+    params = [expression]
+    if exclude:
+        sql += f" AND rowid NOT IN ({', '.join(['%s'] * len(exclude))})"
+        params.extend(exclude)
+    sql += f" ORDER BY bm25({table}, {weights}) LIMIT %s"
+    params.append(limit)
+    cursor.execute(sql, params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def search_product_ids(query, limit=20, using="default"):
+    """Return ranked product ids for ``query``, or ``None`` if the index is unavailable.
+
+    Word-prefix hits rank first; when they do not fill ``limit`` the trigram
+    table adds substring hits (the old ``icontains`` behaviour) after them.
+    """
+    if not index_available(using):
+        return None
+    expression = prefix_match_expression(query)
+    if not expression:
+        return []
+    try:
+        with connections[using].cursor() as cursor:
+            ids = _ranked_ids(cursor, PREFIX_TABLE, expression, limit)
+            trigram_expression = trigram_match_expression(query)
+            if len(ids) < limit and trigram_expression:
+                ids += _ranked_ids(cursor, TRIGRAM_TABLE, trigram_expression, limit - len(ids), exclude=ids)
+    except OperationalError:
+        # The tables may be gone (a restored database): check again next time.
+        _available.pop(using, None)
+        return None
+    return ids
+
+
+def legacy_filter(queryset, query):
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(brand__name__icontains=query) |
+        Q(category__name__icontains=query) |
+        Q(company__icontains=query)
+    )
+
+
+def filter_products(queryset, query):
+    """Narrow ``queryset`` to every product matching ``query``, unranked.
+
+    Used where results are listed in their own order (the paginated
+    product list); the match runs inside the product query as a subquery.
+    """
+    query = (query or "").strip()
+    if not query:
+        return queryset
+    if not index_available(queryset.db):
+        return legacy_filter(queryset, query)
+    expression = prefix_match_expression(query)
+    if not expression:
+        return queryset.none()
+    sql = f"SELECT rowid FROM {PREFIX_TABLE} WHERE {PREFIX_TABLE} MATCH %s"
+    params = [expression]
+    # Substring hits only when every token can be matched as trigrams;
+    # dropping the short ones would widen the filter instead of adding to it.
+    if all(len(token) >= 3 for token in _tokens(query)):
+        trigram_expression = trigram_match_expression(query)
+        sql += f" UNION SELECT rowid FROM {TRIGRAM_TABLE} WHERE {TRIGRAM_TABLE} MATCH %s"
+        params.append(trigram_expression)
+    return queryset.filter(id__in=RawSQL(sql, params))
+
+
+def search_products(query, queryset=None, limit=20):
+    """Return up to ``limit`` products matching ``query``, best match first."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    query = (query or "").strip()
+    if not query:
+        return list(queryset.order_by("id")[:limit])
+    ids = search_product_ids(query, limit=limit, using=queryset.db)
+    if ids is None:
+        return list(legacy_filter(queryset, query)[:limit])
+    products = queryset.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
+
+
+def rebuild_index(using="default"):
+    """Repopulate both FTS tables from the catalog. Returns the number of products indexed."""
+    select = (
+        "SELECT p.id, p.name, b.name, c.name, p.company FROM inventory_product p "
+        "JOIN inventory_brand b ON b.id = p.brand_id "
+        "JOIN inventory_category c ON c.id = p.category_id"
+    )
+    with connections[using].cursor() as cursor:
+        for table in (PREFIX_TABLE, TRIGRAM_TABLE):
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"INSERT INTO {table}(rowid, name, brand, category, company) {select}")
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {PREFIX_TABLE}")
+        return cursor.fetchone()[0]
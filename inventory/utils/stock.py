@@ -0,0 +1,201 @@
+"""Stock helpers shared by the inventory, sales and purchase views."""
+from collections import defaultdict
+
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import Batch, Product, StockMovement
+from inventory.utils import batch_cache
+
+
+class StockChanged(Exception):
+    """A batch no longer holds the stock a movement takes out of it; plan the movements again."""
+
+
+def batch_total():
+    """Subquery summing the outer product's batch quantities."""
+    total = (
+        Batch.objects.filter(product=OuterRef("pk")).order_by()
+        .values("product").annotate(total=Sum("quantity")).values("total")
+    )
+    return Coalesce(Subquery(total), 0)
+
+
+def with_stock_summary(queryset):
+    """Annotate products with ``stock`` and their FEFO batch's ``fefo_price`` / ``fefo_expiry``.
+
+    FEFO (first expired, first out) is the in-stock batch with the earliest
+    expiry date, the same order the sale allocation consumes batches in.
+    """
+    fefo = Batch.objects.filter(product=OuterRef("pk"), quantity__gt=0).order_by("expiry_date", "id")
+    return queryset.annotate(
+        stock=F("stock_on_hand"),
+        fefo_price=Subquery(fefo.values("sale_price")[:1]),
+        fefo_expiry=Subquery(fefo.values("expiry_date")[:1]),
+    )
+
+
+def adjust_stock_on_hand(deltas):
+    """Add ``{product_id: delta}`` to ``Product.stock_on_hand`` with one conditional UPDATE."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    return Product.objects.filter(pk__in=deltas).update(
+        stock_on_hand=F("stock_on_hand") + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            output_field=IntegerField(),
+        ),
+    )
+
+
+def stock_drift():
+    """Products whose stored ``stock_on_hand`` differs from their batches: ``[(id, stored, actual)]``."""
+    return list(
+        Product.objects.annotate(actual=batch_total())
+        .exclude(stock_on_hand=F("actual"))
+        .order_by("id")
+        .values_list("id", "stock_on_hand", "actual")
+    )
+
+
+def apply_movements(movements):
+    """Write unsaved StockMovements and apply them to batch quantities.
+
+    Every path that changes ``Batch.quantity`` in bulk goes through here,
+    so the ledger, the batches and ``Product.stock_on_hand`` always move
+    together: one INSERT for the movements, one conditional UPDATE for the
+    batches (``F()`` increments, so concurrent writers never overwrite each
+    other) and one for the products. Cached FEFO batch lists are patched
+    once the transaction commits. Call inside ``transaction.atomic``.
+
+    A batch is only taken from while it still holds what is taken, so the
+    UPDATE is safe even where the batches were read without a row lock
+    (``select_for_update`` does nothing on SQLite); if any batch fell short,
+    ``StockChanged`` is raised and the transaction must be rolled back.
+    """
+    movements = [movement for movement in movements if movement.quantity]
+    if not movements:
+        return []
+    StockMovement.objects.bulk_create(movements)
+    batch_deltas = defaultdict(int)
+    product_deltas = defaultdict(int)
+    batch_products = {}
+    for movement in movements:
+        batch_deltas[movement.batch_id] += movement.quantity
+        product_deltas[movement.product_id] += movement.quantity
+        batch_products[movement.batch_id] = movement.product_id
+    enough = Q(pk__in=[pk for pk, delta in batch_deltas.items() if delta > 0])
+    for pk, delta in batch_deltas.items():
+        if delta < 0:
+            enough |= Q(pk=pk, quantity__gte=-delta)
+    updated = Batch.objects.filter(enough).update(
+        quantity=F("quantity") + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in batch_deltas.items()],
+            output_field=IntegerField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    if updated != len([delta for delta in batch_deltas.values() if delta]):
+        raise StockChanged("Stock changed while it was being updated; please try again.")
+    adjust_stock_on_hand(product_deltas)
+    batch_cache.apply_deltas(batch_deltas, batch_products)
+    return movements
+
+
+def apply_batch_deltas(deltas, movement_type=StockMovement.ADJUSTMENT, reference=""):
+    """Add ``{batch_id: delta}`` to batch quantities, recorded as one movement per batch."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    products = dict(Batch.objects.filter(pk__in=deltas).values_list("id", "product_id"))
+    return apply_movements([
+        StockMovement(
+            batch_id=pk, product_id=products[pk], quantity=delta,
+            movement_type=movement_type, reference=reference,
+        )
+        for pk, delta in deltas.items() if pk in products
+    ])
+
+
+def batch_key(batch):
+    """The identity of a physical batch: product, batch number and expiry."""
+    return batch.product_id, batch.batch_number, batch.expiry_date
+
+
+def receive_batches(batches, movement_type, reference="", stocked_products=(), created=None):
+    """Add unsaved ``Batch`` rows to stock, merging rows into the batch they already are.
+
+    Rows with the same product, batch number and expiry as an existing
+    batch (or as each other) add their quantity to that one batch instead
+    of creating another. Existing batches take the prices of the last row
+    that re-delivers them (the sale price only when the row has one) and
+    get the quantity through ``apply_movements`` as atomic increments;
+    missing ones are inserted with their quantity, at the prices of their
+    first row (a concurrent insert of the same batch fails on the unique
+    constraint).
+    Returns the saved batch of each row, in order; their ``quantity`` is
+    not refreshed. ``stocked_products`` are products just created with
+    these rows' stock already in ``stock_on_hand``; the ids of the batches
+    inserted are added to the ``created`` set, if given. Call inside
+    ``transaction.atomic``.
+    """
+    keys = {batch_key(batch) for batch in batches}
+    saved = {}
+    if keys:
+        existing = Batch.objects.filter(
+            product_id__in={key[0] for key in keys}, batch_number__in={key[1] for key in keys},
+        ).values_list("product_id", "batch_number", "expiry_date", "id", "purchase_price", "sale_price")
+        for product_id, number, expiry, pk, purchase_price, sale_price in existing:
+            if (product_id, number, expiry) in keys:
+                saved[product_id, number, expiry] = Batch(
+                    id=pk, product_id=product_id, batch_number=number, expiry_date=expiry,
+                    purchase_price=purchase_price, sale_price=sale_price,
+                )
+    repriced = {}
+    for batch in batches:
+        old = saved.get(batch_key(batch))
+        if old is None:
+            continue
+        sale_price = old.sale_price if batch.sale_price is None else batch.sale_price
+        if (old.purchase_price, old.sale_price) != (batch.purchase_price, sale_price):
+            old.purchase_price, old.sale_price = batch.purchase_price, sale_price
+            repriced[old.pk] = old
+    if repriced:
+        now = timezone.now()
+        for batch in repriced.values():
+            batch.updated_at = now
+        Batch.objects.bulk_update(repriced.values(), ["purchase_price", "sale_price", "updated_at"])
+        # Cached batch lists carry the sale price
+        batch_cache.invalidate({batch.product_id for batch in repriced.values()})
+    new = {}
+    for batch in batches:
+        key = batch_key(batch)
+        if key in new:
+            new[key].quantity += batch.quantity
+        elif key not in saved:
+            new[key] = Batch(
+                product_id=batch.product_id, batch_number=batch.batch_number, expiry_date=batch.expiry_date,
+                purchase_price=batch.purchase_price, sale_price=batch.sale_price, quantity=batch.quantity,
+            )
+    Batch.objects.bulk_create(new.values())
+    saved.update(new)
+
+    received = [saved[batch_key(batch)] for batch in batches]
+    movements = [
+        StockMovement(
+            batch_id=batch.pk, product_id=batch.product_id, quantity=row.quantity,
+            movement_type=movement_type, reference=reference,
+        )
+        for row, batch in zip(batches, received) if row.quantity
+    ]
+    # New batches were inserted with their stock; only the ledger and products follow.
+    inserted = {batch.pk for batch in new.values()}
+    if created is not None:
+        created.update(inserted)
+    StockMovement.objects.bulk_create([movement for movement in movements if movement.batch_id in inserted])
+    stock = defaultdict(int)
+    for batch in new.values():
+        stock[batch.product_id] += batch.quantity
+    adjust_stock_on_hand({pk: quantity for pk, quantity in stock.items() if pk not in stocked_products})
+    batch_cache.invalidate(stock)
+    apply_movements([movement for movement in movements if movement.batch_id not in inserted])
+    return received
@@ -0,0 +1,250 @@
+"""Physical stock counts reconciled against batch quantities in bulk.
+
+A stock take covers one section of the store (a category, or everything)
+and collects counted quantities per batch from a count sheet, an uploaded
+CSV/XLSX file or barcode scans, over as many sessions as needed. Each line
+keeps the batch quantity at the moment it was counted, so the variance is
+``counted - expected`` and sales rung up while the count goes on are not
+mistaken for shrinkage.
+
+Variances are computed by the database for the whole stock take in one
+query. Applying writes them as ``STOCK_TAKE`` movements through
+``apply_movements`` in chunks, all in one transaction; keeping each stock
+take to a section keeps that transaction, and the batch locks it holds,
+short.
+"""
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, Q, Sum, When
+from django.utils import timezone
+
+from core.utils.transactions import write_atomic
+from inventory.models import Batch, StockMovement, StockTake, StockTakeLine
+from inventory.utils.catalog_import import MAX_ERRORS, read_rows
+from inventory.utils.scan import resolve_scan
+from inventory.utils.stock import apply_movements
+
+CHUNK_SIZE = 500
+COUNT_COLUMNS = ("counted",)
+SHEET_COLUMNS = ["batch_id", "product", "brand", "batch_number", "expiry_date", "counted"]
+
+
+def scope_batches(stock_take):
+    """Batches the stock take can count (empty ones too: stock may turn up)."""
+    batches = Batch.objects.all()
+    if stock_take.category_id:
+        batches = batches.filter(product__category_id=stock_take.category_id)
+    return batches
+
+
+def sheet_batches(stock_take):
+    """Batches to list on the count sheet: in stock, or counted already."""
+    return scope_batches(stock_take).filter(Q(quantity__gt=0) | Q(pk__in=stock_take.lines.values("batch_id")))
+
+
+def _check_open(stock_take):
+    if stock_take.status != StockTake.OPEN:
+        raise ValueError(f"{stock_take.name} has already been applied.")
+
+
+def record_counts(stock_take, counts):
+    """Save ``{batch_id: counted}``, replacing earlier counts of the same batches.
+
+    The expected quantity is each batch's quantity now. Returns the ids
+    that are not batches of the stock take's section (nothing is saved for
+    them).
+    """
+    _check_open(stock_take)
+    counts = {int(pk): int(counted) for pk, counted in counts.items()}
+    if any(counted < 0 for counted in counts.values()):
+        raise ValueError("Counts cannot be negative.")
+    ids = list(counts)
+    now = timezone.now()
+    unknown = []
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        expected = dict(scope_batches(stock_take).filter(pk__in=chunk).values_list("id", "quantity"))
+        unknown.extend(pk for pk in chunk if pk not in expected)
+        StockTakeLine.objects.bulk_create(
+            [
+                StockTakeLine(
+                    stock_take=stock_take, batch_id=pk, expected_quantity=quantity,
+                    counted_quantity=counts[pk], counted_at=now,
+                )
+                for pk, quantity in expected.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["stock_take", "batch"],
+            update_fields=["expected_quantity", "counted_quantity", "counted_at"],
+        )
+    return unknown
+
+
+def record_scan(stock_take, raw, packs=1):
+    """Add ``packs`` scanned packs to the count of the scanned batch; returns ``(batch_id, units)``.
+
+    The barcode must carry the lot (GS1) unless the product has a single
+    batch in the section. The first scan of a batch takes its expected
+    quantity; later scans only add to the count.
+    """
+    _check_open(stock_take)
+    scan, product = resolve_scan(raw)
+    if product is None:
+        raise ValueError(f"No product has barcode {scan.code or '(empty)'}.")
+    batches = scope_batches(stock_take).filter(product=product)
+    if scan.lot:
+        batches = batches.filter(pk=product.lot_batch)
+    candidates = list(batches.values_list("id", "quantity")[:2])
+    if not candidates:
+        lot = f" {scan.lot}" if scan.lot else ""
+        raise ValueError(f"No batch{lot} of {product.name} in this stock take.")
+    if len(candidates) > 1:
+        raise ValueError(f"{product.name} has several batches; scan a code with the lot number or use the count sheet.")
+    batch_id, quantity = candidates[0]
+    units = packs * product.pack_quantity
+    with write_atomic():
+        line, created = StockTakeLine.objects.select_for_update().get_or_create(
+            stock_take=stock_take, batch_id=batch_id,
+            defaults={"expected_quantity": quantity, "counted_quantity": units},
+        )
+        if not created:
+            StockTakeLine.objects.filter(pk=line.pk).update(
+                counted_quantity=F("counted_quantity") + units, counted_at=timezone.now(),
+            )
+    return batch_id, units
+
+
+def _batch_ids_by_number(stock_take, numbers):
+    """``{batch_number: id}`` for numbers naming exactly one batch of the section."""
+    found = {}
+    numbers = list(numbers)
+    for start in range(0, len(numbers), CHUNK_SIZE):
+        rows = scope_batches(stock_take).filter(batch_number__in=numbers[start:start + CHUNK_SIZE])
+        for number, pk in rows.values_list("batch_number", "id"):
+            found[number] = None if number in found else pk
+    return found
+
+
+def _whole(value):
+    """A whole number from a cell (``"12"``, ``12`` or ``12.0``); ``ValueError`` otherwise."""
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError
+    return int(number)
+
+
+def import_counts(stock_take, file, filename):
+    """Record counts from a CSV/XLSX file with ``counted`` and ``batch_id`` or ``batch_number``.
+
+    Returns ``(saved, errors)`` where ``errors`` lists ``(line, message)``
+    for skipped rows, at most ``MAX_ERRORS`` of them.
+    """
+    _check_open(stock_take)
+    errors = []
+    rows = []
+    for line, row in read_rows(file, filename, required=COUNT_COLUMNS):
+        batch_id = str(row.get("batch_id") or "").strip()
+        number = str(row.get("batch_number") or "").strip()
+        counted = "" if row.get("counted") is None else str(row["counted"]).strip()
+        if counted == "":
+            continue  # not counted yet
+        try:
+            counted = _whole(counted)
+            if counted < 0:
+                raise ValueError
+        except ValueError:
+            errors.append((line, "counted must be a whole number, 0 or more."))
+            continue
+        if batch_id:
+            try:
+                rows.append((line, _whole(batch_id), None, counted))
+            except ValueError:
+                errors.append((line, "batch_id must be a number."))
+        elif number:
+            rows.append((line, None, number, counted))
+        else:
+            errors.append((line, "batch_id or batch_number is required."))
+
+    by_number = _batch_ids_by_number(stock_take, {number for _, _, number, _ in rows if number})
+    counts = {}
+    lines = {}
+    for line, batch_id, number, counted in rows:
+        if number:
+            batch_id = by_number.get(number)
+            if batch_id is None:
+                message = "matches several batches; use batch_id." if number in by_number else "is not in this stock take."
+                errors.append((line, f"Batch {number} {message}"))
+                continue
+        counts[batch_id] = counted
+        lines[batch_id] = line
+    for batch_id in record_counts(stock_take, counts):
+        errors.append((lines[batch_id], f"Batch {batch_id} is not in this stock take."))
+        del counts[batch_id]
+    errors.sort()
+    return len(counts), errors[:MAX_ERRORS]
+
+
+def variances(stock_take):
+    """The stock take's lines with ``variance`` (counted - expected) and its ``value`` at cost."""
+    variance = F("counted_quantity") - F("expected_quantity")
+    return stock_take.lines.annotate(
+        variance=ExpressionWrapper(variance, output_field=IntegerField()),
+        value=ExpressionWrapper(variance * F("batch__purchase_price"), output_field=DecimalField(max_digits=14, decimal_places=2)),
+    )
+
+
+def summary(stock_take):
+    """Counts and totals of the stock take in one aggregate query."""
+    lines = variances(stock_take)
+    totals = lines.aggregate(
+        counted=Count("id"),
+        changed=Count("id", filter=~Q(variance=0)),
+        units_over=Sum(Case(When(variance__gt=0, then="variance"), default=0)),
+        units_short=Sum(Case(When(variance__lt=0, then="variance"), default=0)),
+        value_over=Sum(Case(When(variance__gt=0, then="value"), default=0, output_field=DecimalField())),
+        value_short=Sum(Case(When(variance__lt=0, then="value"), default=0, output_field=DecimalField())),
+    )
+    totals["in_scope"] = sheet_batches(stock_take).count()
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def apply_stock_take(stock_take):
+    """Write every variance as a ``STOCK_TAKE`` movement, in one transaction.
+
+    A batch that sold more since it was counted than the count leaves is
+    set to zero rather than below. Returns the number of batches adjusted.
+    """
+    reference = f"Stock take #{stock_take.pk}"
+    adjusted = 0
+    with write_atomic():
+        stock_take.status = StockTake.objects.select_for_update().values_list("status", flat=True).get(pk=stock_take.pk)
+        _check_open(stock_take)
+        changes = list(
+            variances(stock_take).exclude(variance=0).order_by("batch_id")
+            .values_list("batch_id", "batch__product_id", "variance")
+        )
+        for start in range(0, len(changes), CHUNK_SIZE):
+            chunk = changes[start:start + CHUNK_SIZE]
+            current = dict(
+                Batch.objects.select_for_update().filter(pk__in=[pk for pk, _, _ in chunk]).values_list("id", "quantity")
+            )
+            adjusted += len(apply_movements([
+                StockMovement(
+                    batch_id=pk, product_id=product_id, movement_type=StockMovement.STOCK_TAKE,
+                    quantity=max(variance, -current[pk]), reference=reference,
+                )
+                for pk, product_id, variance in chunk
+            ]))
+        stock_take.status = StockTake.APPLIED
+        stock_take.applied_at = timezone.now()
+        stock_take.save(update_fields=["status", "applied_at"])
+    return adjusted
+
+
+def count_sheet_rows(stock_take):
+    """Rows of a downloadable count sheet (``SHEET_COLUMNS``) for the section, counts filled in."""
+    counted = dict(stock_take.lines.values_list("batch_id", "counted_quantity"))
+    batches = (
+        sheet_batches(stock_take).order_by("product__name", "expiry_date", "id")
+        .values_list("id", "product__name", "product__brand__name", "batch_number", "expiry_date")
+    )
+    for pk, product, brand, number, expiry in batches.iterator(chunk_size=2000):
+        yield [pk, product, brand, number, expiry.isoformat(), counted.get(pk, "")]
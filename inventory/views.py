@@ -1,19 +1,47 @@
+import csv
+from itertools import chain
+
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q
-from .models import Product, Batch
-from .forms import ProductForm, BatchForm
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import ProtectedError
+from django.http import JsonResponse, StreamingHttpResponse
+from .models import Product, Batch, StockMovement, StockTake
+from .forms import ProductForm, BatchForm, StockTakeForm
+from .utils import batch_cache
+from .utils.catalog import product_count
+from .utils.catalog_import import import_catalog, read_rows
+from .utils.search_index import filter_products, search_products
+from .utils.stock import receive_batches
+from .utils import stock_take as stock_takes
+from core.utils.pagination import keyset_page
+from core.utils.transactions import write_atomic
 from django.contrib import messages
 
+PRODUCTS_PER_PAGE = 50
+PRODUCT_ORDER = ('name', 'id')
+SHEET_PER_PAGE = 50
+SHEET_ORDER = ('product__name', 'expiry_date', 'id')
+VARIANCE_ORDER = ('batch__product__name', 'id')
+
 def product_list(request):
     query = (request.GET.get('q') or '').strip()
-    products = Product.objects.all().select_related('brand', 'category')
-    if query:
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(brand__name__icontains=query) |
-            Q(category__name__icontains=query)
+    # stock_on_hand is a column, so stock comes with the page query itself
+    products = filter_products(Product.objects.select_related('brand', 'category'), query)
+    try:
+        page = keyset_page(
+            products, PRODUCT_ORDER,
+            after=request.GET.get('after'), before=request.GET.get('before'), per_page=PRODUCTS_PER_PAGE,
         )
-    return render(request, 'inventory/product_list.html', {'products': products, 'query': query})
+    except ValueError:
+        # A stale or hand-edited cursor starts over at the first page
+        page = keyset_page(products, PRODUCT_ORDER, per_page=PRODUCTS_PER_PAGE)
+    context = {
+        'products': page.items,
+        'page': page,
+        'total_count': product_count(products, query),
+        'query': query,
+    }
+    return render(request, 'inventory/product_list.html', context)
 
 def product_create(request):
     if request.method == 'POST':
@@ -41,7 +69,11 @@ def product_edit(request, pk):
 def product_delete(request, pk):
     product = get_object_or_404(Product, pk=pk)
     if request.method == 'POST':
-        product.delete()
+        try:
+            product.delete()
+        except ProtectedError:
+            messages.error(request, 'This product has stock history and cannot be deleted.')
+            return redirect('product_list')
         messages.success(request, 'Product deleted successfully.')
         return redirect('product_list')
     return render(request, 'inventory/product_confirm_delete.html', {'product': product})
@@ -53,9 +85,164 @@ def add_stock(request, pk):
         if form.is_valid():
             batch = form.save(commit=False)
             batch.product = product
-            batch.save()
+            # Adds to the batch if this product already has it (same number and expiry)
+            with write_atomic():
+                receive_batches([batch], StockMovement.MANUAL, reference=f'Manual: {batch.batch_number}')
             messages.success(request, f'Stock added to {product.name} successfully.')
             return redirect('product_list')
     else:
         form = BatchForm()
     return render(request, 'inventory/batch_form.html', {'form': form, 'product': product})
+
+def product_autocomplete(request):
+    """Up to 10 products matching ``q`` from the search index, for product pickers."""
+    query = request.GET.get('q', '').strip()
+    if len(query) < 2:
+        return JsonResponse({'results': []})
+    products = search_products(query, queryset=Product.objects.select_related('brand'), limit=10)
+    return JsonResponse({'results': [{'id': p.id, 'label': f'{p.name} ({p.brand.name})'} for p in products]})
+
+def catalog_import(request):
+    result = None
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        if not upload:
+            messages.error(request, 'Choose a CSV or XLSX file to import.')
+        else:
+            try:
+                result = import_catalog(read_rows(upload, upload.name), reference=f'Import: {upload.name}')
+            except ValueError as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, f'Imported {result.summary()}.')
+    return render(request, 'inventory/catalog_import.html', {'result': result})
+
+@staff_member_required
+def batch_cache_stats(request):
+    """Hit/miss counters of this worker's FEFO batch cache."""
+    return JsonResponse(batch_cache.stats())
+
+def stock_take_list(request):
+    if request.method == 'POST':
+        form = StockTakeForm(request.POST)
+        if form.is_valid():
+            stock_take = form.save()
+            return redirect('stock_take_detail', pk=stock_take.pk)
+    else:
+        form = StockTakeForm()
+    takes = StockTake.objects.select_related('category').order_by('-created_at', '-id')[:100]
+    return render(request, 'inventory/stock_take_list.html', {'form': form, 'stock_takes': takes})
+
+def _posted_counts(request):
+    """``count_<batch id>`` fields of the count sheet that were filled in; returns ``(counts, errors)``."""
+    counts = {}
+    errors = []
+    for name, value in request.POST.items():
+        if not name.startswith('count_') or not value.strip():
+            continue
+        try:
+            counts[int(name[len('count_'):])] = int(value)
+        except ValueError:
+            errors.append(f'"{value}" is not a whole number.')
+    return counts, errors
+
+def _record_posted(request, stock_take):
+    """Save counts from the sheet, an uploaded file or a scan; returns upload errors to list."""
+    action = request.POST.get('action')
+    if action == 'sheet':
+        counts, errors = _posted_counts(request)
+        if not errors:
+            try:
+                stock_takes.record_counts(stock_take, counts)
+            except ValueError as exc:
+                errors = [str(exc)]
+        for error in errors:
+            messages.error(request, error)
+        if not errors:
+            messages.success(request, f'{len(counts)} count{"s" if len(counts) != 1 else ""} saved.')
+    elif action == 'upload':
+        upload = request.FILES.get('file')
+        if not upload:
+            messages.error(request, 'Choose a CSV or XLSX file to upload.')
+            return []
+        try:
+            saved, errors = stock_takes.import_counts(stock_take, upload, upload.name)
+        except ValueError as exc:
+            messages.error(request, str(exc))
+            return []
+        messages.success(request, f'{saved} counts saved from {upload.name}.')
+        return errors
+    elif action == 'scan':
+        try:
+            packs = int(request.POST.get('packs') or 1)
+            batch_id, units = stock_takes.record_scan(stock_take, request.POST.get('code', ''), packs)
+        except ValueError as exc:
+            messages.error(request, str(exc) or 'Packs must be a whole number.')
+        else:
+            messages.success(request, f'Batch {batch_id}: {units} units added to the count.')
+    return []
+
+def stock_take_detail(request, pk):
+    """Count sheet of a stock take, a page at a time, with file upload and scanning."""
+    stock_take = get_object_or_404(StockTake.objects.select_related('category'), pk=pk)
+    errors = []
+    if request.method == 'POST' and stock_take.status == StockTake.OPEN:
+        errors = _record_posted(request, stock_take)
+        if not errors:
+            return redirect(request.get_full_path())
+
+    batches = stock_takes.sheet_batches(stock_take).select_related('product__brand')
+    try:
+        page = keyset_page(
+            batches, SHEET_ORDER,
+            after=request.GET.get('after'), before=request.GET.get('before'), per_page=SHEET_PER_PAGE,
+        )
+    except ValueError:
+        page = keyset_page(batches, SHEET_ORDER, per_page=SHEET_PER_PAGE)
+    counted = dict(
+        stock_take.lines.filter(batch__in=[b.pk for b in page.items]).values_list('batch_id', 'counted_quantity')
+    )
+    context = {
+        'stock_take': stock_take,
+        'summary': stock_takes.summary(stock_take),
+        'page': page,
+        'rows': [(batch, counted.get(batch.pk)) for batch in page.items],
+        'errors': errors,
+    }
+    return render(request, 'inventory/stock_take_detail.html', context)
+
+class _Echo:
+    def write(self, value):
+        return value
+
+def stock_take_sheet(request, pk):
+    """The section's count sheet as CSV, to fill in and upload back."""
+    stock_take = get_object_or_404(StockTake, pk=pk)
+    writer = csv.writer(_Echo())
+    rows = chain([stock_takes.SHEET_COLUMNS], stock_takes.count_sheet_rows(stock_take))
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="stock-take-{stock_take.pk}.csv"'
+    return response
+
+def stock_take_preview(request, pk):
+    """Every variance of a stock take; applying writes them all in one transaction."""
+    stock_take = get_object_or_404(StockTake.objects.select_related('category'), pk=pk)
+    if request.method == 'POST':
+        try:
+            adjusted = stock_takes.apply_stock_take(stock_take)
+        except ValueError as exc:
+            messages.error(request, str(exc))
+        else:
+            messages.success(request, f'{stock_take.name} applied: {adjusted} batches adjusted.')
+        return redirect('stock_take_detail', pk=stock_take.pk)
+
+    lines = stock_takes.variances(stock_take).exclude(variance=0).select_related('batch__product__brand')
+    try:
+        page = keyset_page(
+            lines, VARIANCE_ORDER,
+            after=request.GET.get('after'), before=request.GET.get('before'), per_page=SHEET_PER_PAGE,
+        )
+    except ValueError:
+        page = keyset_page(lines, VARIANCE_ORDER, per_page=SHEET_PER_PAGE)
+    context = {'stock_take': stock_take, 'summary': stock_takes.summary(stock_take), 'page': page}
+    return render(request, 'inventory/stock_take_preview.html', context)
@@ -82,6 +82,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.pharmacy2',
+        # Writers wait up to 20s for the write lock instead of failing with "database is locked".
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 # DATABASES = {
@@ -139,3 +143,13 @@ MEDIA_ROOT = BASE_DIR / 'media'
 LOGIN_URL = '/auth/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/auth/login/'
+
+# Sales invoice numbers: INV-000123, or INV-2026-000123 when numbering restarts every year.
+SALES_INVOICE_PREFIX = 'INV'
+SALES_INVOICE_YEARLY = False
+
+# How long a POS idempotency key replays its original sale.
+SALES_IDEMPOTENCY_TTL_HOURS = 24
+
+# POS catalogs that last synced longer ago than this reload the whole catalog.
+POS_CATALOG_TOMBSTONE_DAYS = 30
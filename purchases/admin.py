@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Supplier, PurchaseInvoice, PurchaseItem
+from .models import Supplier, PurchaseInvoice, PurchaseItem, SupplierProductCost
 
 @admin.register(Supplier)
 class SupplierAdmin(admin.ModelAdmin):
@@ -18,3 +18,10 @@ class PurchaseInvoiceAdmin(admin.ModelAdmin):
     list_filter = ('supplier', 'date')
     search_fields = ('invoice_number', 'supplier__name')
     inlines = [PurchaseItemInline]
+
+@admin.register(SupplierProductCost)
+class SupplierProductCostAdmin(admin.ModelAdmin):
+    list_display = ('product', 'supplier', 'unit_price', 'purchased_on', 'invoice')
+    list_filter = ('supplier',)
+    search_fields = ('product__name', 'supplier__name')
+    raw_id_fields = ('product', 'invoice')
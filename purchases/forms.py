@@ -1,7 +1,10 @@
 from django import forms
 from decimal import Decimal
+from django.urls import reverse
+from django.utils.html import format_html
 from .models import Supplier, PurchaseInvoice, PurchaseItem
-from django.forms import inlineformset_factory
+from inventory.models import Product
+from django.forms import BaseInlineFormSet, inlineformset_factory
 
 class SupplierForm(forms.ModelForm):
     class Meta:
@@ -25,15 +28,51 @@ class PurchaseInvoiceForm(forms.ModelForm):
             'note': forms.Textarea(attrs={'class': 'form-control', 'rows': 2}),
         }
 
+class PurchaseImportForm(PurchaseInvoiceForm):
+    file = forms.FileField(widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'}))
+
+class ProductAutocomplete(forms.HiddenInput):
+    """The product id, plus a search box that fills it in; renders no list of products."""
+
+    def __init__(self, attrs=None):
+        super().__init__(attrs)
+        self.labels = {}
+
+    def render(self, name, value, attrs=None, renderer=None):
+        hidden = super().render(name, value, attrs, renderer)
+        label = self.labels.get(str(value), '') if value else ''
+        return format_html(
+            '{}<input type="text" class="form-control product-autocomplete" value="{}" autocomplete="off" '
+            'placeholder="Search product..." data-url="{}" data-target="{}">',
+            hidden, label, reverse('product_autocomplete'), (attrs or {}).get('id', ''),
+        )
+
+class ProductChoiceField(forms.ModelChoiceField):
+    """Resolves ids from ``products`` when the formset loaded them, instead of one query per row."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.products = {}
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.products[int(value)]
+        except (KeyError, ValueError, TypeError):
+            return super().to_python(value)
+
 class PurchaseItemForm(forms.ModelForm):
+    # Not a Meta field, so model validation skips its per-row existence query
+    product = ProductChoiceField(queryset=Product.objects.all(), widget=ProductAutocomplete())
+
     class Meta:
         model = PurchaseItem
         fields = [
-            'product', 'batch_number', 'expiry_date', 'quantity',
+            'batch_number', 'expiry_date', 'quantity',
             'unit_price', 'sale_price', 'discount_percentage', 'tax_percentage',
         ]
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control'}),
             'batch_number': forms.TextInput(attrs={'class': 'form-control'}),
             'expiry_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),
@@ -49,6 +88,8 @@ class PurchaseItemForm(forms.ModelForm):
         self.fields['tax_percentage'].required = False
         self.fields['discount_percentage'].initial = Decimal('0')
         self.fields['tax_percentage'].initial = Decimal('0')
+        if self.instance.product_id:
+            self.initial.setdefault('product', self.instance.product_id)
 
     def clean_discount_percentage(self):
         value = self.cleaned_data.get('discount_percentage')
@@ -58,9 +99,33 @@ class PurchaseItemForm(forms.ModelForm):
         value = self.cleaned_data.get('tax_percentage')
         return value if value is not None else Decimal('0')
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('product'):
+            self.instance.product = cleaned_data['product']
+        return cleaned_data
+
+class BasePurchaseItemFormSet(BaseInlineFormSet):
+    def full_clean(self):
+        # Load every posted product in one query before the rows validate.
+        if self.is_bound:
+            ids = set()
+            for form in self.forms:
+                try:
+                    ids.add(int(form.data.get(form.add_prefix('product'))))
+                except (TypeError, ValueError):
+                    pass
+            products = Product.objects.select_related('brand').in_bulk(ids)
+            labels = {str(pk): f'{product.name} ({product.brand.name})' for pk, product in products.items()}
+            for form in self.forms:
+                form.fields['product'].products = products
+                form.fields['product'].widget.labels = labels
+        super().full_clean()
+
 PurchaseItemFormSet = inlineformset_factory(
     PurchaseInvoice, PurchaseItem,
     form=PurchaseItemForm,
+    formset=BasePurchaseItemFormSet,
     extra=1,
     can_delete=True,
 )
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from purchases.models import PurchaseInvoice, Supplier
+from purchases.utils.invoice_import import CHUNK_SIZE, import_invoice, read_invoice_rows
+
+
+class Command(BaseCommand):
+    help = "Receive a supplier's purchase invoice from a CSV or XLSX file, one row per line."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="A .csv or .xlsx file with a header row.")
+        parser.add_argument("--supplier", required=True, help="Supplier id or exact name.")
+        parser.add_argument("--invoice-number", required=True, help="The supplier's invoice number.")
+        parser.add_argument("--date", help="Invoice date (YYYY-MM-DD), today by default.")
+        parser.add_argument("--dry-run", action="store_true", help="Check and total the lines without saving.")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Lines written per batch of queries.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        supplier = options["supplier"]
+        suppliers = Supplier.objects.filter(pk=supplier) if supplier.isdigit() else Supplier.objects.filter(name=supplier)
+        supplier = suppliers.first()
+        if supplier is None:
+            raise CommandError(f"No supplier {options['supplier']}.")
+        if PurchaseInvoice.objects.filter(invoice_number=options["invoice_number"]).exists():
+            raise CommandError(f"Invoice {options['invoice_number']} already exists.")
+        day = timezone.localdate()
+        if options["date"]:
+            try:
+                day = parse_date(options["date"])
+            except ValueError:
+                day = None
+            if day is None:
+                raise CommandError("--date must be a date (YYYY-MM-DD).")
+
+        invoice = PurchaseInvoice(supplier=supplier, invoice_number=options["invoice_number"], date=day)
+        try:
+            with open(path, "rb") as file:
+                result = import_invoice(
+                    invoice, read_invoice_rows(file, path),
+                    dry_run=options["dry_run"], chunk_size=options["chunk_size"],
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        for line, message in result.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more errors.")
+        if result.saved:
+            self.stdout.write(self.style.SUCCESS(f"Imported {invoice}: {result.summary()}."))
+        elif result.error_count:
+            raise CommandError(f"Nothing saved: {result.summary()}.")
+        else:
+            self.stdout.write(f"Dry run, nothing saved: {result.summary()}.")
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-18 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_last_costs(apps, schema_editor):
+    """Start the table from the latest purchase of each product from each supplier."""
+    PurchaseItem = apps.get_model('purchases', 'PurchaseItem')
+    SupplierProductCost = apps.get_model('purchases', 'SupplierProductCost')
+    latest = {}
+    items = (
+        PurchaseItem.objects.order_by('invoice__date', 'id')
+        .values_list('invoice__supplier_id', 'product_id', 'unit_price', 'invoice__date', 'invoice_id')
+    )
+    for supplier_id, product_id, unit_price, day, invoice_id in items.iterator():
+        latest[supplier_id, product_id] = (unit_price, day, invoice_id)
+    SupplierProductCost.objects.bulk_create(
+        (
+            SupplierProductCost(
+                supplier_id=supplier_id, product_id=product_id,
+                unit_price=unit_price, purchased_on=day, invoice_id=invoice_id,
+            )
+            for (supplier_id, product_id), (unit_price, day, invoice_id) in latest.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_batch_unique_number_expiry'),
+        ('purchases', '0002_purchase_invoice_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchaseitem',
+            index=models.Index(fields=['product', '-id'], name='purchase_item_history_idx'),
+        ),
+        migrations.CreateModel(
+            name='SupplierProductCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('purchased_on', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='purchases.purchaseinvoice')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='supplier_costs', to='inventory.product')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_costs', to='purchases.supplier')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('supplier', 'product'), name='unique_supplier_product_cost')],
+            },
+        ),
+        migrations.RunPython(backfill_last_costs, migrations.RunPython.noop),
+    ]
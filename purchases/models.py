@@ -1,7 +1,7 @@
 from django.db import models
 from inventory.models import Product, Batch
 from django.utils import timezone
-from decimal import Decimal
+from core.utils.pricing import apply_pricing
 
 class Supplier(models.Model):
     name = models.CharField(max_length=200)
@@ -26,7 +26,13 @@ class PurchaseInvoice(models.Model):
     note = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date'], name='purchase_invoice_date_idx'),
+            models.Index(fields=['supplier', 'date'], name='purchase_invoice_supplier_idx'),
+        ]
+
     def __str__(self):
         return f"INV-{self.invoice_number} ({self.supplier.name})"
 
@@ -59,38 +65,30 @@ class PurchaseItem(models.Model):
         # Basic calculation (can be overridden by JS frontend, but good for safety)
         # Gross = qty * unit_price
         # Disc = Gross * (disc_perc / 100) OR fixed amount
-        # Tax = (Gross - Disc) * (tax_perc / 100)
+        # Tax = (Gross - Disc) * (tax_perc / 100) OR fixed amount
         # Total = Gross - Disc + Tax
-        
-        # Ensure all inputs are Decimal
-        qty = Decimal(self.quantity or 0)
-        u_price = Decimal(self.unit_price or 0)
-        d_perc = Decimal(self.discount_percentage or 0)
-        d_amt = Decimal(self.discount_amount or 0)
-        t_perc = Decimal(self.tax_percentage or 0)
-        t_amt = Decimal(self.tax_amount or 0)
-        
-        gross = qty * u_price
-        
-        # Priority: if amount is set manually, use it. Else calc from percent.
-        if d_amt == 0 and d_perc > 0:
-            d_amt = gross * (d_perc / Decimal(100))
-        
-        # Write back calculated/casted to model
-        self.discount_percentage = d_perc
-        self.discount_amount = d_amt
-            
-        taxable_amount = gross - d_amt
-        
-        if t_amt == 0 and t_perc > 0:
-            t_amt = taxable_amount * (t_perc / Decimal(100))
-        
-        # Write back calculated/casted to model
-        self.tax_percentage = t_perc
-        self.tax_amount = t_amt
-            
-        self.total_amount = taxable_amount + t_amt
+        # Shared with bulk inserts, see core.utils.pricing
+        apply_pricing(self)
         super().save(*args, **kwargs)
 
+    class Meta:
+        # Price history: a product's purchases, newest first
+        indexes = [models.Index(fields=['product', '-id'], name='purchase_item_history_idx')]
+
     def __str__(self):
         return f"{self.product.name} - {self.quantity} qty"
+
+class SupplierProductCost(models.Model):
+    """What we last paid a supplier for a product, kept up to date when purchases are received."""
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='product_costs')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='supplier_costs')
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    purchased_on = models.DateField()
+    invoice = models.ForeignKey(PurchaseInvoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['supplier', 'product'], name='unique_supplier_product_cost')]
+
+    def __str__(self):
+        return f"{self.product} from {self.supplier}: {self.unit_price}"
@@ -1,3 +1,283 @@
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from openpyxl import Workbook
+
+from inventory.models import Batch, Brand, Category, Product, ProductBarcode, StockMovement
+from .models import PurchaseInvoice, Supplier, SupplierProductCost
+from .utils.invoice_import import import_invoice, read_invoice_rows
+
+
+class PurchaseCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        cls.products = [
+            Product.objects.create(brand=brand, category=category, name=f'Paracetamol {i}') for i in range(5)
+        ]
+        cls.supplier = Supplier.objects.create(name='Alpha Pharma')
+
+    def post(self, number, lines, day='2026-10-01'):
+        data = {
+            'supplier': self.supplier.pk, 'invoice_number': number, 'date': day, 'note': '',
+            'items-TOTAL_FORMS': len(lines), 'items-INITIAL_FORMS': 0,
+        }
+        for i, (product, quantity, price, discount, *lot) in enumerate(lines):
+            data.update({
+                f'items-{i}-product': product.pk, f'items-{i}-batch_number': lot[0] if lot else f'{number}-{i}',
+                f'items-{i}-expiry_date': '2028-01-01', f'items-{i}-quantity': quantity,
+                f'items-{i}-unit_price': price, f'items-{i}-sale_price': '9.00',
+                f'items-{i}-discount_percentage': discount, f'items-{i}-tax_percentage': '5',
+            })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('purchase_create'), data)
+        return response, len(queries)
+
+    def test_invoice_received_in_bulk(self):
+        response, _ = self.post('P-1', [
+            (self.products[0], 10, '3.33', '10'),
+            (self.products[1], 4, '7.25', '0'),
+            (self.products[0], 6, '3.50', '0'),
+        ])
+        self.assertEqual(response.status_code, 302)
+        invoice = PurchaseInvoice.objects.get(invoice_number='P-1')
+        items = list(invoice.items.order_by('id'))
+        self.assertEqual([item.total_amount for item in items], [Decimal('31.47'), Decimal('30.45'), Decimal('22.05')])
+        self.assertEqual(invoice.sub_total, Decimal('83.30'))
+        self.assertEqual(invoice.total_discount, Decimal('3.33'))
+        self.assertEqual(invoice.grand_total, sum(item.total_amount for item in items))
+        self.assertEqual([item.batch.quantity for item in items], [10, 4, 6])
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_on_hand, 16)
+        self.assertEqual(StockMovement.objects.filter(movement_type=StockMovement.PURCHASE, reference='P-1').count(), 3)
+
+    def test_redelivered_batch_is_merged(self):
+        self.post('P-1', [(self.products[0], 10, '3.00', '0', 'LOT7')])
+        self.post('P-2', [(self.products[0], 5, '3.20', '0', 'LOT7'), (self.products[0], 1, '3.20', '0', 'LOT7')])
+        batch = Batch.objects.get()
+        self.assertEqual((batch.quantity, batch.purchase_price), (16, Decimal('3.20')))  # the latest delivery's price
+        self.assertEqual(batch.purchase_items.count(), 3)
+        self.assertEqual(StockMovement.objects.filter(batch=batch).count(), 3)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_on_hand, 16)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        _, one = self.post('P-1', [(self.products[0], 1, '1.00', '0')])
+        _, five = self.post('P-5', [(product, 1, '1.00', '0') for product in self.products])
+        self.assertEqual(one, five)
+        self.assertEqual(Batch.objects.count(), 6)
+
+    def test_form_lists_no_products(self):
+        response = self.client.get(reverse('purchase_create'))
+        self.assertNotContains(response, 'Paracetamol')
+        self.assertContains(response, 'product-autocomplete')
+
+        # Errors redisplay the chosen product by name.
+        data = {
+            'supplier': self.supplier.pk, 'invoice_number': '', 'date': '2026-10-01',
+            'items-TOTAL_FORMS': 1, 'items-INITIAL_FORMS': 0, 'items-0-product': self.products[2].pk,
+        }
+        self.assertContains(self.client.post(reverse('purchase_create'), data), 'Paracetamol 2 (Panadol)')
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('product_autocomplete'), {'q': 'parac'})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertEqual(self.client.get(reverse('product_autocomplete'), {'q': 'p'}).json(), {'results': []})
+
+    def test_last_costs(self):
+        cache.clear()
+        url = reverse('last_cost_api')
+        params = {'supplier': self.supplier.pk, 'products': f'{self.products[0].pk},{self.products[1].pk}'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('P-1', [(self.products[0], 1, '3.00', '0'), (self.products[0], 1, '3.10', '0')])
+        self.assertEqual(self.client.get(url, params).json()['results'], {
+            str(self.products[0].pk): {'unit_price': '3.10', 'date': '2026-10-01', 'invoice': 'P-1'},
+        })
+        with self.assertNumQueries(0):
+            self.client.get(url, params)
+
+        # A back-dated invoice does not replace a newer cost; a later one does.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post('P-0', [(self.products[0], 1, '2.00', '0')], day='2026-09-01')
+            self.post('P-2', [(self.products[1], 1, '7.00', '0')], day='2026-10-05')
+        results = self.client.get(url, params).json()['results']
+        self.assertEqual(results[str(self.products[0].pk)]['unit_price'], '3.10')
+        self.assertEqual(results[str(self.products[1].pk)]['unit_price'], '7.00')
+        self.assertEqual(SupplierProductCost.objects.count(), 2)
+        self.assertEqual(self.client.get(url, {'supplier': 'x'}).status_code, 400)
+
+    def test_price_history(self):
+        for i in range(3):
+            self.post(f'P-{i}', [(self.products[0], 1, f'{i + 1}.00', '0')])
+        other = Supplier.objects.create(name='Zeta Traders')
+        self.supplier, supplier = other, self.supplier
+        self.post('Z-1', [(self.products[0], 1, '9.00', '0')])
+
+        url = reverse('price_history', args=[self.products[0].pk])
+        response = self.client.get(url)
+        self.assertEqual([item.invoice.invoice_number for item in response.context['page'].items], ['Z-1', 'P-2', 'P-1', 'P-0'])
+        self.assertContains(response, 'Zeta Traders')
+        response = self.client.get(url, {'supplier': supplier.pk})
+        self.assertEqual(len(response.context['page'].items), 3)
+
+
+class PurchaseListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.alpha = Supplier.objects.create(name='Alpha Pharma')
+        cls.zeta = Supplier.objects.create(name='Zeta Traders')
+        for i in range(5):
+            PurchaseInvoice.objects.create(
+                supplier=cls.alpha, invoice_number=f'A-{i}', date=today - timedelta(days=i), grand_total=Decimal('10.50'),
+            )
+        PurchaseInvoice.objects.create(supplier=cls.zeta, invoice_number='Z-1', date=today, grand_total=Decimal('99.00'))
+        PurchaseInvoice.objects.create(
+            supplier=cls.zeta, invoice_number='Z-OLD', date=today - timedelta(days=90), grand_total=Decimal('1.00'),
+        )
+
+    def test_list_pages_and_subtotals(self):
+        url = reverse('purchase_list')
+        response = self.client.get(url)
+        # The last 30 days by default, newest first; totals come from the invoices, not their items
+        numbers = [invoice.invoice_number for invoice in response.context['page'].items]
+        self.assertEqual(numbers, ['Z-1', 'A-0', 'A-1', 'A-2', 'A-3', 'A-4'])
+        self.assertEqual(
+            [(row['supplier__name'], row['invoices'], row['total']) for row in response.context['subtotals']],
+            [('Zeta Traders', 1, Decimal('99.00')), ('Alpha Pharma', 5, Decimal('52.50'))],
+        )
+        self.assertEqual(response.context['grand_total'], Decimal('151.50'))
+
+        response = self.client.get(url, {'supplier': self.zeta.pk, 'start': '2000-01-01'})
+        self.assertEqual([invoice.invoice_number for invoice in response.context['page'].items], ['Z-1', 'Z-OLD'])
+        response = self.client.get(url, {'start': 'bad', 'after': 'bad'})
+        self.assertEqual(len(response.context['page'].items), 6)
+
+    def test_api_cursor(self):
+        day = timezone.localdate() - timedelta(days=10)
+        PurchaseInvoice.objects.bulk_create([
+            PurchaseInvoice(supplier=self.alpha, invoice_number=f'B-{i:02}', date=day, grand_total=Decimal('1.00'))
+            for i in range(50)
+        ])
+        url = reverse('purchase_list_api')
+        first = self.client.get(url).json()
+        second = self.client.get(url, {'after': first['next']}).json()
+        back = self.client.get(url, {'before': second['previous']}).json()
+        self.assertEqual(len(first['results']), 50)
+        self.assertEqual([row['invoice_number'] for row in first['results'][:2]], ['Z-1', 'A-0'])
+        self.assertEqual([row['invoice_number'] for row in second['results']], ['B-05', 'B-04', 'B-03', 'B-02', 'B-01', 'B-00'])
+        self.assertIsNone(second['next'])
+        self.assertEqual(back['results'], first['results'])
+        self.assertEqual(first['results'][0]['grand_total'], '99.00')
+        self.assertEqual(
+            first['subtotals'],
+            [
+                {'supplier_id': self.alpha.pk, 'supplier': 'Alpha Pharma', 'invoices': 55, 'total': '102.50'},
+                {'supplier_id': self.zeta.pk, 'supplier': 'Zeta Traders', 'invoices': 1, 'total': '99.00'},
+            ],
+        )
+
+
+class PurchaseImportTests(TestCase):
+    header = 'barcode,product,brand,batch_number,expiry_date,quantity,unit_price,discount_percentage,tax_percentage\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Analgesic')
+        panadol = Brand.objects.create(name='Panadol')
+        calpol = Brand.objects.create(name='Calpol')
+        cls.panadol = Product.objects.create(brand=panadol, category=category, name='Paracetamol')
+        cls.calpol = Product.objects.create(brand=calpol, category=category, name='Paracetamol')
+        cls.brufen = Product.objects.create(brand=Brand.objects.create(name='Brufen'), category=category, name='Ibuprofen')
+        ProductBarcode.objects.create(product=cls.brufen, code='9501101530003')
+        cls.supplier = Supplier.objects.create(name='Alpha Pharma')
+
+    def post(self, action, body, number='D-1'):
+        upload = SimpleUploadedFile('invoice.csv', (self.header + body).encode())
+        data = {'supplier': self.supplier.pk, 'invoice_number': number, 'date': '2026-10-01', 'note': '', 'file': upload}
+        return self.client.post(reverse('purchase_import'), {**data, 'action': action})
+
+    def test_preview_then_import(self):
+        body = (
+            '9501101530003,,,L1,2028-01-31,10,3.33,10,0\n'
+            ',paracetamol,PANADOL,L2,2028-02-28,4,7.25,,5\n'
+            ',Ibuprofen,,L3,2028-03-31,6,3.50,0,0\n'
+        )
+        response = self.post('preview', body)
+        result = response.context['result']
+        self.assertFalse(result.saved)
+        self.assertEqual(result.errors, [])
+        self.assertEqual([(line, label) for line, label, _ in result.preview], [
+            (2, 'Ibuprofen (Brufen)'), (3, 'Paracetamol (Panadol)'), (4, 'Ibuprofen (Brufen)'),
+        ])
+        self.assertEqual(result.totals['grand_total'], Decimal('81.42'))
+        self.assertFalse(PurchaseInvoice.objects.exists())
+        self.assertFalse(Batch.objects.exists())
+
+        response = self.post('import', body)
+        self.assertRedirects(response, reverse('purchase_list'))
+        invoice = PurchaseInvoice.objects.get(invoice_number='D-1')
+        self.assertEqual(invoice.grand_total, Decimal('81.42'))
+        self.assertEqual(invoice.grand_total, sum(item.total_amount for item in invoice.items.all()))
+        self.brufen.refresh_from_db()
+        self.assertEqual(self.brufen.stock_on_hand, 16)
+        self.assertEqual(StockMovement.objects.filter(movement_type=StockMovement.PURCHASE, reference='D-1').count(), 3)
+
+    def test_bad_line_saves_nothing(self):
+        lines = ''.join(f'9501101530003,,,L{i},2028-01-31,1,2.00,,\n' for i in range(5))
+        lines += ',Paracetamol,,X1,2028-01-31,1,2.00,,\n'  # two products with this name
+        lines += ',Aspirin,,X2,2028-01-31,1.5,2.00,,\n'
+        invoice = PurchaseInvoice(supplier=self.supplier, invoice_number='D-2')
+        result = import_invoice(invoice, read_invoice_rows(BytesIO((self.header + lines).encode()), 'x.csv'), chunk_size=2)
+        self.assertFalse(result.saved)
+        self.assertIsNone(invoice.pk)
+        self.assertEqual(result.errors, [
+            (7, 'Paracetamol matches several products; add the brand or a barcode.'),
+            (8, 'quantity must be a whole number, 1 or more.'),
+        ])
+        self.assertFalse(PurchaseInvoice.objects.exists())
+        self.assertFalse(Batch.objects.exists())
+        self.brufen.refresh_from_db()
+        self.assertEqual(self.brufen.stock_on_hand, 0)
+
+        response = self.post('import', ',Aspirin,,X2,2028-01-31,1,2.00,,\n')
+        self.assertEqual(response.context['result'].errors, [(2, 'No product named Aspirin.')])
+        self.assertContains(response, 'Nothing was saved')
+
+    def test_command_xlsx(self):
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Barcode', 'Product', 'Batch', 'Expiry', 'Qty', 'Unit Price'])
+        sheet.append([9501101530003.0, None, 'L1', date(2028, 1, 31), 12, 2.5])
+        sheet.append([None, 'Paracetamol', 'L2', date(2028, 1, 31), 3, 1])  # ambiguous without brand
+        handle, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        workbook.save(path)
+        out = StringIO()
 
-# Create your tests here.
+        args = [path, '--supplier', 'Alpha Pharma', '--invoice-number', 'X-1', '--date', '2026-10-02']
+        with self.assertRaisesMessage(Exception, 'Nothing saved: 2 lines'):
+            call_command('import_purchase_invoice', *args, '--dry-run', stdout=out, stderr=StringIO())
+        workbook.active.delete_rows(3)
+        workbook.save(path)
+        call_command('import_purchase_invoice', *args, '--dry-run', stdout=out)
+        self.assertIn('Dry run, nothing saved: 1 lines, grand total 30.00', out.getvalue())
+        self.assertFalse(PurchaseInvoice.objects.exists())
+        call_command('import_purchase_invoice', *args, stdout=out)
+        invoice = PurchaseInvoice.objects.get()
+        self.assertEqual((invoice.date, invoice.grand_total), (date(2026, 10, 2), Decimal('30.00')))
+        self.assertEqual(Batch.objects.get().quantity, 12)
@@ -4,5 +4,10 @@ from . import views
 urlpatterns = [
     path('suppliers/', views.supplier_list, name='supplier_list'),
     path('suppliers/add/', views.supplier_create, name='supplier_create'),
+    path('', views.purchase_list, name='purchase_list'),
     path('new/', views.purchase_create, name='purchase_create'),
+    path('import/', views.purchase_import, name='purchase_import'),
+    path('api/invoices/', views.purchase_list_api, name='purchase_list_api'),
+    path('api/last-cost/', views.last_cost_api, name='last_cost_api'),
+    path('products/<int:product_id>/prices/', views.price_history, name='price_history'),
 ]
@@ -0,0 +1,83 @@
+"""Last purchase cost per supplier and product, and the price history behind it.
+
+``SupplierProductCost`` keeps one row per (supplier, product) with the
+latest price paid, written for a whole invoice in two statements when it
+is received, so the purchase form can show "last paid" without scanning
+``PurchaseItem``. Lookups go through the cache, one key per pair, loaded
+for a whole form in one ``get_many`` and invalidated when a purchase
+changes the pair. The invalidation only reaches other workers with a
+shared cache backend, so entries also expire after
+``LAST_COST_CACHE_SECONDS`` (default 60).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, DecimalField, Value, When
+from django.utils import timezone
+
+from purchases.models import PurchaseItem, SupplierProductCost
+
+CACHE_KEY = "purchases:last_cost:{}:{}"
+
+
+def record_costs(invoice, items):
+    """Upsert the costs of a received invoice's ``items``; older invoices do not overwrite newer costs.
+
+    New pairs are inserted, skipping conflicts, then one UPDATE moves the
+    pairs not bought more recently. Both statements check the stored rows
+    as they write, so concurrent receipts neither collide nor let an older
+    price win.
+    """
+    latest = {item.product_id: item for item in items}  # the last line of a product wins
+    if not latest:
+        return
+    SupplierProductCost.objects.bulk_create(
+        [
+            SupplierProductCost(
+                supplier_id=invoice.supplier_id, product_id=product_id,
+                unit_price=item.unit_price, purchased_on=invoice.date, invoice=invoice,
+            )
+            for product_id, item in latest.items()
+        ],
+        ignore_conflicts=True,
+    )
+    SupplierProductCost.objects.filter(
+        supplier_id=invoice.supplier_id, product_id__in=latest, purchased_on__lte=invoice.date,
+    ).update(
+        unit_price=Case(
+            *[When(product_id=product_id, then=Value(item.unit_price)) for product_id, item in latest.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        purchased_on=invoice.date, invoice=invoice, updated_at=timezone.now(),
+    )
+    keys = [CACHE_KEY.format(invoice.supplier_id, product_id) for product_id in latest]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def last_costs(supplier_id, product_ids):
+    """``{product_id: {"unit_price", "date", "invoice"}}`` for the products bought from the supplier before."""
+    keys = {CACHE_KEY.format(supplier_id, pk): pk for pk in set(product_ids)}
+    found = cache.get_many(keys)
+    missing = [pk for key, pk in keys.items() if key not in found]
+    if missing:
+        loaded = {pk: {} for pk in missing}  # cached empty too: never bought
+        rows = (
+            SupplierProductCost.objects.filter(supplier_id=supplier_id, product_id__in=missing)
+            .values_list("product_id", "unit_price", "purchased_on", "invoice__invoice_number")
+        )
+        for pk, unit_price, day, number in rows:
+            loaded[pk] = {"unit_price": str(unit_price), "date": day.isoformat(), "invoice": number}
+        cache.set_many(
+            {CACHE_KEY.format(supplier_id, pk): row for pk, row in loaded.items()},
+            getattr(settings, "LAST_COST_CACHE_SECONDS", 60),
+        )
+        found.update((CACHE_KEY.format(supplier_id, pk), row) for pk, row in loaded.items())
+    return {pk: found[key] for key, pk in keys.items() if found[key]}
+
+
+def price_history(product_id, supplier_id=None):
+    """A product's purchase lines, newest first (``purchase_item_history_idx``)."""
+    items = PurchaseItem.objects.filter(product_id=product_id).select_related("invoice__supplier")
+    if supplier_id:
+        items = items.filter(invoice__supplier_id=supplier_id)
+    return items
@@ -0,0 +1,42 @@
+"""Purchase invoice history, read from the totals stored on each invoice.
+
+``receive_invoice`` saves ``sub_total``, ``total_discount``, ``total_tax``
+and ``grand_total`` on the invoice, so listing invoices and summing them
+per supplier never joins ``PurchaseItem``. The list is keyset paged on
+``(-date, -id)`` and the subtotals are one grouped query over the same
+date range, both served by the invoice date indexes: a page costs the
+same however long the purchase history grows. Without a range the last
+``HISTORY_DAYS`` days are shown.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from purchases.models import PurchaseInvoice
+
+HISTORY_DAYS = 30
+INVOICE_ORDER = ("-date", "-id")
+
+
+def default_range(today=None):
+    """``(start, end)`` of the last ``HISTORY_DAYS`` days, today included."""
+    today = today or timezone.localdate()
+    return today - timedelta(days=HISTORY_DAYS - 1), today
+
+
+def invoices_between(start, end, supplier_id=None):
+    """Invoices dated ``start`` to ``end`` (inclusive), of one supplier if given."""
+    invoices = PurchaseInvoice.objects.filter(date__range=(start, end))
+    if supplier_id:
+        invoices = invoices.filter(supplier_id=supplier_id)
+    return invoices
+
+
+def supplier_subtotals(invoices):
+    """``[{"supplier_id", "supplier__name", "invoices", "total"}]`` of ``invoices``, largest total first."""
+    return list(
+        invoices.order_by().values("supplier_id", "supplier__name")
+        .annotate(invoices=Count("id"), total=Sum("grand_total"))
+        .order_by("-total", "supplier__name")
+    )
@@ -0,0 +1,192 @@
+"""Streaming import of a supplier's invoice from a CSV or XLSX file.
+
+Distributors send their invoices as spreadsheets, one row per line. Rows
+are read one at a time with ``read_rows`` (the csv module, or openpyxl in
+read-only mode) and handled in chunks of ``CHUNK_SIZE``: the chunk's
+products are resolved with one query for its barcodes and one for its
+product names, the lines are priced in memory, and ``receive_items``
+writes their batches, items and stock movements in bulk. The invoice is
+received in one transaction, so it goes in whole or not at all: a bad
+line rolls every written chunk back. The totals are summed chunk by
+chunk and saved on the invoice at the end. Only the current chunk, the
+first ``PREVIEW_LINES`` lines, the first ``MAX_ERRORS`` errors and the
+ids of the products received (their caches are invalidated at commit)
+are kept, so memory use stays flat however long the invoice is.
+
+A dry run reads, matches and prices every line the same way but writes
+nothing, for a preview of the invoice before it is received.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from core.utils.pricing import apply_pricing
+from core.utils.transactions import write_atomic
+from inventory.models import Product, ProductBarcode
+from inventory.utils.catalog_import import MAX_ERRORS, _date, _decimal, _money, _text, read_rows
+from inventory.utils.gs1 import barcode_key
+from purchases.models import PurchaseItem
+from purchases.utils.receiving import invoice_totals, receive_items
+
+CHUNK_SIZE = 250  # smaller than a catalog chunk: the stock UPDATEs have a CASE arm per batch and product
+PREVIEW_LINES = 20
+LINE_COLUMNS = ("batch_number", "expiry_date", "quantity", "unit_price")
+
+
+class InvoiceImportResult:
+    def __init__(self):
+        self.lines = 0
+        self.saved = False
+        self.totals = {field: Decimal(0) for field in ("sub_total", "total_discount", "total_tax", "grand_total")}
+        self.preview = []
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return (
+            f"{self.lines} lines, grand total {self.totals['grand_total']}, "
+            f"{self.error_count} lines with errors"
+        )
+
+
+def _code(row):
+    value = row.get("barcode")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # a numeric XLSX cell
+    return barcode_key("" if value is None else str(value))
+
+
+def clean_line(row):
+    """Validate one row; returns ``(product, item_fields)`` where ``product`` is ``(barcode, name, brand)``."""
+    product = (_code(row), _text(row, "product", 200) or _text(row, "name", 200), _text(row, "brand", 100))
+    if not product[0] and not product[1]:
+        raise ValueError("barcode or product is required.")
+    quantity = _decimal(row, "quantity")
+    if quantity is None or quantity != quantity.to_integral_value() or quantity < 1:
+        raise ValueError("quantity must be a whole number, 1 or more.")
+    fields = {
+        "batch_number": _text(row, "batch_number", 50),
+        "expiry_date": _date(row, "expiry_date"),
+        "quantity": int(quantity),
+        "unit_price": _money(row, "unit_price"),
+        "sale_price": _money(row, "sale_price"),
+        "discount_percentage": _money(row, "discount_percentage", Decimal("0")),
+        "tax_percentage": _money(row, "tax_percentage", Decimal("0")),
+    }
+    if not fields["batch_number"]:
+        raise ValueError("batch_number is required.")
+    if fields["unit_price"] is None:
+        raise ValueError("unit_price is required.")
+    for column in ("unit_price", "sale_price"):
+        if fields[column] is not None and fields[column] >= 10 ** 8:
+            raise ValueError(f"{column} is too large.")
+    for column in ("discount_percentage", "tax_percentage"):
+        if fields[column] > 100:
+            raise ValueError(f"{column} must be between 0 and 100.")
+    return product, fields
+
+
+def _resolve(products):
+    """``{(barcode, name, brand): (product_id, label) or error message}`` in two queries."""
+    by_code = {}
+    codes = {code for code, _, _ in products if code}
+    rows = ProductBarcode.objects.filter(code__in=codes).values_list("code", "product_id", "product__name", "product__brand__name")
+    for code, pk, name, brand in rows:
+        by_code[code] = (pk, f"{name} ({brand})")
+
+    by_name = defaultdict(list)
+    names = {name.lower() for code, name, _ in products if name and code not in by_code}
+    rows = (
+        Product.objects.annotate(key=Lower("name")).filter(key__in=names)
+        .order_by("id").values_list("id", "key", "name", "brand__name")
+    )
+    for pk, key, name, brand in rows:
+        by_name[key].append((pk, name, brand))
+
+    resolved = {}
+    for code, name, brand in products:
+        if code in by_code:
+            resolved[code, name, brand] = by_code[code]
+            continue
+        matches = [
+            (pk, f"{found} ({found_brand})") for pk, found, found_brand in by_name.get(name.lower(), [])
+            if not brand or found_brand.lower() == brand.lower()
+        ]
+        if len(matches) == 1:
+            resolved[code, name, brand] = matches[0]
+        elif matches:
+            resolved[code, name, brand] = f"{name} matches several products; add the brand or a barcode."
+        elif name:
+            resolved[code, name, brand] = f"No product named {name}{f' ({brand})' if brand else ''}."
+        else:
+            resolved[code, name, brand] = f"No product has barcode {code}."
+    return resolved
+
+
+def _handle_chunk(invoice, chunk, result, write):
+    resolved = _resolve({product for _, product, _ in chunk})
+    items = []
+    for line, product, fields in chunk:
+        match = resolved[product]
+        if isinstance(match, str):
+            result.add_error(line, match)
+            continue
+        item = apply_pricing(PurchaseItem(product_id=match[0], **fields))
+        items.append(item)
+        if len(result.preview) < PREVIEW_LINES:
+            result.preview.append((line, match[1], item))
+    for field, value in invoice_totals(items).items():
+        result.totals[field] += value
+    if write and not result.error_count:
+        receive_items(invoice, items)
+
+
+def import_invoice(invoice, rows, dry_run=False, chunk_size=CHUNK_SIZE):
+    """Receive ``(line, row)`` pairs from ``read_rows`` as the lines of the unsaved ``invoice``.
+
+    Nothing is written for a dry run or if any line has an error;
+    ``result.saved`` tells whether the invoice was received.
+    """
+    result = InvoiceImportResult()
+    chunk = []
+    with transaction.atomic() if dry_run else write_atomic():
+        if not dry_run:
+            invoice.save()
+        for line, row in rows:
+            result.lines += 1
+            try:
+                product, fields = clean_line(row)
+            except ValueError as exc:
+                result.add_error(line, str(exc))
+                continue
+            chunk.append((line, product, fields))
+            if len(chunk) >= chunk_size:
+                _handle_chunk(invoice, chunk, result, not dry_run)
+                chunk.clear()
+        if chunk:
+            _handle_chunk(invoice, chunk, result, not dry_run)
+        if not result.lines:
+            raise ValueError("The file has no invoice lines.")
+        result.errors.sort()
+
+        if dry_run or result.error_count:
+            transaction.set_rollback(True)
+            invoice.pk = None  # rolled back with the lines
+        else:
+            for field, value in result.totals.items():
+                setattr(invoice, field, value)
+            invoice.save(update_fields=[*result.totals, "updated_at"])
+            result.saved = True
+    return result
+
+
+def read_invoice_rows(file, filename):
+    """``read_rows`` with the columns an invoice needs."""
+    return read_rows(file, filename, required=LINE_COLUMNS)
@@ -0,0 +1,77 @@
+"""Receiving a supplier invoice into stock in bulk.
+
+Each line of a purchase invoice adds its quantity to a batch: the one
+with the same product, batch number and expiry if it was delivered
+before, a new one otherwise (see ``inventory.utils.stock.receive_batches``).
+Instead of saving row by row, the lines are priced in memory (see
+``core.utils.pricing``), the invoice totals are summed from them so the
+invoice is inserted once, and the batches, items, ``PURCHASE`` stock
+movements and supplier last costs are each written in bulk: a constant
+number of queries however long the invoice is.
+"""
+from decimal import Decimal
+
+from core.utils.pricing import apply_pricing
+from core.utils.transactions import write_atomic
+from inventory.models import Batch, StockMovement
+from inventory.utils.stock import receive_batches
+from purchases.models import PurchaseItem
+from purchases.utils.costs import record_costs
+
+CENT = Decimal("0.01")
+
+
+def _money(value):
+    # Rounded like the DecimalField stores it, so the totals match the saved lines.
+    return Decimal(value).quantize(CENT)
+
+
+def invoice_totals(items):
+    """``sub_total``, ``total_discount``, ``total_tax`` and ``grand_total`` of priced items."""
+    return {
+        "sub_total": sum((_money(item.quantity * item.unit_price) for item in items), Decimal(0)),
+        "total_discount": sum((_money(item.discount_amount) for item in items), Decimal(0)),
+        "total_tax": sum((_money(item.tax_amount) for item in items), Decimal(0)),
+        "grand_total": sum((_money(item.total_amount) for item in items), Decimal(0)),
+    }
+
+
+def receive_items(invoice, items):
+    """Save priced ``PurchaseItem`` lines of the saved ``invoice`` and receive their stock.
+
+    Returns the batch of each line. Call inside ``transaction.atomic``; a
+    long invoice can be received a chunk of lines at a time.
+    """
+    batches = receive_batches(
+        [
+            Batch(
+                product_id=item.product_id, batch_number=item.batch_number, expiry_date=item.expiry_date,
+                purchase_price=item.unit_price, sale_price=item.sale_price, quantity=item.quantity,
+            )
+            for item in items
+        ],
+        StockMovement.PURCHASE,
+        reference=invoice.invoice_number,
+    )
+    for item, batch in zip(items, batches):
+        item.invoice = invoice
+        item.batch = batch
+    PurchaseItem.objects.bulk_create(items)
+    record_costs(invoice, items)
+    return batches
+
+
+def receive_invoice(invoice, items):
+    """Save the unsaved ``invoice`` and ``PurchaseItem`` lines and receive their stock.
+
+    Returns the batch of each line. Stock on hand, the stock ledger and the
+    FEFO batch cache move with them, in one transaction.
+    """
+    for item in items:
+        apply_pricing(item)
+    for field, value in invoice_totals(items).items():
+        setattr(invoice, field, value)
+
+    with write_atomic():
+        invoice.save()
+        return receive_items(invoice, items)
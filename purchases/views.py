@@ -1,9 +1,20 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import DecimalField, F, Sum
-from .models import Supplier, PurchaseInvoice
-from .forms import SupplierForm, PurchaseInvoiceForm, PurchaseItemFormSet
+from django.http import JsonResponse
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
+from .models import Supplier, SupplierProductCost
+from .forms import SupplierForm, PurchaseInvoiceForm, PurchaseItemFormSet, PurchaseImportForm
+from .utils.costs import last_costs, price_history as product_price_history
+from .utils.invoice_import import import_invoice, read_invoice_rows
+from .utils.history import INVOICE_ORDER, default_range, invoices_between, supplier_subtotals
+from .utils.receiving import receive_invoice
+from core.utils.pagination import keyset_page
+from inventory.models import Product
 from django.contrib import messages
-from inventory.models import Batch
+
+HISTORY_PER_PAGE = 50
+HISTORY_ORDER = ('-id',)
+INVOICES_PER_PAGE = 50
 
 def supplier_list(request):
     suppliers = Supplier.objects.all()
@@ -25,37 +36,10 @@ def purchase_create(request):
         form = PurchaseInvoiceForm(request.POST)
         formset = PurchaseItemFormSet(request.POST)
         if form.is_valid() and formset.is_valid():
-            invoice = form.save()
-            items = formset.save(commit=False)
-            for item in items:
-                item.invoice = invoice
-                # Create Batch Logic
-                batch = Batch.objects.create(
-                    product=item.product,
-                    batch_number=item.batch_number,
-                    expiry_date=item.expiry_date,
-                    purchase_price=item.unit_price,
-                    sale_price=item.sale_price,
-                    quantity=item.quantity
-                )
-                item.batch = batch
-                item.save()
-            totals = invoice.items.aggregate(
-                sub_total=Sum(
-                    F('quantity') * F('unit_price'),
-                    output_field=DecimalField(max_digits=12, decimal_places=2),
-                ),
-                total_discount=Sum('discount_amount'),
-                total_tax=Sum('tax_amount'),
-                grand_total=Sum('total_amount'),
-            )
-            invoice.sub_total = totals['sub_total'] or 0
-            invoice.total_discount = totals['total_discount'] or 0
-            invoice.total_tax = totals['total_tax'] or 0
-            invoice.grand_total = totals['grand_total'] or 0
-            invoice.save()
+            # Batches and stock_on_hand move together with the invoice or not at all
+            receive_invoice(form.save(commit=False), formset.save(commit=False))
             messages.success(request, 'Purchase Invoice saved and Stock updated.')
-            return redirect('dashboard') # Or purchase list
+            return redirect('purchase_list')
         else:
             print("Form Errors:", form.errors)
             print("Formset Errors:", formset.errors)
@@ -63,3 +47,119 @@ def purchase_create(request):
         form = PurchaseInvoiceForm()
         formset = PurchaseItemFormSet()
     return render(request, 'purchases/purchase_form.html', {'form': form, 'formset': formset})
+
+def purchase_import(request):
+    """Receive a supplier's invoice from a CSV/XLSX file, or preview it without saving."""
+    result = None
+    if request.method == 'POST':
+        form = PurchaseImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            dry_run = request.POST.get('action') != 'import'
+            try:
+                result = import_invoice(form.save(commit=False), read_invoice_rows(upload, upload.name), dry_run=dry_run)
+            except ValueError as exc:
+                messages.error(request, str(exc))
+            else:
+                if result.saved:
+                    messages.success(request, f'Purchase Invoice imported: {result.summary()}.')
+                    return redirect('purchase_list')
+                if result.error_count:
+                    messages.error(request, 'Nothing was saved: fix the lines listed below and upload the file again.')
+    else:
+        form = PurchaseImportForm()
+    return render(request, 'purchases/purchase_import.html', {'form': form, 'result': result})
+
+def last_cost_api(request):
+    """What was last paid ``supplier`` for each of ``products`` (comma separated ids)."""
+    try:
+        supplier_id = int(request.GET.get('supplier', ''))
+        product_ids = [int(pk) for pk in request.GET.get('products', '').split(',') if pk.strip()][:200]
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'supplier and products must be ids'}, status=400)
+    return JsonResponse({'results': last_costs(supplier_id, product_ids)})
+
+def price_history(request, product_id):
+    product = get_object_or_404(Product.objects.select_related('brand'), pk=product_id)
+    supplier_id = request.GET.get('supplier') or ''
+    if not supplier_id.isdigit():
+        supplier_id = ''
+    items = product_price_history(product.pk, supplier_id)
+    try:
+        page = keyset_page(
+            items, HISTORY_ORDER,
+            after=request.GET.get('after'), before=request.GET.get('before'), per_page=HISTORY_PER_PAGE,
+        )
+    except ValueError:
+        page = keyset_page(items, HISTORY_ORDER, per_page=HISTORY_PER_PAGE)
+    costs = SupplierProductCost.objects.filter(product=product).select_related('supplier').order_by('-purchased_on', 'id')
+    context = {'product': product, 'page': page, 'costs': costs, 'supplier_id': supplier_id}
+    return render(request, 'purchases/price_history.html', context)
+
+def _invoice_filters(request):
+    """``(supplier_id, start, end)`` from the query string; the last 30 days by default."""
+    supplier_id = request.GET.get('supplier') or ''
+    if not supplier_id.isdigit():
+        supplier_id = ''
+    start, end = default_range()
+    try:
+        start = parse_date(request.GET.get('start', '')) or start
+        end = parse_date(request.GET.get('end', '')) or end
+    except ValueError:
+        start, end = default_range()
+    return supplier_id, start, end
+
+def _invoice_page(request):
+    supplier_id, start, end = _invoice_filters(request)
+    invoices = invoices_between(start, end, supplier_id)
+    try:
+        page = keyset_page(
+            invoices.select_related('supplier'), INVOICE_ORDER,
+            after=request.GET.get('after'), before=request.GET.get('before'), per_page=INVOICES_PER_PAGE,
+        )
+    except ValueError:
+        page = keyset_page(invoices.select_related('supplier'), INVOICE_ORDER, per_page=INVOICES_PER_PAGE)
+    subtotals = supplier_subtotals(invoices)
+    filters = {'supplier': supplier_id, 'start': start.isoformat(), 'end': end.isoformat()}
+    return page, subtotals, filters
+
+def purchase_list(request):
+    page, subtotals, filters = _invoice_page(request)
+    context = {
+        'page': page,
+        'subtotals': subtotals,
+        'grand_total': sum(row['total'] for row in subtotals),
+        'invoice_count': sum(row['invoices'] for row in subtotals),
+        'filters': filters,
+        'query': urlencode({key: value for key, value in filters.items() if value}),
+        'period': urlencode({'start': filters['start'], 'end': filters['end']}),
+        'suppliers': Supplier.objects.order_by('name'),
+    }
+    return render(request, 'purchases/purchase_list.html', context)
+
+def purchase_list_api(request):
+    """Purchase invoices of ``supplier`` from ``start`` to ``end``, newest first, with per-supplier subtotals."""
+    page, subtotals, filters = _invoice_page(request)
+    return JsonResponse({
+        'results': [
+            {
+                'id': invoice.id,
+                'invoice_number': invoice.invoice_number,
+                'date': invoice.date.isoformat(),
+                'supplier_id': invoice.supplier_id,
+                'supplier': invoice.supplier.name,
+                'sub_total': str(invoice.sub_total),
+                'total_discount': str(invoice.total_discount),
+                'total_tax': str(invoice.total_tax),
+                'grand_total': str(invoice.grand_total),
+            }
+            for invoice in page.items
+        ],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+        'subtotals': [
+            {'supplier_id': row['supplier_id'], 'supplier': row['supplier__name'], 'invoices': row['invoices'], 'total': f"{row['total']:.2f}"}
+            for row in subtotals
+        ],
+        **filters,
+    })
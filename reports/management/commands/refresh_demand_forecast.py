@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from reports.utils.forecasting import refresh_forecasts
+
+
+class Command(BaseCommand):
+    help = "Add the sales since the last run, net of returns, to the demand forecasts (run daily, after midnight)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--as-of", help="Last day to count (YYYY-MM-DD); defaults to yesterday.")
+        parser.add_argument("--rebuild", action="store_true", help="Recompute from the full sales history.")
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options["as_of"]:
+            try:
+                as_of = parse_date(options["as_of"])
+            except ValueError:
+                as_of = None
+            if as_of is None:
+                raise CommandError("--as-of must be a date (YYYY-MM-DD).")
+        run = refresh_forecasts(as_of=as_of, rebuild=options["rebuild"])
+        if run is None:
+            raise CommandError("The forecasts are already past that day; use --rebuild to go back.")
+        self.stdout.write(self.style.SUCCESS(f"Forecasts updated through {run.as_of:%Y-%m-%d}."))
@@ -1,3 +1,28 @@
 from django.db import models
 
-# Create your models here.
+
+class ForecastRun(models.Model):
+    """One refresh of the demand forecasts, through the end of ``as_of``.
+
+    Sale items with an id up to ``through_item_id`` on days up to ``as_of``
+    are counted; the next refresh picks up everything else.
+    """
+    as_of = models.DateField()
+    through_item_id = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Forecast as of {self.as_of:%Y-%m-%d}"
+
+
+class DemandForecast(models.Model):
+    """Exponentially weighted daily demand of a product (see reports.utils.forecasting)."""
+    product = models.OneToOneField(
+        'inventory.Product', on_delete=models.CASCADE, primary_key=True, related_name='demand_forecast',
+    )
+    weighted_sum = models.FloatField(default=0)
+    weighted_square_sum = models.FloatField(default=0)
+    first_day = models.DateField(help_text="Day of the first counted sale")
+
+    def __str__(self):
+        return f"Demand of product {self.product_id}"
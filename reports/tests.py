@@ -1,3 +1,174 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from inventory.models import Batch, Brand, Category, Product
+from purchases.models import PurchaseInvoice, PurchaseItem, Supplier
+from sales.models import SaleItem, SalesInvoice, SalesReturn, SalesReturnItem
+from .models import DemandForecast
+from .utils.forecasting import load_demand, refresh_forecasts, stock_cover, suggest_reorders
+
+AS_OF = date(2026, 6, 30)
+
+
+def sell(product, day, quantity):
+    invoice = SalesInvoice.objects.create(date=timezone.make_aware(datetime.combine(day, time(12))))
+    return SaleItem.objects.create(invoice=invoice, product=product, quantity=quantity, unit_price=Decimal('10.00'))
+
+
+class ForecastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        cls.steady = Product.objects.create(brand=brand, category=category, name='Paracetamol')
+        cls.new = Product.objects.create(brand=brand, category=category, name='Paracetamol Extra')
+        cls.idle = Product.objects.create(brand=brand, category=category, name='Paracetamol Syrup')
+
+    def forecasts(self):
+        return {
+            f.product_id: (f.weighted_sum, f.weighted_square_sum, f.first_day)
+            for f in DemandForecast.objects.all()
+        }
+
+    def test_constant_demand(self):
+        for days_ago in range(60):
+            sell(self.steady, AS_OF - timedelta(days=days_ago), 10)
+        # Sold only for the last week; the days before it existed do not count.
+        for days_ago in range(7):
+            sell(self.new, AS_OF - timedelta(days=days_ago), 4)
+        run = refresh_forecasts(as_of=AS_OF)
+
+        ids, demand, std = load_demand(run)
+        self.assertEqual(ids.tolist(), [self.steady.pk, self.new.pk])
+        np.testing.assert_allclose(demand, [10, 4])
+        np.testing.assert_allclose(std, [0, 0], atol=1e-6)
+
+    def test_incremental_refresh_matches_rebuild(self):
+        for days_ago, quantity in [(40, 3), (10, 5), (3, 2), (0, 7)]:
+            sell(self.steady, AS_OF - timedelta(days=days_ago), quantity)
+        refresh_forecasts(as_of=AS_OF)
+
+        sell(self.steady, AS_OF + timedelta(days=1), 4)
+        sell(self.steady, AS_OF + timedelta(days=3), 6)
+        sell(self.new, AS_OF + timedelta(days=2), 1)
+        sell(self.idle, AS_OF - timedelta(days=5), 9)  # synced late from an offline till
+        sell(self.steady, AS_OF + timedelta(days=4), 8)  # after the new as_of: not counted yet
+        refresh_forecasts(as_of=AS_OF + timedelta(days=3))
+        incremental = self.forecasts()
+
+        refresh_forecasts(as_of=AS_OF + timedelta(days=3), rebuild=True)
+        rebuilt = self.forecasts()
+        self.assertEqual(set(incremental), {self.steady.pk, self.new.pk, self.idle.pk})
+        for pk, (total, square, first_day) in rebuilt.items():
+            self.assertAlmostEqual(incremental[pk][0], total)
+            self.assertAlmostEqual(incremental[pk][1], square)
+            self.assertEqual(incremental[pk][2], first_day)
+        self.assertEqual(rebuilt[self.idle.pk][2], AS_OF - timedelta(days=5))
+
+    def test_returns_are_not_demand(self):
+        returned_on = AS_OF - timedelta(days=4)
+        items = {}
+        for days_ago in range(30):
+            day = AS_OF - timedelta(days=days_ago)
+            items[day] = sell(self.steady, day, 10)
+            if day != returned_on:
+                sell(self.new, day, 10)
+        # A day's sales came back just after midnight (the previous day in UTC): that day sold nothing net.
+        item = items[returned_on - timedelta(days=1)]
+        sales_return = SalesReturn.objects.create(
+            invoice=item.invoice, date=timezone.make_aware(datetime.combine(returned_on, time(0, 30))),
+        )
+        SalesReturnItem.objects.create(sales_return=sales_return, sale_item=item, quantity=10)
+        refresh_forecasts(as_of=AS_OF)
+
+        forecasts = self.forecasts()
+        for steady, new in zip(forecasts[self.steady.pk], forecasts[self.new.pk]):
+            self.assertAlmostEqual(steady, new)
+
+    def test_rebuild_reads_history_in_a_fixed_number_of_queries(self):
+        sell(self.steady, AS_OF - timedelta(days=600), 1)
+        sell(self.steady, AS_OF, 1)
+        with CaptureQueriesContext(connection) as ctx:
+            refresh_forecasts(as_of=AS_OF, rebuild=True)
+        reads = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and '"sales_' in q['sql']]
+        self.assertEqual(len(reads), 3)  # the last item id, the sales and the returns
+
+    def test_refresh_never_goes_back(self):
+        refresh_forecasts(as_of=AS_OF)
+        self.assertIsNone(refresh_forecasts(as_of=AS_OF - timedelta(days=1)))
+
+
+class ReorderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        cls.products = {
+            name: Product.objects.create(brand=brand, category=category, name=name)
+            for name in ['Amoxil', 'Brufen', 'Calpol', 'Disprin']
+        }
+        cls.old_supplier = Supplier.objects.create(name='Zeta Traders')
+        cls.supplier = Supplier.objects.create(name='Alpha Pharma')
+        for supplier, day, cost in [(cls.supplier, date(2026, 5, 1), '6.00'), (cls.old_supplier, date(2026, 1, 1), '5.00')]:
+            invoice = PurchaseInvoice.objects.create(supplier=supplier, invoice_number=f'P-{day}', date=day)
+            for name in ['Amoxil', 'Brufen']:
+                PurchaseItem.objects.create(
+                    invoice=invoice, product=cls.products[name], batch_number='B1',
+                    expiry_date=date(2028, 1, 1), quantity=10, unit_price=Decimal(cost),
+                )
+        # Disprin: 4 of the 10 short-dated units expire before demand sells them.
+        cls.add_batch('Disprin', AS_OF + timedelta(days=3), 10)
+        cls.add_batch('Disprin', AS_OF + timedelta(days=1000), 30)
+        cls.add_batch('Calpol', AS_OF + timedelta(days=1000), 500)
+        for days_ago in range(30):
+            for name in cls.products:
+                sell(cls.products[name], AS_OF - timedelta(days=days_ago), 2)
+        refresh_forecasts(as_of=AS_OF)
+
+    @classmethod
+    def add_batch(cls, name, expiry, quantity):
+        Batch.objects.create(
+            product=cls.products[name], batch_number=f'{name}-{expiry}', expiry_date=expiry,
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=quantity,
+        )
+
+    def test_usable_stock_stops_at_expiry(self):
+        ids = np.array(sorted(p.pk for p in self.products.values()))
+        demand = np.full(len(ids), 2.0)
+        on_hand, usable = stock_cover(ids, demand, AS_OF)
+        disprin = np.searchsorted(ids, self.products['Disprin'].pk)
+        amoxil = np.searchsorted(ids, self.products['Amoxil'].pk)
+        self.assertEqual(on_hand[disprin], 40)
+        self.assertEqual(usable[disprin], 36)
+        self.assertEqual(on_hand[amoxil], 0)
+        self.assertEqual(usable[amoxil], 0)
+
+    def test_suggestions_grouped_by_last_supplier(self):
+        run, groups = suggest_reorders(lead_days=7, review=14, today=AS_OF)
+        self.assertEqual(run.as_of, AS_OF)
+        self.assertEqual([group['supplier'] for group in groups], [self.supplier, None])
+
+        alpha = groups[0]
+        self.assertEqual([row['product'].name for row in alpha['rows']], ['Amoxil', 'Brufen'])
+        self.assertEqual([row['quantity'] for row in alpha['rows']], [42, 42])
+        self.assertEqual(alpha['rows'][0]['unit_cost'], Decimal('6.00'))
+        self.assertEqual(alpha['total'], Decimal('504.00'))
+        # Never bought; 4 of its 40 units expire unsold, so 42 - 36 are ordered.
+        disprin, = groups[1]['rows']
+        self.assertEqual(disprin['product'].name, 'Disprin')
+        self.assertEqual((disprin['on_hand'], disprin['expiring'], disprin['quantity']), (40, 4, 6))
+        self.assertIsNone(disprin['cost'])
+        self.assertNotIn('Calpol', [row['product'].name for group in groups for row in group['rows']])
 
-# Create your tests here.
+    def test_page(self):
+        response = self.client.get(reverse('reorder_suggestions'), {'lead': 7, 'review': 14})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Alpha Pharma')
+        self.assertContains(response, 'Amoxil')
@@ -4,4 +4,6 @@ from . import views
 urlpatterns = [
     path('expiry-alerts/', views.expiry_alerts, name='expiry_alerts'),
     path('daily-sales/', views.daily_sales, name='daily_sales'),
+    path('stock-on-date/', views.stock_on_date, name='stock_on_date'),
+    path('reorder/', views.reorder_suggestions, name='reorder_suggestions'),
 ]
@@ -0,0 +1,295 @@
+"""Demand forecasting and reorder suggestions over SaleItem history.
+
+Daily demand is an exponentially weighted average of each product's daily
+sold quantity, less the quantity returned that day: a day ``k`` days
+before ``as_of`` carries weight ``SMOOTHING * (1 - SMOOTHING) ** k``.
+Weights only shrink with time, so a forecast is stored as two running sums
+per product (``DemandForecast``) and a refresh multiplies every stored sum
+by one decay factor, then adds the new days. All new days are read with
+one query grouped by product and local day, served by the sales invoice
+date index, and one for returns served by the return date index, so a full
+rebuild costs the same few queries as the daily refresh, which adds one
+for late-synced sales.
+
+Sales that reach the server after their day was counted (offline POS
+terminals) are found by sale item id (``ForecastRun.through_item_id``)
+and added at their own day's weight. Their square sum then misses the
+cross term with what was already counted for that day, which only
+affects the variance estimate.
+
+Reorder suggestions are computed for every product at once with NumPy:
+usable stock counts each in-stock batch only as far as forecast demand
+can sell it before it expires (FEFO), and the suggested quantity tops it
+up to lead time + review period of demand plus safety stock.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.utils.dates import day_bounds, on_day
+from inventory.models import Batch, Product
+from purchases.models import PurchaseItem, Supplier
+from reports.models import DemandForecast, ForecastRun
+from sales.models import SaleItem, SalesReturnItem
+
+SMOOTHING = 0.05  # weights halve about every two weeks
+HISTORY_DAYS = 730  # older days weigh less than 1e-16 of the latest
+SERVICE_LEVEL_Z = 1.65  # no stock-out in about 95% of cover periods
+LOOKUP_CHUNK = 500
+
+
+def lead_time_days():
+    return getattr(settings, "REORDER_LEAD_TIME_DAYS", 7)
+
+
+def review_days():
+    return getattr(settings, "REORDER_REVIEW_DAYS", 14)
+
+
+def latest_run():
+    return ForecastRun.objects.order_by("-as_of", "-id").first()
+
+
+def _daily_sales(first, last, through_item_id):
+    """``(product_ids, quantities, day_ordinals)`` per local day from ``first`` through ``last``.
+
+    Items up to ``through_item_id`` count as sold; returns count on the
+    day they were made, as negative quantities.
+    """
+    sold = (
+        SaleItem.objects.filter(id__lte=through_item_id, product__isnull=False, **on_day("invoice__date", first, last))
+        .annotate(day=TruncDate("invoice__date")).values("product_id", "day")
+        .annotate(total=Sum("quantity")).order_by().values_list("product_id", "day", "total")
+    )
+    returned = (
+        SalesReturnItem.objects.filter(
+            sale_item__product__isnull=False, **on_day("sales_return__date", first, last),
+        )
+        .annotate(day=TruncDate("sales_return__date")).values("sale_item__product_id", "day")
+        .annotate(total=Sum("quantity")).order_by().values_list("sale_item__product_id", "day", "total")
+    )
+    rows = [(pk, total, day.toordinal()) for pk, day, total in sold]
+    rows += [(pk, -total, day.toordinal()) for pk, day, total in returned]
+    rows = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def _late_sales(since_item_id, through_item_id, through_day):
+    """``(product_ids, quantities, day_ordinals)`` of new items dated on or before ``through_day``."""
+    _, end = day_bounds(through_day)
+    rows = SaleItem.objects.filter(
+        id__gt=since_item_id, id__lte=through_item_id, product__isnull=False, invoice__date__lt=end,
+    ).values_list("product_id", "quantity", "invoice__date")
+    rows = np.array(
+        [(pk, quantity, timezone.localdate(sold_at).toordinal()) for pk, quantity, sold_at in rows],
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def _accumulate(ids, quantities, days, as_of):
+    """Per product ``(ids, weighted_sum, weighted_square_sum, first_day_ordinal)``.
+
+    ``ids``, ``quantities`` and ``days`` (ordinals) are parallel arrays;
+    quantities of the same product and day are added up before squaring.
+    A day with more returned than sold counts as no demand.
+    """
+    if not len(ids):
+        return ids, np.zeros(0), np.zeros(0), ids
+    pairs, index = np.unique(np.column_stack([ids, days]), axis=0, return_inverse=True)
+    daily = np.bincount(index.ravel(), weights=quantities, minlength=len(pairs))
+    sold = daily > 0
+    pairs, daily = pairs[sold], daily[sold]
+    weights = SMOOTHING * (1 - SMOOTHING) ** (as_of.toordinal() - pairs[:, 1])
+
+    product_ids, index = np.unique(pairs[:, 0], return_inverse=True)
+    sums = np.bincount(index, weights=weights * daily, minlength=len(product_ids))
+    squares = np.bincount(index, weights=weights * daily ** 2, minlength=len(product_ids))
+    first_days = np.full(len(product_ids), date.max.toordinal())
+    np.minimum.at(first_days, index, pairs[:, 1])
+    return product_ids, sums, squares, first_days
+
+
+def refresh_forecasts(as_of=None, rebuild=False):
+    """Bring the stored forecasts up to the end of ``as_of`` (default: yesterday).
+
+    Only days after the previous run and sale items added since it are
+    read, unless ``rebuild`` (or there is no previous run), which starts
+    over from ``HISTORY_DAYS`` of history. Returns the new ``ForecastRun``,
+    or ``None`` if ``as_of`` is before the previous run.
+    """
+    as_of = as_of or timezone.localdate() - timedelta(days=1)
+    with transaction.atomic():
+        previous = None if rebuild else latest_run()
+        if previous and previous.as_of > as_of:
+            return None
+        through_item_id = SaleItem.objects.aggregate(last=Max("id"))["last"] or 0
+
+        ids, quantities, days = [], [], []
+        if previous:
+            late = _late_sales(previous.through_item_id, through_item_id, previous.as_of)
+            ids.append(late[0])
+            quantities.append(late[1])
+            days.append(late[2])
+            first = previous.as_of + timedelta(days=1)
+        else:
+            first = as_of - timedelta(days=HISTORY_DAYS - 1)
+        if first <= as_of:
+            daily = _daily_sales(first, as_of, through_item_id)
+            ids.append(daily[0])
+            quantities.append(daily[1])
+            days.append(daily[2])
+        ids, sums, squares, first_days = _accumulate(
+            np.concatenate(ids), np.concatenate(quantities).astype(float), np.concatenate(days), as_of,
+        )
+
+        if previous:
+            decay = (1 - SMOOTHING) ** (as_of - previous.as_of).days
+            DemandForecast.objects.update(
+                weighted_sum=F("weighted_sum") * decay,
+                weighted_square_sum=F("weighted_square_sum") * decay,
+            )
+        else:
+            DemandForecast.objects.all().delete()
+        stored = {}
+        for start in range(0, len(ids), LOOKUP_CHUNK):
+            stored.update(DemandForecast.objects.in_bulk(ids[start:start + LOOKUP_CHUNK].tolist()))
+
+        rows = []
+        for pk, total, square, first_day in zip(ids.tolist(), sums.tolist(), squares.tolist(), first_days.tolist()):
+            first_day = date.fromordinal(first_day)
+            row = stored.get(pk) or DemandForecast(product_id=pk, first_day=first_day)
+            row.weighted_sum += total
+            row.weighted_square_sum += square
+            row.first_day = min(row.first_day, first_day)
+            rows.append(row)
+        DemandForecast.objects.bulk_create(
+            rows, batch_size=1000, update_conflicts=True, unique_fields=["product"],
+            update_fields=["weighted_sum", "weighted_square_sum", "first_day"],
+        )
+        return ForecastRun.objects.create(as_of=as_of, through_item_id=through_item_id)
+
+
+def load_demand(run):
+    """``(product_ids, daily_demand, daily_std)`` of every forecast, ordered by product id."""
+    rows = np.array([
+        (pk, total, square, first_day.toordinal())
+        for pk, total, square, first_day in DemandForecast.objects.order_by("product_id").values_list(
+            "product_id", "weighted_sum", "weighted_square_sum", "first_day",
+        )
+    ], dtype=float).reshape(-1, 4)
+    # Normalize by the weight of the days since the first sale, so a new
+    # product's demand is not diluted by the days before it was sold.
+    days = np.maximum(run.as_of.toordinal() - rows[:, 3] + 1, 1)
+    norm = 1 - (1 - SMOOTHING) ** days
+    demand = rows[:, 1] / norm
+    variance = np.maximum(rows[:, 2] / norm - demand ** 2, 0)
+    return rows[:, 0].astype(np.int64), demand, np.sqrt(variance)
+
+
+def stock_cover(product_ids, demand, today):
+    """``(on_hand, usable)`` per product of ``product_ids`` (sorted) from its in-stock batches.
+
+    Selling FEFO at ``demand`` units a day, at most ``demand * t_i`` units
+    are sold by the expiry of batch ``i`` (``t_i`` days away), so the units
+    of batches ``1..i`` sold in time are
+    ``U_i = min(U_(i-1) + q_i, demand * t_i)``. Unrolled, the last one is
+    ``cum_n + min(0, min_i(demand * t_i - cum_i))`` with ``cum`` the running
+    quantity, which only needs one grouped minimum over all batches.
+    """
+    rows = np.array(list(
+        Batch.objects.filter(quantity__gt=0).order_by("product_id", "expiry_date", "id")
+        .values_list("product_id", "expiry_date", "quantity")
+    ), dtype=object).reshape(-1, 3)
+    on_hand = np.zeros(len(product_ids))
+    usable = np.zeros(len(product_ids))
+    if not len(rows) or not len(product_ids):
+        return on_hand, usable
+
+    batch_products = rows[:, 0].astype(np.int64)
+    index = np.minimum(np.searchsorted(product_ids, batch_products), len(product_ids) - 1)
+    forecast = product_ids[index] == batch_products
+    index = index[forecast]
+    quantities = rows[forecast, 2].astype(float)
+    days_left = np.array([expiry.toordinal() for expiry in rows[forecast, 1]]) - today.toordinal()
+    if not len(index):
+        return on_hand, usable
+
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    groups = index[starts]
+    totals = np.cumsum(quantities)
+    group_base = np.repeat(np.r_[0, totals[starts[1:] - 1]], np.diff(np.r_[starts, len(index)]))
+    cum = totals - group_base
+    slack = demand[index] * np.maximum(days_left, 0) - cum
+    on_hand[groups] = cum[np.r_[starts[1:] - 1, len(index) - 1]]
+    usable[groups] = on_hand[groups] + np.minimum(np.minimum.reduceat(slack, starts), 0)
+    return on_hand, usable
+
+
+def _supplier_info(product_ids):
+    """``{product_id: (product, supplier_id, unit_cost)}`` from each product's latest purchase."""
+    latest = PurchaseItem.objects.filter(product=OuterRef("pk")).order_by("-invoice__date", "-id")
+    info = {}
+    for start in range(0, len(product_ids), LOOKUP_CHUNK):
+        products = Product.objects.filter(pk__in=product_ids[start:start + LOOKUP_CHUNK]).select_related(
+            "brand",
+        ).annotate(
+            last_supplier_id=Subquery(latest.values("invoice__supplier_id")[:1]),
+            last_unit_cost=Subquery(latest.values("unit_price")[:1]),
+        )
+        for product in products:
+            info[product.pk] = (product, product.last_supplier_id, product.last_unit_cost)
+    return info
+
+
+def suggest_reorders(lead_days=None, review=None, today=None):
+    """Suggested purchases from the latest forecast, grouped by last supplier.
+
+    Returns ``(run, groups)``; each group is ``{"supplier", "rows", "total"}``
+    with ``supplier`` ``None`` for products never bought, listed last.
+    """
+    run = latest_run()
+    if run is None:
+        return None, []
+    lead_days = lead_time_days() if lead_days is None else lead_days
+    review = review_days() if review is None else review
+    today = today or timezone.localdate()
+    cover = lead_days + review
+
+    product_ids, demand, std = load_demand(run)
+    on_hand, usable = stock_cover(product_ids, demand, today)
+    target = demand * cover + SERVICE_LEVEL_Z * std * np.sqrt(cover)
+    quantities = np.floor(np.maximum(target - usable, 0) + 0.5)  # to the nearest unit
+    wanted = np.flatnonzero(quantities > 0)
+
+    info = _supplier_info(product_ids[wanted].tolist())
+    groups = {}
+    for i in wanted.tolist():
+        product, supplier_id, unit_cost = info[int(product_ids[i])]
+        quantity = int(quantities[i])
+        groups.setdefault(supplier_id, []).append({
+            "product": product,
+            "daily_demand": float(demand[i]),
+            "on_hand": int(on_hand[i]),
+            "expiring": int(round(on_hand[i] - usable[i])),
+            "quantity": quantity,
+            "unit_cost": unit_cost,
+            "cost": unit_cost * quantity if unit_cost is not None else None,
+        })
+
+    suppliers = Supplier.objects.in_bulk([pk for pk in groups if pk is not None])
+    result = []
+    for supplier_id, rows in groups.items():
+        rows.sort(key=lambda row: (row["product"].name, row["product"].pk))
+        result.append({
+            "supplier": suppliers.get(supplier_id),
+            "rows": rows,
+            "total": sum(row["cost"] for row in rows if row["cost"] is not None),
+        })
+    result.sort(key=lambda group: (group["supplier"] is None, group["supplier"].name if group["supplier"] else ""))
+    return run, result
@@ -1,8 +1,13 @@
 from django.shortcuts import render
 from django.db.models import Sum
 from django.utils import timezone
+from datetime import datetime, time, timedelta
+from core.utils.dates import on_day
+from inventory.models import Product
+from inventory.utils.ledger import stock_at
 from sales.models import SalesInvoice, SalesReturn
 from .utils.expiry_alerts import get_expiry_alert_querysets
+from .utils.forecasting import lead_time_days, review_days, suggest_reorders
 
 def expiry_alerts(request):
     zones = get_expiry_alert_querysets()
@@ -21,8 +26,8 @@ def daily_sales(request):
     if date_str:
         today = timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
         
-    sales = SalesInvoice.objects.filter(date__date=today).order_by('-date')
-    returns = SalesReturn.objects.filter(date__date=today).select_related('invoice').order_by('-date')
+    sales = SalesInvoice.objects.filter(**on_day('date', today)).order_by('-date')
+    returns = SalesReturn.objects.filter(**on_day('date', today)).select_related('invoice').order_by('-date')
     
     summary = sales.aggregate(
         total_sales=Sum('grand_total'),
@@ -41,3 +46,41 @@ def daily_sales(request):
         'date': today,
     }
     return render(request, 'reports/daily_sales_report.html', context)
+
+def stock_on_date(request):
+    """Stock on hand per product at the end of ``date``, read from the movement ledger."""
+    day = timezone.localdate()
+    date_str = request.GET.get('date')
+    if date_str:
+        day = timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
+    end_of_day = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min)) - timedelta(microseconds=1)
+
+    quantities = stock_at(end_of_day)
+    products = Product.objects.filter(pk__in=quantities).select_related('brand').order_by('name', 'id')
+    rows = [{'product': p, 'quantity': quantities[p.pk]} for p in products]
+    context = {
+        'rows': rows,
+        'date': day,
+        'total_units': sum(quantities.values()),
+    }
+    return render(request, 'reports/stock_on_date.html', context)
+
+def _days_param(request, name, default):
+    try:
+        return max(int(request.GET.get(name, default)), 0)
+    except ValueError:
+        return default
+
+def reorder_suggestions(request):
+    """Suggested purchase quantities from the demand forecast, grouped by last supplier."""
+    lead_days = _days_param(request, 'lead', lead_time_days())
+    review = _days_param(request, 'review', review_days())
+    run, groups = suggest_reorders(lead_days=lead_days, review=review)
+    context = {
+        'run': run,
+        'groups': groups,
+        'lead_days': lead_days,
+        'review_days': review,
+        'total_cost': sum(group['total'] for group in groups),
+    }
+    return render(request, 'reports/reorder_suggestions.html', context)
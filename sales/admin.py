@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, SalesInvoice, SaleItem, SalesReturn, SalesReturnItem
+from .models import Customer, InvoiceSequence, SalesInvoice, SaleItem, SalesReturn, SalesReturnItem
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -31,3 +31,8 @@ class SalesReturnAdmin(admin.ModelAdmin):
     list_filter = ('date',)
     search_fields = ('invoice__invoice_number',)
     inlines = [SalesReturnItemInline]
+
+
+@admin.register(InvoiceSequence)
+class InvoiceSequenceAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'year', 'last_value')
@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 13:11
+
+import re
+
+from django.db import migrations, models
+
+
+def seed_invoice_sequence(apps, schema_editor):
+    """Continue the existing INV-xxxxxx numbers from where MAX(id) left them."""
+    SalesInvoice = apps.get_model('sales', 'SalesInvoice')
+    InvoiceSequence = apps.get_model('sales', 'InvoiceSequence')
+    last_value = 0
+    for pk, number in SalesInvoice.objects.values_list('id', 'invoice_number').iterator():
+        match = re.fullmatch(r'INV-(\d+)', number or '')
+        last_value = max(last_value, pk, int(match.group(1)) if match else 0)
+    if last_value:
+        InvoiceSequence.objects.create(prefix='INV', year=0, last_value=last_value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_salesreturn_salesreturnitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=20)),
+                ('year', models.PositiveIntegerField(default=0, help_text='0 for a series that never resets')),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('prefix', 'year'), name='unique_invoice_sequence')],
+            },
+        ),
+        migrations.RunPython(seed_invoice_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_invoicesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleRequestKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='request_keys', to='sales.salesinvoice')),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0005_salerequestkey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='salesinvoice',
+            index=models.Index(fields=['date'], name='sales_invoice_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesreturn',
+            index=models.Index(fields=['date'], name='sales_return_date_idx'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 from inventory.models import Product, Batch
+from core.utils.pricing import apply_pricing
 
 class Customer(models.Model):
     name = models.CharField(max_length=100)
@@ -12,6 +13,21 @@ class Customer(models.Model):
     def __str__(self):
         return self.name
 
+class InvoiceSequence(models.Model):
+    """Counter row for one invoice number series (a prefix, optionally per year)."""
+    prefix = models.CharField(max_length=20)
+    year = models.PositiveIntegerField(default=0, help_text="0 for a series that never resets")
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['prefix', 'year'], name='unique_invoice_sequence'),
+        ]
+
+    def __str__(self):
+        series = f"{self.prefix}-{self.year}" if self.year else self.prefix
+        return f"{series} (last {self.last_value})"
+
 class SalesInvoice(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     date = models.DateTimeField(default=timezone.now)
@@ -40,20 +56,28 @@ class SalesInvoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['date'], name='sales_invoice_date_idx')]
+
     def save(self, *args, **kwargs):
         if not self.invoice_number:
-            # Auto-increment invoice number logic
-            last_invoice = SalesInvoice.objects.all().order_by('id').last()
-            if last_invoice:
-                last_id = last_invoice.id
-            else:
-                last_id = 0
-            self.invoice_number = f"INV-{last_id + 1:06d}"
+            # Numbers come from a counter row, so concurrent terminals never collide
+            from .utils.invoice_numbers import next_invoice_numbers
+            self.invoice_number = next_invoice_numbers(when=self.date)[0]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.invoice_number}"
 
+class SaleRequestKey(models.Model):
+    """Idempotency key sent by a POS client, remembered with the invoice it created."""
+    key = models.CharField(max_length=64, unique=True)
+    invoice = models.ForeignKey(SalesInvoice, on_delete=models.CASCADE, related_name='request_keys')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} -> {self.invoice}"
+
 class SaleItem(models.Model):
     invoice = models.ForeignKey(SalesInvoice, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.PROTECT, null=True, blank=True)
@@ -77,25 +101,8 @@ class SaleItem(models.Model):
         if not self.item_name and self.product:
             self.item_name = self.product.name
             
-        # Ensure Decimal
-        from decimal import Decimal
-        qty = Decimal(self.quantity)
-        u_price = Decimal(self.unit_price)
-        d_perc = Decimal(self.discount_percentage)
-        d_amt = Decimal(self.discount_amount)
-        t_amt = Decimal(self.tax_amount or 0)
-        
-        gross = qty * u_price
-        
-        # Priority: if amount is set manually, use it. Else calc from percent.
-        if d_amt == 0 and d_perc > 0:
-            d_amt = gross * (d_perc / Decimal(100))
-        
-        self.discount_amount = d_amt # save back
-        
-        taxable_amount = gross - d_amt
-        self.tax_amount = t_amt
-        self.total_amount = taxable_amount + t_amt
+        # Discount/tax/total math is shared with the bulk insert paths
+        apply_pricing(self)
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -109,6 +116,9 @@ class SalesReturn(models.Model):
     refund_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['date'], name='sales_return_date_idx')]
+
     def __str__(self):
         return f"Return {self.id} - {self.invoice.invoice_number}"
 
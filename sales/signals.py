@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Customer, SalesInvoice, SalesReturn
+from .utils.customer_index import customer_index
+
+
+@receiver(post_save, sender=Customer)
+def index_customer(sender, instance, **kwargs):
+    pk, name, phone = instance.pk, instance.name, instance.phone
+    transaction.on_commit(lambda: customer_index.update(pk, name, phone))
+
+
+@receiver(post_delete, sender=Customer)
+def unindex_customer(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: customer_index.remove(pk))
+
+
+@receiver(post_save, sender=SalesReturn)
+def touch_returned_invoice(sender, instance, **kwargs):
+    # Returns saved one by one (admin) must also refresh the cached receipt;
+    # the bulk return path in utils/returns.py touches its invoices itself.
+    SalesInvoice.objects.filter(pk=instance.invoice_id).update(updated_at=timezone.now())
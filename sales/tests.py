@@ -1,3 +1,718 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.utils.pricing import price_line
+from inventory.models import Batch, Brand, Category, Product, ProductBarcode, StockMovement
+from inventory.utils import batch_cache
+from inventory.utils.stock import StockChanged, apply_batch_deltas, apply_movements
+from .models import Customer, SaleItem, SaleRequestKey, SalesInvoice, SalesReturn
+from .utils import idempotency
+from .utils.allocation import load_batches, plan_sale_items, split_amount
+from .utils.checkout import OFFLINE_SALE_MAX_AGE, sync_sales
+from .utils.customer_index import customer_index
+from .utils.invoice_numbers import next_invoice_numbers
+from .utils.returns import process_returns
+
+
+class ProductSearchApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        for i in range(15):
+            product = Product.objects.create(brand=brand, category=category, name=f'Paracetamol {i}')
+            Batch.objects.create(
+                product=product, batch_number=f'LATE-{i}', expiry_date=date(2031, 1, 1),
+                purchase_price=Decimal('5.00'), sale_price=Decimal('9.00'), quantity=4,
+            )
+            Batch.objects.create(
+                product=product, batch_number=f'SOON-{i}', expiry_date=date(2030, 1, 1),
+                purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=6,
+            )
+            Batch.objects.create(
+                product=product, batch_number=f'EMPTY-{i}', expiry_date=date(2029, 1, 1),
+                purchase_price=Decimal('5.00'), sale_price=Decimal('7.00'), quantity=0,
+            )
+        Product.objects.create(brand=Brand.objects.create(name='Brufen'), category=category, name='Ibuprofen')
+
+    def search(self, query):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('product_search_api'), {'q': query})
+        return response.json()['results'], len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_result_size(self):
+        batch_cache.clear()
+        self.search('warm up')  # the first search checks once whether the FTS index exists
+        one, one_queries = self.search('ibuprofen')
+        many, many_queries = self.search('paracetamol')
+        self.assertEqual(len(one), 1)
+        self.assertEqual(len(many), 15)
+        self.assertEqual(one_queries, many_queries)
+        # Batches are loaded once per search for products not in the batch cache yet.
+        _, one_cached = self.search('ibuprofen')
+        _, many_cached = self.search('paracetamol')
+        self.assertEqual(one_cached, many_cached)
+        self.assertEqual(many_cached, many_queries - 1)
+        self.assertLessEqual(many_cached, 3)
+
+    def test_stock_and_fefo_price(self):
+        results, _ = self.search('paracetamol 3')
+        hit = next(r for r in results if r['name'] == 'Paracetamol 3')
+        self.assertEqual(hit['stock'], 10)
+        self.assertEqual(hit['price'], 8.0)
+        self.assertEqual(hit['expiry'], '2030-01-01')
+        self.assertEqual(hit['brand'], 'Panadol')
+
+        results, _ = self.search('ibuprofen')
+        self.assertEqual(results[0]['stock'], 0)
+        self.assertEqual(results[0]['price'], 0.0)
+
+
+class ScanApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol', tax_percentage=Decimal('5'),
+        )
+        cls.fefo = Batch.objects.create(
+            product=cls.product, batch_number='SOON', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=6,
+        )
+        Batch.objects.create(
+            product=cls.product, batch_number='AB-12', expiry_date=date(2031, 6, 30),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('9.00'), quantity=4,
+        )
+        ProductBarcode.objects.create(product=cls.product, code='9501101530003')
+        ProductBarcode.objects.create(product=cls.product, code='19501101530000', pack_quantity=10)
+
+    def scan(self, code):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('scan_api'), {'code': code})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        return response
+
+    def test_plain_gtin_in_any_length(self):
+        self.assertEqual(ProductBarcode.objects.get(pack_quantity=1).code, '09501101530003')
+        for code in ('9501101530003', '09501101530003'):
+            product = self.scan(code).json()['product']
+            self.assertEqual(product['id'], self.product.id)
+            self.assertEqual(product['price'], 8.0)
+            self.assertEqual(product['expiry'], '2030-01-01')
+            self.assertEqual(product['batch_id'], self.fefo.id)
+            self.assertEqual(product['stock'], 10)
+            self.assertEqual(product['pack_quantity'], 1)
+            self.assertNotIn('lot', product)
+        self.assertEqual(self.scan('19501101530000').json()['product']['pack_quantity'], 10)
+
+    def test_gs1_lot_and_expiry(self):
+        lot = self.scan(']d201095011015300031731063010AB-12\x1d21SERIAL').json()['product']['lot']
+        self.assertEqual(lot['batch_number'], 'AB-12')
+        self.assertEqual(lot['quantity'], 4)
+        self.assertEqual(lot['expiry'], '2031-06-30')
+        self.assertFalse(lot['expired'])
+
+        lot = self.scan('(01)09501101530003(17)200100(10)OLD').json()['product']['lot']
+        self.assertIsNone(lot['batch_id'])
+        self.assertEqual(lot['expiry'], '2020-01-31')
+        self.assertTrue(lot['expired'])
+
+    def test_unknown_code(self):
+        response = self.scan('4006381333931')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['status'], 'error')
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name='Panadol')
+        category = Category.objects.create(name='Analgesic')
+        cls.products = [
+            Product.objects.create(brand=cls.brand, category=category, name=f'Paracetamol {i}') for i in range(5)
+        ]
+        cls.batch = Batch.objects.create(
+            product=cls.products[0], batch_number='B1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=10,
+        )
+
+    def setUp(self):
+        # Everything above was synced an hour ago.
+        self.since = timezone.now() - timedelta(minutes=30)
+        past = timezone.now() - timedelta(hours=1)
+        Product.objects.update(updated_at=past)
+        Batch.objects.update(updated_at=past)
+
+    def sync(self, since=None, **params):
+        if since:
+            params['since'] = since.isoformat()
+        return self.client.get(reverse('catalog_api'), params).json()
+
+    def rows(self, page):
+        return {row[0]: dict(zip(page['fields'], row)) for row in page['products']}
+
+    def test_full_load_is_paged_and_resets(self):
+        first = self.sync(limit=3)
+        self.assertTrue(first['reset'])
+        self.assertEqual(len(first['products']), 3)
+        self.assertIsNotNone(first['cursor'])
+        rest = self.sync(limit=3, after=first['next_after'])
+        self.assertIsNone(rest['next_after'])
+        self.assertIsNone(rest['cursor'])
+        self.assertEqual(len(first['products']) + len(rest['products']), 5)
+        row = self.rows(first)[self.products[0].id]
+        self.assertEqual((row['stock'], row['price'], row['brand']), (10, 8.0, 'Panadol'))
+
+    def test_delta_has_only_changed_products(self):
+        self.assertEqual(self.sync(self.since)['products'], [])
+
+        apply_batch_deltas({self.batch.id: -4})
+        self.products[3].save()
+        page = self.sync(self.since)
+        self.assertFalse(page['reset'])
+        rows = self.rows(page)
+        self.assertEqual(sorted(rows), [self.products[0].id, self.products[3].id])
+        self.assertEqual(rows[self.products[0].id]['stock'], 6)
+
+    def test_deletes_and_brand_renames(self):
+        deleted_id = self.products[4].id
+        self.products[4].delete()
+        self.brand.name = 'Calpol'
+        self.brand.save()
+        page = self.sync(self.since)
+        self.assertEqual(page['deleted'], [deleted_id])
+        self.assertEqual({row['brand'] for row in self.rows(page).values()}, {'Calpol'})
+        self.assertEqual(len(page['products']), 4)
+
+    def test_stale_cursor_reloads_everything(self):
+        page = self.sync(timezone.now() - timedelta(days=365))
+        self.assertTrue(page['reset'])
+        self.assertEqual(len(page['products']), 5)
+
+
+class CustomerSearchApiTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.create(name='Ali Khan', phone='0300-1234567')
+            Customer.objects.create(name='Alina Shah', phone='+92 301 7654321')
+            Customer.objects.create(name='Sara Ali', phone='0321 5550000')
+        customer_index.build()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('customer_search_api'), dict(params, q=query))
+        return response.json()
+
+    def names(self, query, **params):
+        return sorted(c['name'] for c in self.search(query, **params)['results'])
+
+    def test_phone_prefix_ignores_formatting(self):
+        self.assertEqual(self.names('0300123'), ['Ali Khan'])
+        self.assertEqual(self.names('030'), ['Ali Khan', 'Alina Shah'])
+        self.assertEqual(self.names('92301'), ['Alina Shah'])
+
+    def test_name_prefix_matches_any_word(self):
+        self.assertEqual(self.names('ali'), ['Ali Khan', 'Alina Shah', 'Sara Ali'])
+        self.assertEqual(self.names('ALI K'), ['Ali Khan'])
+        self.assertEqual(self.names('khan al'), ['Ali Khan'])
+
+    def test_pagination(self):
+        first = self.search('ali', limit=2)
+        self.assertEqual(len(first['results']), 2)
+        self.assertTrue(first['has_more'])
+        rest = self.search('ali', limit=2, offset=first['next_offset'])
+        self.assertEqual(len(rest['results']), 1)
+        self.assertFalse(rest['has_more'])
+        self.assertIsNone(rest['next_offset'])
+
+    def test_saves_and_deletes_update_the_index(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            customer = Customer.objects.create(name='Bilal Raza', phone='0333 1112222')
+        self.assertEqual(self.names('bil'), ['Bilal Raza'])
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.phone = '0344 9998888'
+            customer.save()
+        self.assertEqual(self.names('0333'), [])
+        self.assertEqual(self.names('0344'), ['Bilal Raza'])
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.delete()
+        self.assertEqual(self.names('bil'), [])
+
+    def test_old_index_is_rebuilt_off_the_request_path(self):
+        # bulk_create sends no signals, like a save in another worker with a per-process cache
+        Customer.objects.bulk_create([Customer(name='Zara Malik'), Customer(name='Zain Malik', phone='0355 1230000')])
+        self.assertEqual(self.names('mal'), [])
+        with override_settings(CUSTOMER_INDEX_SECONDS=0), mock.patch('sales.utils.customer_index.threading.Thread') as thread:
+            with self.assertNumQueries(0):
+                self.assertEqual(customer_index.search('mal'), ([], False))
+                customer_index.search('mal')  # one refresh at a time
+        thread.assert_called_once()
+        with mock.patch('sales.utils.customer_index.connection'):  # the test's connection stays open
+            thread.call_args.kwargs['target']()
+        self.assertEqual(self.names('mal'), ['Zain Malik', 'Zara Malik'])
+        self.assertEqual(self.search('zara')['results'][0]['phone'], None)
+
+
+class SalesReturnTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+        cls.batch = Batch.objects.create(
+            product=product, batch_number='RECALL-1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=0,
+        )
+        cls.items = []
+        for qty in (3, 5, 2):
+            invoice = SalesInvoice.objects.create()
+            cls.items.append(SaleItem.objects.create(
+                invoice=invoice, product=product, batch=cls.batch, item_name='Paracetamol',
+                quantity=qty, unit_price=Decimal('8.00'),
+            ))
+
+    def post_return(self, item, qty):
+        return self.client.post(
+            reverse('sales_return_create', args=[item.invoice_id]), {f'return_qty_{item.id}': qty},
+        )
+
+    def test_return_restocks_batch(self):
+        self.post_return(self.items[1], 2)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 2)
+        sales_return = SalesReturn.objects.get(invoice=self.items[1].invoice)
+        self.assertEqual(sales_return.refund_amount, Decimal('16.00'))
+
+    def test_over_return_is_rejected(self):
+        self.post_return(self.items[0], 2)
+        response = self.post_return(self.items[0], 2)
+        self.assertEqual(response.status_code, 200)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 2)
+        self.assertEqual(SalesReturn.objects.count(), 1)
+
+    def test_batch_recall_returns_every_invoice(self):
+        self.post_return(self.items[0], 1)
+        url = reverse('batch_recall_return', args=[self.batch.id])
+        self.assertEqual(self.client.get(url).context['total_available'], 9)
+
+        data = {f'return_qty_{item.id}': qty for item, qty in zip(self.items, (2, 5, 2))}
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(url, dict(data, reason='Recall'))
+        writes = [q for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 3)  # returns, lines, invoice: nothing goes back into stock
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.quantity, 1)  # only the ordinary return above
+        self.assertEqual(list(StockMovement.objects.filter(batch=self.batch).values_list('quantity', flat=True)), [1])
+        self.assertEqual(SalesReturn.objects.filter(reason='Recall').count(), 3)
+        self.assertEqual(self.client.get(url).context['return_rows'], [])
+
+    def test_items_without_a_product_can_be_returned(self):
+        # The lock must skip the nullable product join, which PostgreSQL cannot lock.
+        item = SaleItem.objects.create(
+            invoice=self.items[0].invoice, item_name='Cotton wool', quantity=1, unit_price=Decimal('2.00'),
+        )
+        with transaction.atomic():
+            (sales_return,) = process_returns({item.id: 1})
+        self.assertEqual(sales_return.refund_amount, Decimal('2.00'))
+
+
+class ReceiptTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Analgesic')
+        cls.invoices = []
+        for lines in (1, 6):
+            invoice = SalesInvoice.objects.create(customer=Customer.objects.create(name='Ali', phone=f'0300{lines}'))
+            for i in range(lines):
+                product = Product.objects.create(
+                    brand=Brand.objects.create(name=f'Brand {lines}-{i}'), category=category, name=f'Item {i}',
+                )
+                SaleItem.objects.create(
+                    invoice=invoice, product=product, item_name=product.name, quantity=2, unit_price=Decimal('4.00'),
+                )
+            cls.invoices.append(invoice)
+
+    def setUp(self):
+        cache.clear()
+
+    def print_invoice(self, invoice):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('invoice_print', args=[invoice.id]))
+        return response.content.decode(), len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_lines(self):
+        small, small_queries = self.print_invoice(self.invoices[0])
+        large, large_queries = self.print_invoice(self.invoices[1])
+        self.assertIn('Brand 6-5', large)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_reprint_is_served_from_cache(self):
+        first, first_queries = self.print_invoice(self.invoices[1])
+        again, again_queries = self.print_invoice(self.invoices[1])
+        self.assertEqual(first, again)
+        self.assertEqual(again_queries, 1)
+        self.assertLess(again_queries, first_queries)
+
+    def test_return_invalidates_receipt(self):
+        invoice = self.invoices[1]
+        self.print_invoice(invoice)
+        item = invoice.items.first()
+        self.client.post(reverse('sales_return_create', args=[invoice.id]), {f'return_qty_{item.id}': 1})
+        html, _ = self.print_invoice(invoice)
+        self.assertIn('Returned', html)
+
+    def test_bulk_reprint_renders_the_date_range(self):
+        day = timezone.localdate().isoformat()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('invoice_reprint'), {'start': day, 'end': day})
+        self.assertEqual(len(response.context['receipts']), 2)
+        self.assertContains(response, self.invoices[0].invoice_number)
+        self.assertContains(response, self.invoices[1].invoice_number)
+        self.assertLessEqual(len(ctx.captured_queries), 6)
+
+
+class AllocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+        cls.late = cls.add_batch('LATE', 10, date(2031, 1, 1))
+        cls.soon = cls.add_batch('SOON', 3, date(2030, 1, 1))
+
+    @classmethod
+    def add_batch(cls, number, quantity, expiry):
+        return Batch.objects.create(
+            product=cls.product, batch_number=number, expiry_date=expiry,
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=quantity,
+        )
+
+    def plan(self, quantity, **line):
+        invoice = SalesInvoice(invoice_number='INV-TEST')
+        batches = load_batches([self.product.id])
+        items = [dict({'product_id': self.product.id, 'quantity': quantity, 'price': '8.00'}, **line)]
+        sale_items, movements = plan_sale_items(invoice, items, {self.product.id: self.product}, batches)
+        return sale_items, movements, batches[self.product.id]
+
+    def test_split_amount(self):
+        self.assertEqual(split_amount(Decimal('1.00'), [1, 1, 1]), [Decimal('0.33'), Decimal('0.33'), Decimal('0.34')])
+        self.assertEqual(split_amount(Decimal('0.05'), [3, 7]), [Decimal('0.02'), Decimal('0.03')])
+        self.assertEqual(split_amount(Decimal('0.01'), [1, 1, 1]), [Decimal('0.00'), Decimal('0.00'), Decimal('0.01')])
+        self.assertEqual(split_amount(Decimal('2.50'), [4]), [Decimal('2.50')])
+
+    def test_line_is_split_across_batches_in_fefo_order(self):
+        sale_items, movements, batches = self.plan(5)
+        self.assertEqual([(i.batch_id, i.quantity) for i in sale_items], [(self.soon.pk, 3), (self.late.pk, 2)])
+        self.assertEqual([(m.batch_id, m.quantity, m.reference) for m in movements], [
+            (self.soon.pk, -3, 'INV-TEST'), (self.late.pk, -2, 'INV-TEST'),
+        ])
+        self.assertEqual([b.quantity for b in batches], [0, 8])
+
+    def test_split_discount_and_tax_add_up_to_the_line(self):
+        for quantity, discount, tax in ((5, '1.00', '0.50'), (13, '0.07', '1.99'), (4, '0.01', '0')):
+            sale_items, _, _ = self.plan(quantity, discount_amount=discount, tax_amount=tax)
+            self.assertEqual(sum(i.discount_amount for i in sale_items), Decimal(discount))
+            self.assertEqual(sum(i.tax_amount for i in sale_items), Decimal(tax))
+            line = price_line(quantity, '8.00', discount_amount=discount, tax_amount=tax)
+            self.assertEqual(sum(i.total_amount for i in sale_items), line.total_amount)
+
+    def test_fixed_discount_is_not_applied_again_as_a_percentage(self):
+        sale_items, _, _ = self.plan(5, discount_amount='0.01', discount_percentage='10')
+        self.assertEqual([i.discount_amount for i in sale_items], [Decimal('0.01'), Decimal('0.00')])
+        self.assertEqual(sum(i.total_amount for i in sale_items), Decimal('39.99'))
+
+        sale_items, _, _ = self.plan(5, discount_percentage='10')
+        self.assertEqual([i.discount_amount for i in sale_items], [Decimal('2.4'), Decimal('1.6')])
+
+    def test_quantity_no_batch_covers_is_sold_without_a_batch(self):
+        sale_items, movements, batches = self.plan(15)
+        self.assertEqual(
+            [(i.batch_id, i.quantity) for i in sale_items], [(self.soon.pk, 3), (self.late.pk, 10), (None, 2)],
+        )
+        self.assertEqual(sum(m.quantity for m in movements), -13)
+        self.assertEqual([b.quantity for b in batches], [0, 0])
+
+    def test_stock_is_never_taken_twice(self):
+        _, movements, _ = self.plan(5)
+        Batch.objects.filter(pk=self.soon.pk).update(quantity=2)  # a sale the plan did not see
+        with self.assertRaises(StockChanged):
+            with transaction.atomic():
+                apply_movements(movements)
+        self.assertEqual(Batch.objects.get(pk=self.late.pk).quantity, 10)
+        self.assertFalse(StockMovement.objects.filter(movement_type=StockMovement.SALE).exists())
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+        cls.batch = Batch.objects.create(
+            product=cls.product, batch_number='KEY-1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=10,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def sell(self, key):
+        payload = {'items': [{'product_id': self.product.id, 'quantity': 2, 'price': '8.00'}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('create_sale_api'), json.dumps(payload), content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY=key,
+            )
+        return response.json()
+
+    def stock(self):
+        self.batch.refresh_from_db()
+        return self.batch.quantity, StockMovement.objects.count()
+
+    def test_replay_returns_the_original_sale(self):
+        first = self.sell('retry-1')
+        stock = self.stock()
+        replay = self.sell('retry-1')
+        self.assertEqual(replay, {'status': 'success', 'invoice_id': first['invoice_id'], 'replayed': True})
+        self.assertEqual(self.stock(), stock)
+        self.assertEqual(stock[0], 8)
+        self.assertEqual(SalesInvoice.objects.count(), 1)
+
+    @override_settings(SALES_IDEMPOTENCY_TTL_HOURS=1)
+    def test_expired_key_is_a_new_sale(self):
+        first = self.sell('old-key')
+        SaleRequestKey.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        second = self.sell('old-key')
+        self.assertNotIn('replayed', second)
+        self.assertNotEqual(second['invoice_id'], first['invoice_id'])
+        self.assertEqual(self.stock()[0], 6)
+        self.assertEqual(list(SaleRequestKey.objects.values_list('invoice_id', flat=True)), [second['invoice_id']])
+
+        SaleRequestKey.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(idempotency.purge_expired(force=True), 1)
+
+    def test_key_committed_by_a_concurrent_request(self):
+        first = self.sell('race')
+        stock = self.stock()
+        real_lookup = idempotency.lookup
+        calls = []
+
+        def racing_lookup(key):
+            # The first check runs before the other request commits the key.
+            calls.append(key)
+            return None if len(calls) == 1 else real_lookup(key)
+
+        with mock.patch.object(idempotency, 'lookup', side_effect=racing_lookup):
+            replay = self.sell('race')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(replay, {'status': 'success', 'invoice_id': first['invoice_id'], 'replayed': True})
+        self.assertEqual(self.stock(), stock)
+        self.assertEqual(SalesInvoice.objects.count(), 1)
+
+class SyncSalesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            brand=Brand.objects.create(name='Panadol'),
+            category=Category.objects.create(name='Analgesic'),
+            name='Paracetamol',
+        )
+        cls.batch = Batch.objects.create(
+            product=cls.product, batch_number='SYNC-1', expiry_date=date(2030, 1, 1),
+            purchase_price=Decimal('5.00'), sale_price=Decimal('8.00'), quantity=100,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def sale(self, key, quantity=1, **extra):
+        items = [{'type': 'product', 'product_id': self.product.id, 'quantity': quantity, 'price': '8.00'}]
+        return dict({'idempotency_key': key, 'items': items, 'grand_total': 8 * quantity}, **extra)
+
+    def sync(self, sales):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('sync_sales_api'), json.dumps({'sales': sales}), content_type='application/json',
+            )
+        return response.json()['results']
+
+    def stock(self):
+        self.batch.refresh_from_db()
+        return self.batch.quantity
+
+    def test_backlog_is_written_in_chunks(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                results = sync_sales([self.sale(f'k{n}') for n in range(5)], chunk_size=2)
+        self.assertEqual([r['status'] for r in results], ['success'] * 5)
+        self.assertEqual([r['idempotency_key'] for r in results], [f'k{n}' for n in range(5)])
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "sales_salesinvoice"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(SalesInvoice.objects.count(), 5)
+        self.assertEqual(self.stock(), 95)
+
+    def test_bad_sales_fail_alone(self):
+        missing = dict(self.sale('missing'), items=[{'type': 'product', 'product_id': 999999, 'quantity': 1, 'price': '8.00'}])
+        unwritable = self.sale('unwritable', discount_amount='lots')  # passes validation, fails on insert
+        results = self.sync([self.sale('a', 2), missing, unwritable, self.sale('b', 3)])
+        self.assertEqual([r['status'] for r in results], ['success', 'error', 'error', 'success'])
+        self.assertIn('999999', results[1]['message'])
+        self.assertEqual(SalesInvoice.objects.count(), 2)
+        self.assertEqual(self.stock(), 95)
+        self.assertEqual(
+            set(SaleItem.objects.values_list('invoice_id', flat=True)), {results[0]['invoice_id'], results[3]['invoice_id']},
+        )
+
+    def test_duplicate_keys_in_a_batch(self):
+        bad = self.sale('bad', quantity=0)
+        results = self.sync([self.sale('dup'), self.sale('dup'), bad, bad])
+        self.assertEqual(results[1], dict(results[0], replayed=True))
+        self.assertEqual([results[2]['status'], results[3]['status']], ['error', 'error'])
+        self.assertNotIn('replayed', results[3])
+        self.assertEqual(SalesInvoice.objects.count(), 1)
+        self.assertEqual(self.stock(), 99)
+
+        replay = self.sync([self.sale('dup')])
+        self.assertEqual(replay[0], dict(results[0], replayed=True))
+        self.assertEqual(self.stock(), 99)
+
+    def test_database_errors_are_retried(self):
+        with mock.patch('sales.utils.checkout._create_chunk', side_effect=OperationalError('database is locked')):
+            results = self.sync([self.sale('a'), self.sale('b')])
+        self.assertEqual([r['status'] for r in results], ['retry', 'retry'])
+        self.assertFalse(SalesInvoice.objects.exists())
+
+        results = self.sync([self.sale('a'), self.sale('b')])
+        self.assertEqual([r['status'] for r in results], ['success', 'success'])
+
+    def test_retried_chunk_keeps_its_rejected_sales(self):
+        with mock.patch('sales.utils.checkout.apply_movements', side_effect=StockChanged('Stock changed')):
+            results = self.sync([self.sale('good'), self.sale('bad', quantity=0)])
+        self.assertEqual([r['status'] for r in results], ['retry', 'error'])
+        self.assertNotEqual(results[1]['message'], 'Stock changed')
+        self.assertFalse(SalesInvoice.objects.exists())
+
+    def test_offline_date_is_kept_within_range(self):
+        now = timezone.now()
+        sold_at = now - timedelta(hours=3)
+        results = self.sync([
+            self.sale('past', date=sold_at.isoformat()),
+            self.sale('future', date=(now + timedelta(days=2)).isoformat()),
+            self.sale('ancient', date='2001-01-01T10:00:00Z'),
+            self.sale('garbage', date='2026-13-45T99:00:00'),
+        ])
+        dates = dict(SalesInvoice.objects.filter(pk__in=[r['invoice_id'] for r in results]).values_list('id', 'date'))
+        past, future, ancient, garbage = (dates[r['invoice_id']] for r in results)
+        self.assertEqual(past, sold_at)
+        self.assertLessEqual(future, timezone.now())
+        self.assertGreaterEqual(future, now)
+        self.assertGreaterEqual(ancient, now - OFFLINE_SALE_MAX_AGE)
+        self.assertLess(ancient, now - OFFLINE_SALE_MAX_AGE + timedelta(minutes=1))
+        self.assertGreaterEqual(garbage, now)
+
+    def test_online_sale_ignores_client_date(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('create_sale_api'), json.dumps(self.sale('online', date='2001-01-01T10:00:00Z')),
+                content_type='application/json',
+            )
+        invoice = SalesInvoice.objects.get(pk=response.json()['invoice_id'])
+        self.assertGreater(invoice.date, timezone.now() - timedelta(minutes=1))
+
+
+class InvoiceNumberTests(TestCase):
+    def test_numbers_are_sequential_per_series(self):
+        first = SalesInvoice.objects.create()
+        second = SalesInvoice.objects.create()
+        self.assertEqual([first.invoice_number, second.invoice_number], ['INV-000001', 'INV-000002'])
+
+    @override_settings(SALES_INVOICE_PREFIX='RX', SALES_INVOICE_YEARLY=True)
+    def test_yearly_series_with_prefix(self):
+        invoice = SalesInvoice.objects.create(date=timezone.make_aware(datetime(2026, 6, 1, 12)))
+        self.assertEqual(invoice.invoice_number, 'RX-2026-000001')
+        self.assertEqual(next_invoice_numbers(count=2, when=date(2027, 1, 5)), ['RX-2027-000001', 'RX-2027-000002'])
+
+
+class InvoiceNumberConcurrencyTests(TransactionTestCase):
+    terminals, sales_per_terminal = 8, 25
+
+    def setUp(self):
+        # SQLite's shared-cache memory test database fails with "table is locked"
+        # instead of waiting, so the terminals write to a file copy of it.
+        self.settings_dict = None
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            handle, path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(handle)
+            self.addCleanup(os.remove, path)
+            connection.ensure_connection()
+            copy = sqlite3.connect(path)
+            connection.connection.backup(copy)
+            copy.close()
+            self.settings_dict = {**connection.settings_dict, 'NAME': path}
+            self.wrapper = type(connections[DEFAULT_DB_ALIAS])
+
+    def run_terminals(self, make_invoice):
+        numbers, errors = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(self.terminals)
+
+        def terminal(index):
+            try:
+                if self.settings_dict:
+                    connections[DEFAULT_DB_ALIAS] = self.wrapper(self.settings_dict)
+                start.wait()
+                for sale in range(self.sales_per_terminal):
+                    invoice = make_invoice(index, sale)
+                    with lock:
+                        numbers.append(invoice.invoice_number)
+            except Exception as exc:  # surfaced by the assertion below
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=terminal, args=(index,)) for index in range(self.terminals)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return numbers
+
+    def test_concurrent_terminals_never_share_a_number(self):
+        numbers = self.run_terminals(lambda index, sale: SalesInvoice.objects.create())
+        total = self.terminals * self.sales_per_terminal
+        self.assertEqual(sorted(numbers), [f'INV-{n:06d}' for n in range(1, total + 1)])
+
+    @override_settings(SALES_INVOICE_PREFIX='RX', SALES_INVOICE_YEARLY=True)
+    def test_each_yearly_series_counts_on_its_own(self):
+        years = (2026, 2027)
+        numbers = self.run_terminals(
+            lambda index, sale: SalesInvoice.objects.create(
+                date=timezone.make_aware(datetime(years[(index + sale) % 2], 6, 1, 12)),
+            ),
+        )
+        per_year = self.terminals * self.sales_per_terminal // len(years)
+        for year in years:
+            self.assertEqual(
+                sorted(n for n in numbers if n.startswith(f'RX-{year}-')),
+                [f'RX-{year}-{n:06d}' for n in range(1, per_year + 1)],
+            )
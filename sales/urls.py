@@ -4,7 +4,13 @@ from . import views
 urlpatterns = [
     path('pos/', views.pos_view, name='pos'),
     path('api/search/', views.product_search_api, name='product_search_api'),
+    path('api/scan/', views.scan_api, name='scan_api'),
+    path('api/catalog/', views.catalog_api, name='catalog_api'),
+    path('api/customers/', views.customer_search_api, name='customer_search_api'),
     path('api/create/', views.create_sale_api, name='create_sale_api'),
+    path('api/sync/', views.sync_sales_api, name='sync_sales_api'),
     path('invoice/<int:invoice_id>/print/', views.invoice_print, name='invoice_print'),
+    path('invoices/reprint/', views.invoice_reprint, name='invoice_reprint'),
     path('invoice/<int:invoice_id>/return/', views.sales_return_create, name='sales_return_create'),
+    path('returns/batch/<int:batch_id>/', views.batch_recall_return, name='batch_recall_return'),
 ]
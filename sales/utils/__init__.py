@@ -0,0 +1 @@
+"""Utility helpers for the sales app."""
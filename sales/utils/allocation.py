@@ -0,0 +1,225 @@
+"""FEFO stock allocation for POS sales.
+
+A sale is allocated in a fixed number of queries: one for the products, one
+locked query for the batches the sale draws from, one ``bulk_create`` for
+the sale items and a fixed set of writes for the stock movements
+(``apply_movements``). The FEFO split itself is computed in memory, against
+the cached batch lists (``inventory.utils.batch_cache``); each product's
+FEFO head in the database (its in-stock batches up to the last one the
+split chose) is locked and compared with the split, and if the cache was
+behind the split is redone against every in-stock batch, locked.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db.models import Q
+
+from core.utils.pricing import apply_pricing
+from inventory.models import Batch, Product, StockMovement
+from inventory.utils import batch_cache
+from inventory.utils.stock import apply_movements
+from sales.models import SaleItem
+
+CENT = Decimal("0.01")
+
+
+def _decimal(value):
+    return Decimal(str(value or 0))
+
+
+def split_amount(amount, quantities):
+    """Split ``amount`` across ``quantities`` pro rata; the last part absorbs rounding."""
+    total_qty = sum(quantities)
+    parts = []
+    remaining = amount
+    for index, qty in enumerate(quantities):
+        if index == len(quantities) - 1 or not total_qty:
+            part = remaining
+        else:
+            part = (amount * qty / total_qty).quantize(CENT, rounding=ROUND_HALF_UP)
+        parts.append(part)
+        remaining -= part
+    return parts
+
+
+def product_ids_for(items_data):
+    ids = []
+    for index, item in enumerate(items_data, start=1):
+        if item.get("type") == "manual":
+            continue
+        try:
+            ids.append(int(item["product_id"]))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Item {index}: a product is required.")
+    return ids
+
+
+def clean_items(items_data, products):
+    """Validate ``items_data`` before planning so a bad line never half-consumes batches."""
+    for index, item in enumerate(items_data, start=1):
+        try:
+            quantity = int(item["quantity"])
+            Decimal(str(item["price"]))
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            raise ValueError(f"Item {index}: quantity and price are required.")
+        if quantity <= 0:
+            raise ValueError(f"Item {index}: quantity must be greater than zero.")
+        if item.get("type") == "manual":
+            if not item.get("name"):
+                raise ValueError(f"Item {index}: manual items need a name.")
+        elif int(item["product_id"]) not in products:
+            raise ValueError(f"Item {index}: product {item['product_id']} does not exist.")
+
+
+def load_products(product_ids):
+    products = Product.objects.in_bulk(set(product_ids))
+    missing = set(product_ids) - set(products)
+    if missing:
+        raise Product.DoesNotExist(f"Product {min(missing)} does not exist.")
+    return products
+
+
+def load_batches(product_ids):
+    """Lock and load the in-stock batches of every product in one query, FEFO ordered."""
+    batches = defaultdict(list)
+    queryset = (
+        Batch.objects.select_for_update()
+        .filter(product_id__in=set(product_ids), quantity__gt=0)
+        .order_by("product_id", "expiry_date", "id")
+    )
+    for batch in queryset:
+        batches[batch.product_id].append(batch)
+    return batches
+
+
+def cached_batches(product_ids):
+    """Unlocked FEFO batches per product from the batch cache, safe to consume while planning."""
+    return {pk: entry.batches(pk) for pk, entry in batch_cache.get_many(product_ids).items()}
+
+
+def lock_planned(sale_items, movements):
+    """Lock the FEFO head of the products a plan draws from; ``False`` unless the plan matches it.
+
+    The cache can be behind writes of another process: a batch received
+    there, or a quantity changed. For each product, the in-stock batches
+    up to the last one the plan takes must be exactly the planned ones,
+    each one before the last emptied, and none asked for more than it
+    holds. A plan that sold product stock without a batch is rejected
+    too: the cache may have missed a batch that could cover it.
+    """
+    if any(item.product_id and not item.batch_id for item in sale_items):
+        return False
+    takes = defaultdict(int)
+    last = {}
+    for movement in movements:
+        batch = movement.batch
+        takes[batch.pk] -= movement.quantity
+        current = last.get(batch.product_id)
+        if current is None or (batch.expiry_date, batch.pk) > (current.expiry_date, current.pk):
+            last[batch.product_id] = batch
+    if not takes:
+        return True
+    head = Q()
+    for product_id, batch in last.items():
+        head |= Q(product_id=product_id) & (
+            Q(expiry_date__lt=batch.expiry_date) | Q(expiry_date=batch.expiry_date, pk__lte=batch.pk)
+        )
+    locked = dict(
+        Batch.objects.select_for_update().filter(head, quantity__gt=0).values_list("id", "quantity")
+    )
+    if locked.keys() != takes.keys():
+        return False
+    ends = {batch.pk for batch in last.values()}
+    return all(
+        locked[pk] >= take if pk in ends else locked[pk] == take
+        for pk, take in takes.items()
+    )
+
+
+def plan_allocation(product_ids, plan):
+    """Run ``plan(batches) -> (sale_items, movements)`` against cached batches, falling back to locked ones."""
+    planned = plan(cached_batches(product_ids))
+    if lock_planned(*planned):
+        return planned
+    batch_cache.invalidate(product_ids)
+    return plan(load_batches(product_ids))
+
+
+def plan_sale_items(invoice, items_data, products, batches):
+    """Build unsaved SaleItems for ``items_data`` and the stock movements they need.
+
+    ``batches`` is consumed in place, so lines planned later (including lines
+    of other invoices planned against the same ``batches``) only see the stock
+    that is left. Quantity no batch can cover is sold without a batch, which
+    keeps the sale but leaves stock untouched. ``invoice`` must already have
+    its number, which the movements reference. Returns ``(sale_items, movements)``.
+    """
+    sale_items = []
+    movements = []
+    for item in items_data:
+        quantity = int(item["quantity"])
+        unit_price = _decimal(item["price"])
+
+        if item.get("type") == "manual":
+            sale_items.append(apply_pricing(SaleItem(
+                invoice=invoice,
+                item_name=item["name"],
+                quantity=quantity,
+                unit_price=unit_price,
+            )))
+            continue
+
+        product = products[int(item["product_id"])]
+        splits = []
+        remaining = quantity
+        for batch in batches.get(product.id, []):
+            if remaining <= 0:
+                break
+            if batch.quantity <= 0:
+                continue
+            take = min(batch.quantity, remaining)
+            batch.quantity -= take
+            movements.append(StockMovement(
+                batch=batch, product=product, movement_type=StockMovement.SALE,
+                quantity=-take, reference=invoice.invoice_number,
+            ))
+            splits.append((batch, take))
+            remaining -= take
+        if remaining > 0:
+            splits.append((None, remaining))
+
+        # Fixed amounts are split pro rata; a percentage discount applies to
+        # each split's own gross, which adds up to the same line total. A
+        # split whose share of a fixed discount rounds to nothing gets no
+        # percentage either, or apply_pricing would discount it again.
+        quantities = [qty for _, qty in splits]
+        line_discount = _decimal(item.get("discount_amount"))
+        discount_percentage = _decimal(item.get("discount_percentage"))
+        discounts = split_amount(line_discount, quantities)
+        taxes = split_amount(_decimal(item.get("tax_amount")), quantities)
+        for (batch, qty), part_discount, part_tax in zip(splits, discounts, taxes):
+            sale_items.append(apply_pricing(SaleItem(
+                invoice=invoice,
+                product=product,
+                batch=batch,
+                item_name=product.name,
+                quantity=qty,
+                unit_price=unit_price,
+                discount_percentage=discount_percentage if part_discount or not line_discount else Decimal(0),
+                discount_amount=part_discount,
+                tax_amount=part_tax,
+            )))
+    return sale_items, movements
+
+
+def allocate_sale(invoice, items_data):
+    """Allocate and write every line of ``invoice``; call inside ``transaction.atomic``."""
+    product_ids = product_ids_for(items_data)
+    products = load_products(product_ids)
+    clean_items(items_data, products)
+    sale_items, movements = plan_allocation(
+        product_ids, lambda batches: plan_sale_items(invoice, items_data, products, batches),
+    )
+    SaleItem.objects.bulk_create(sale_items)
+    apply_movements(movements)
+    return sale_items
@@ -0,0 +1,193 @@
+"""Turning POS payloads into invoices, one at a time or as an offline backlog."""
+from datetime import timedelta
+
+from django.db import IntegrityError, InterfaceError, OperationalError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.utils.transactions import write_atomic
+from inventory.models import Product
+from inventory.utils.stock import StockChanged, apply_movements
+from sales.models import Customer, SaleItem, SaleRequestKey, SalesInvoice
+from sales.utils import idempotency
+from sales.utils.allocation import clean_items, plan_allocation, plan_sale_items, product_ids_for
+from sales.utils.invoice_numbers import assign_invoice_numbers
+
+SYNC_CHUNK_SIZE = 50
+OFFLINE_SALE_MAX_AGE = timedelta(days=30)
+# The database was busy or unreachable, or the stock moved under the sale:
+# the sale is fine and the terminal should send it again.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, StockChanged)
+
+
+def resolve_customer(data):
+    customer_name = data.get("customer_name")
+    customer_phone = data.get("customer_phone")
+    customer = None
+    if customer_phone:
+        customer, created = Customer.objects.get_or_create(
+            phone=customer_phone,
+            defaults={"name": customer_name, "address": ""},
+        )
+        if not created and customer_name and customer.name != customer_name:
+            customer.name = customer_name
+            customer.save()
+    elif customer_name:
+        customer = Customer.objects.create(name=customer_name)
+    return customer
+
+
+def invoice_from_payload(data, customer, offline=False):
+    """Build an unsaved invoice; replayed ``offline`` sales keep the ``date`` they were rung up at."""
+    invoice = SalesInvoice(
+        customer=customer,
+        payment_mode=data.get("payment_mode", "CASH"),
+        discount_percentage=data.get("discount_percentage", 0),
+        discount_amount=data.get("discount_amount", 0),
+        sub_total=data.get("sub_total", 0),
+        tax_amount=data.get("tax_total", 0),
+        grand_total=data.get("grand_total", 0),
+        amount_paid=data.get("amount_paid", 0),
+        change_amount=data.get("change_amount", 0),
+    )
+    if offline:
+        invoice.date = offline_sale_date(data.get("date"), invoice.date)
+    return invoice
+
+
+def offline_sale_date(value, now):
+    """The terminal's clock is not trusted: its date is clamped to the last ``OFFLINE_SALE_MAX_AGE``."""
+    try:
+        sold_at = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        sold_at = None
+    if sold_at is None:
+        return now
+    if timezone.is_naive(sold_at):
+        sold_at = timezone.make_aware(sold_at)
+    return min(max(sold_at, now - OFFLINE_SALE_MAX_AGE), now)
+
+
+def _result(key, invoice_id=None, message=None, replayed=False, retry=False):
+    if message:
+        return {"idempotency_key": key, "status": "retry" if retry else "error", "message": message}
+    result = {"idempotency_key": key, "status": "success", "invoice_id": invoice_id}
+    if replayed:
+        result["replayed"] = True
+    return result
+
+
+def sync_sales(sales, chunk_size=SYNC_CHUNK_SIZE):
+    """Create a backlog of queued sales; returns one result per sale, in order.
+
+    A sale's status is ``success``, ``error`` when the sale itself is bad
+    and will never go in, or ``retry`` when the database failed and the
+    terminal should keep it queued and send it again.
+    """
+    results = []
+    for start in range(0, len(sales), chunk_size):
+        results.extend(_sync_chunk(sales[start:start + chunk_size]))
+    return results
+
+
+def _sync_chunk(sales):
+    results = [None] * len(sales)
+    first_index = {}
+    pending = []
+    for index, data in enumerate(sales):
+        key = str(data.get("idempotency_key") or "").strip() if isinstance(data, dict) else ""
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            results[index] = _result(key, message="Each queued sale needs an idempotency_key.")
+        elif key in first_index:
+            continue  # answered from the first copy below
+        else:
+            first_index[key] = index
+            pending.append((index, data, key))
+
+    recorded = idempotency.lookup_many(key for _, _, key in pending)
+    to_create = []
+    for index, data, key in pending:
+        if key in recorded:
+            results[index] = _result(key, recorded[key], replayed=True)
+            continue
+        try:
+            to_create.append((index, data, key, product_ids_for(data.get("items", []))))
+        except ValueError as exc:
+            results[index] = _result(key, message=str(exc))
+
+    if to_create:
+        try:
+            with write_atomic():
+                _create_chunk(to_create, results)
+        except TRANSIENT_ERRORS as exc:
+            for index, _, key, _ in to_create:
+                # Sales rejected by validation stay rejected; only the rolled back writes are retried.
+                if not results[index] or results[index]["status"] != "error":
+                    results[index] = _result(key, message=str(exc), retry=True)
+        except Exception:
+            # The chunk rolled back; write its sales one at a time so only the bad one fails.
+            for entry in to_create:
+                results[entry[0]] = None
+                _create_one(entry, results)
+
+    for index, data in enumerate(sales):
+        if results[index] is None:
+            key = str(data.get("idempotency_key")).strip()
+            first = results[first_index[key]]
+            results[index] = dict(first, replayed=True) if first["status"] == "success" else dict(first)
+    return results
+
+
+def _create_one(entry, results):
+    index, _, key, _ = entry
+    try:
+        with write_atomic():
+            _create_chunk([entry], results)
+    except IntegrityError as exc:
+        # Another request recorded the key first, or took the same invoice number.
+        recorded = idempotency.lookup(key)
+        if recorded:
+            results[index] = _result(key, recorded, replayed=True)
+        else:
+            results[index] = _result(key, message=str(exc), retry=True)
+    except TRANSIENT_ERRORS as exc:
+        results[index] = _result(key, message=str(exc), retry=True)
+    except Exception as exc:
+        results[index] = _result(key, message=str(exc))
+
+
+def _create_chunk(to_create, results):
+    """Write every valid sale of a chunk with shared product and batch loading."""
+    products = Product.objects.in_bulk({pk for *_, ids in to_create for pk in ids})
+    valid = []
+    for index, data, key, ids in to_create:
+        try:
+            clean_items(data.get("items", []), products)
+        except ValueError as exc:
+            results[index] = _result(key, message=str(exc))
+            continue
+        valid.append((index, data, key, ids))
+    if not valid:
+        return
+
+    invoices = [invoice_from_payload(data, resolve_customer(data), offline=True) for _, data, _, _ in valid]
+    assign_invoice_numbers(invoices)
+    SalesInvoice.objects.bulk_create(invoices)
+
+    def plan(batches):
+        sale_items = []
+        movements = []
+        for invoice, (_, data, _, _) in zip(invoices, valid):
+            items, invoice_movements = plan_sale_items(invoice, data.get("items", []), products, batches)
+            sale_items.extend(items)
+            movements.extend(invoice_movements)
+        return sale_items, movements
+
+    sale_items, movements = plan_allocation({pk for *_, ids in valid for pk in ids}, plan)
+    SaleItem.objects.bulk_create(sale_items)
+    apply_movements(movements)
+    SaleRequestKey.objects.bulk_create([
+        SaleRequestKey(key=key, invoice=invoice) for invoice, (_, _, key, _) in zip(invoices, valid)
+    ])
+    for invoice, (index, _, key, _) in zip(invoices, valid):
+        results[index] = _result(key, invoice.id)
@@ -0,0 +1,186 @@
+"""In-process prefix index over customer phones and names for the POS typeahead.
+
+The index is a sorted list of ``(key, customer_id)`` pairs searched with
+``bisect``; keys are normalized phone numbers, full names and each word of
+a name. It is built on the first search in a process and patched on every
+Customer save or delete (``sales/signals.py``). A version counter in the
+cache tells other processes that their copy is stale and must be rebuilt;
+that only reaches them with a shared cache backend, so an index older than
+``CUSTOMER_INDEX_SECONDS`` (default 60) is also rebuilt, in a background
+thread: searches keep using the current copy until the new one is swapped
+in, so no keystroke waits for the full table scan.
+"""
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from sales.models import Customer
+
+VERSION_KEY = "sales:customer_index:version"
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def normalize_phone(value):
+    digits = _NON_DIGITS.sub("", value or "")
+    # +92 300 1234567 and 0300-1234567 are the same number
+    if digits.startswith("92") and len(digits) == 12:
+        digits = "0" + digits[2:]
+    return digits
+
+
+def normalize_name(value):
+    return " ".join((value or "").lower().split())
+
+
+def _keys(name, phone):
+    keys = set()
+    phone_key = normalize_phone(phone)
+    if phone_key:
+        keys.add(phone_key)
+        keys.add(_NON_DIGITS.sub("", phone))
+    name_key = normalize_name(name)
+    if name_key:
+        keys.add(name_key)
+        keys.update(name_key.split())
+    return keys
+
+
+def max_age():
+    return getattr(settings, "CUSTOMER_INDEX_SECONDS", 60)
+
+
+def _shared_version():
+    cache.add(VERSION_KEY, 0, None)
+    return cache.get(VERSION_KEY)
+
+
+class CustomerPrefixIndex:
+    def __init__(self):
+        self._entries = []
+        self._records = {}
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self.version = None
+        self.built_at = 0.0
+
+    def build(self):
+        # Read first: a patch applied during the scan bumps the version past it, forcing another build
+        version = _shared_version()
+        entries = []
+        records = {}
+        for pk, name, phone in Customer.objects.values_list("id", "name", "phone").iterator():
+            records[pk] = (name, phone)
+            entries.extend((key, pk) for key in _keys(name, phone))
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._records = records
+            self.version = version
+            self.built_at = time.monotonic()
+
+    def _refresh(self):
+        try:
+            self.build()
+        finally:
+            connection.close()  # this thread's connection
+            self._refreshing.release()
+
+    def _refresh_in_background(self):
+        """Rebuild an old index in a thread, one at a time."""
+        if self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _remove(self, pk):
+        record = self._records.pop(pk, None)
+        if record is None:
+            return
+        for key in _keys(*record):
+            index = bisect.bisect_left(self._entries, (key, pk))
+            if index < len(self._entries) and self._entries[index] == (key, pk):
+                del self._entries[index]
+
+    def _apply(self, change):
+        """Run ``change`` under the lock and move to the next shared version."""
+        if self.version is None:
+            return
+        with self._lock:
+            change()
+            expected = self.version + 1
+            try:
+                current = cache.incr(VERSION_KEY)
+            except ValueError:
+                current = None
+            # Another process changed customers too: rebuild on next search.
+            self.version = current if current == expected else None
+
+    def update(self, pk, name, phone):
+        def change():
+            self._remove(pk)
+            self._records[pk] = (name, phone)
+            for key in _keys(name, phone):
+                bisect.insort(self._entries, (key, pk))
+        self._apply(change)
+
+    def remove(self, pk):
+        self._apply(lambda: self._remove(pk))
+
+    def _scan(self, prefix):
+        entries = self._entries
+        for index in range(bisect.bisect_left(entries, (prefix,)), len(entries)):
+            key, pk = entries[index]
+            if not key.startswith(prefix):
+                break
+            yield pk
+
+    def _matches(self, query, stop):
+        """Customer ids matching ``query``, in key order, at most ``stop`` of them."""
+        digits = _NON_DIGITS.sub("", query)
+        words = normalize_name(query).split()
+        if digits and len(digits) == len(query.replace(" ", "").lstrip("+").replace("-", "")):
+            prefixes = [normalize_phone(query), digits]
+            words = []
+        else:
+            prefixes = [" ".join(words)]
+        matched = []
+        seen = set()
+        with self._lock:
+            for prefix in prefixes:
+                for pk in self._scan(prefix):
+                    if pk not in seen:
+                        seen.add(pk)
+                        matched.append(pk)
+                        if len(matched) >= stop:
+                            return self._rows(matched)
+            if len(words) > 1:
+                # "ali kh" also finds "Khan Ali": every word must start a word of the name
+                for pk in self._scan(words[0]):
+                    if pk in seen:
+                        continue
+                    name_words = normalize_name(self._records[pk][0]).split()
+                    if all(any(w.startswith(word) for w in name_words) for word in words):
+                        seen.add(pk)
+                        matched.append(pk)
+                        if len(matched) >= stop:
+                            break
+            return self._rows(matched)
+
+    def _rows(self, ids):
+        return [{"id": pk, "name": self._records[pk][0], "phone": self._records[pk][1]} for pk in ids]
+
+    def search(self, query, limit=10, offset=0):
+        """Return ``(results, has_more)`` for customers whose phone or name starts with ``query``."""
+        if self.version is None or self.version != cache.get(VERSION_KEY):
+            self.build()
+        elif time.monotonic() - self.built_at >= max_age():
+            self._refresh_in_background()
+        rows = self._matches((query or "").strip(), offset + limit + 1)
+        return rows[offset:offset + limit], len(rows) > offset + limit
+
+
+customer_index = CustomerPrefixIndex()
@@ -0,0 +1,60 @@
+"""Idempotency keys for sale submission.
+
+A POS client sends the same ``Idempotency-Key`` header when it retries a
+sale. The key is stored in the same transaction as the invoice, so a
+replay either finds the committed invoice or the sale never happened.
+Keys expire after ``SALES_IDEMPOTENCY_TTL_HOURS``.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from sales.models import SaleRequestKey
+
+MAX_KEY_LENGTH = 64
+PURGE_INTERVAL_SECONDS = 3600
+
+
+def request_key(request, data):
+    key = (request.headers.get("Idempotency-Key") or data.get("idempotency_key") or "").strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency key must be at most {MAX_KEY_LENGTH} characters.")
+    return key or None
+
+
+def _cutoff():
+    return timezone.now() - timedelta(hours=getattr(settings, "SALES_IDEMPOTENCY_TTL_HOURS", 24))
+
+
+def purge_expired(force=False):
+    """Delete expired keys; runs at most once an hour per cache unless ``force``."""
+    if force or cache.add("sales:idempotency:purge", 1, PURGE_INTERVAL_SECONDS):
+        return SaleRequestKey.objects.filter(created_at__lt=_cutoff()).delete()[0]
+    return 0
+
+
+def lookup(key):
+    """Return the invoice id recorded for ``key``, or ``None`` if unknown or expired."""
+    row = SaleRequestKey.objects.filter(key=key).values_list("invoice_id", "created_at").first()
+    if row is None:
+        return None
+    invoice_id, created_at = row
+    if created_at < _cutoff():
+        SaleRequestKey.objects.filter(key=key).delete()
+        return None
+    return invoice_id
+
+
+def lookup_many(keys):
+    """Return ``{key: invoice_id}`` for the unexpired ``keys`` in one query."""
+    return dict(
+        SaleRequestKey.objects.filter(key__in=set(keys), created_at__gte=_cutoff())
+        .values_list("key", "invoice_id")
+    )
+
+
+def remember(key, invoice):
+    """Record ``key`` for ``invoice``; call inside the transaction that created the invoice."""
+    SaleRequestKey.objects.create(key=key, invoice=invoice)
@@ -0,0 +1,67 @@
+"""Invoice number allocation.
+
+Each series is a single ``InvoiceSequence`` row bumped with ``F()``. The
+UPDATE locks the row until the surrounding transaction commits, so
+concurrent POS terminals are serialized on that one row instead of racing
+on ``MAX(id)``, and a rolled back sale gives its number back.
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from sales.models import InvoiceSequence
+
+
+def _series(when=None):
+    prefix = getattr(settings, "SALES_INVOICE_PREFIX", "INV")
+    year = 0
+    if getattr(settings, "SALES_INVOICE_YEARLY", False):
+        if isinstance(when, datetime):
+            when = timezone.localtime(when) if timezone.is_aware(when) else when
+        year = (when or timezone.localdate()).year
+    return prefix, year
+
+
+def format_invoice_number(prefix, year, value):
+    if year:
+        return f"{prefix}-{year}-{value:06d}"
+    return f"{prefix}-{value:06d}"
+
+
+def reserve(prefix, year=0, count=1):
+    """Reserve ``count`` consecutive values of a series and return the first."""
+    with transaction.atomic():
+        series = InvoiceSequence.objects.filter(prefix=prefix, year=year)
+        if not series.update(last_value=F("last_value") + count):
+            try:
+                with transaction.atomic():
+                    InvoiceSequence.objects.create(prefix=prefix, year=year, last_value=count)
+                return 1
+            except IntegrityError:
+                # Another terminal created the row first.
+                series.update(last_value=F("last_value") + count)
+        last_value = series.values_list("last_value", flat=True).get()
+    return last_value - count + 1
+
+
+def next_invoice_numbers(count=1, when=None):
+    """Return ``count`` new invoice numbers for the configured series."""
+    prefix, year = _series(when)
+    first = reserve(prefix, year, count)
+    return [format_invoice_number(prefix, year, value) for value in range(first, first + count)]
+
+
+def assign_invoice_numbers(invoices):
+    """Number unsaved ``invoices`` with one reservation per series, ready for ``bulk_create``."""
+    by_series = {}
+    for invoice in invoices:
+        if not invoice.invoice_number:
+            by_series.setdefault(_series(invoice.date), []).append(invoice)
+    for (prefix, year), series_invoices in by_series.items():
+        first = reserve(prefix, year, len(series_invoices))
+        for offset, invoice in enumerate(series_invoices):
+            invoice.invoice_number = format_invoice_number(prefix, year, first + offset)
+    return invoices
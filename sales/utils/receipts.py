@@ -0,0 +1,51 @@
+"""Rendered receipt cache for invoice printing.
+
+A receipt is rendered once and cached under the invoice id and its
+``updated_at``. Anything that changes what the receipt shows (a return is
+posted, the invoice is edited) moves ``updated_at``, so the next print
+misses the cache and renders again; stale entries simply expire.
+Uncached receipts are rendered from ``receipt_queryset``, which loads
+the invoice, customer, lines, products, brands and returns in a fixed
+number of queries however many receipts are rendered.
+"""
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from sales.models import SaleItem, SalesInvoice, SalesReturn
+
+RECEIPT_TEMPLATE = "sales/_receipt.html"
+# Bump when the receipt template changes so cached HTML is not reused.
+RECEIPT_VERSION = 1
+RECEIPT_CACHE_SECONDS = 24 * 3600
+
+
+def receipt_queryset():
+    return SalesInvoice.objects.select_related("customer").prefetch_related(
+        Prefetch("items", queryset=SaleItem.objects.select_related("product__brand").order_by("id")),
+        Prefetch("returns", queryset=SalesReturn.objects.order_by("date", "id")),
+    )
+
+
+def cache_key(invoice_id, updated_at):
+    return f"sales:receipt:v{RECEIPT_VERSION}:{invoice_id}:{updated_at.timestamp()}"
+
+
+def render_receipts(invoices):
+    """Return the receipt HTML for each ``(id, updated_at)`` pair, in order.
+
+    Cached receipts come from one ``get_many``; the rest are loaded
+    together, rendered and stored with one ``set_many``.
+    """
+    keys = [cache_key(pk, updated_at) for pk, updated_at in invoices]
+    html = cache.get_many(keys)
+    missing = {pk: key for (pk, _), key in zip(invoices, keys) if key not in html}
+    if missing:
+        rendered = {}
+        for invoice in receipt_queryset().filter(pk__in=missing):
+            key = missing[invoice.pk]
+            rendered[key] = render_to_string(RECEIPT_TEMPLATE, {"invoice": invoice})
+        cache.set_many(rendered, RECEIPT_CACHE_SECONDS)
+        html.update(rendered)
+    return [html[key] for key in keys if key in html]
+
@@ -0,0 +1,118 @@
+"""Sales returns: validation against one annotated query, restock in bulk.
+
+Returned quantities are checked against ``available_qty`` read from the
+locked sale items, the return lines go in with one ``bulk_create`` and the
+restock goes through ``apply_movements`` (grouped ``F()`` updates), so a
+return never overwrites stock that a concurrent sale just changed.
+Recalled units are refunded without a restock: they must not be sold again.
+"""
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import StockMovement
+from inventory.utils.stock import apply_movements
+from sales.models import SaleItem, SalesInvoice, SalesReturn, SalesReturnItem
+
+CENT = Decimal("0.01")
+
+
+def with_returned_quantities(queryset):
+    """Annotate sale items with ``returned_qty`` and ``available_qty``."""
+    returned = (
+        SalesReturnItem.objects.filter(sale_item=OuterRef("pk"))
+        .order_by().values("sale_item").annotate(total=Sum("quantity")).values("total")
+    )
+    return queryset.annotate(returned_qty=Coalesce(Subquery(returned), 0)).annotate(
+        available_qty=F("quantity") - F("returned_qty"),
+    )
+
+
+def unit_refund(item):
+    if item.quantity and item.total_amount:
+        return (item.total_amount / item.quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+    return Decimal(item.unit_price or 0).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def display_name(item):
+    return item.item_name or (item.product.name if item.product else "Item")
+
+
+def return_rows(queryset):
+    """Rows for a return form: one per sale item, with what can still be returned."""
+    return [
+        {
+            "item": item,
+            "display_name": display_name(item),
+            "returned_qty": item.returned_qty,
+            "available_qty": item.available_qty,
+            "unit_refund": unit_refund(item),
+        }
+        for item in with_returned_quantities(queryset.select_related("product", "batch"))
+    ]
+
+
+def process_returns(quantities, reason="", restock=True):
+    """Return ``{sale_item_id: quantity}`` across any number of invoices.
+
+    Creates one SalesReturn per invoice; the units go back to their batch
+    unless ``restock`` is false. Call inside ``transaction.atomic``;
+    raises ``ValueError`` listing every line that cannot be returned, in
+    which case nothing is written. Returns the created SalesReturns.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+    if not quantities:
+        raise ValueError("Select at least one item to return.")
+
+    # Lock only the sale items: FOR UPDATE cannot lock the nullable side of the product outer join.
+    items = list(
+        with_returned_quantities(SaleItem.objects.select_for_update(of=("self",)).filter(pk__in=quantities))
+        .select_related("product").order_by("invoice_id", "id")
+    )
+    errors = [f"Sale item {pk} does not exist." for pk in sorted(set(quantities) - {i.pk for i in items})]
+    errors += [
+        f"Return quantity for {display_name(item)} exceeds available."
+        for item in items if quantities[item.pk] > item.available_qty
+    ]
+    if errors:
+        raise ValueError(*errors)
+
+    lines_by_invoice = defaultdict(list)
+    for item in items:
+        qty = quantities[item.pk]
+        refund = unit_refund(item)
+        lines_by_invoice[item.invoice_id].append(SalesReturnItem(
+            sale_item=item,
+            quantity=qty,
+            unit_refund=refund,
+            total_amount=(refund * qty).quantize(CENT, rounding=ROUND_HALF_UP),
+        ))
+
+    sales_returns = SalesReturn.objects.bulk_create([
+        SalesReturn(
+            invoice_id=invoice_id,
+            reason=reason,
+            refund_amount=sum((line.total_amount for line in lines), Decimal("0.00")),
+        )
+        for invoice_id, lines in lines_by_invoice.items()
+    ])
+    return_items = []
+    movements = []
+    for sales_return, lines in zip(sales_returns, lines_by_invoice.values()):
+        for line in lines:
+            line.sales_return = sales_return
+            return_items.append(line)
+            if restock and line.sale_item.batch_id:
+                movements.append(StockMovement(
+                    batch_id=line.sale_item.batch_id, product_id=line.sale_item.product_id,
+                    movement_type=StockMovement.RETURN, quantity=line.quantity,
+                    reference=f"RET-{sales_return.pk}",
+                ))
+    SalesReturnItem.objects.bulk_create(return_items)
+    apply_movements(movements)
+    # Receipts are cached by updated_at (sales/utils/receipts.py); they now show the return.
+    SalesInvoice.objects.filter(pk__in=lines_by_invoice).update(updated_at=timezone.now())
+    return sales_returns
@@ -1,259 +1,236 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
-from django.db.models import Sum
+from django.db import IntegrityError
 from django.urls import reverse
 from django.contrib import messages
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.safestring import mark_safe
 import json
-from decimal import Decimal, ROUND_HALF_UP
-from .models import SalesInvoice, SaleItem, Customer, SalesReturn, SalesReturnItem
-from inventory.models import Product, Batch
-from django.db.models import Q
+from .models import SaleItem, SalesInvoice, SalesReturn
+from core.utils.dates import on_day
+from core.utils.transactions import write_atomic
+from inventory.models import Batch, Product
+from inventory.utils import batch_cache, catalog
+from inventory.utils.scan import resolve_scan
+from inventory.utils.search_index import search_products
+from .utils import idempotency
+from .utils.allocation import allocate_sale
+from .utils.checkout import invoice_from_payload, resolve_customer, sync_sales
+from .utils.customer_index import customer_index
+from .utils.receipts import render_receipts
+from .utils.returns import process_returns, return_rows
+
+MAX_REPRINT = 500
 
 def pos_view(request):
-    customers = list(Customer.objects.values('id', 'name', 'phone'))
-    customers_json = json.dumps(customers)
-    context = {'customers_json': customers_json}
-    return render(request, 'sales/pos.html', context)
+    # Customers are looked up through customer_search_api as the cashier types.
+    return render(request, 'sales/pos.html')
+
+def customer_search_api(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit and offset must be integers'}, status=400)
+    if not query:
+        return JsonResponse({'results': [], 'has_more': False, 'next_offset': None})
+
+    results, has_more = customer_index.search(query, limit=limit, offset=offset)
+    return JsonResponse({
+        'results': results,
+        'has_more': has_more,
+        'next_offset': offset + limit if has_more else None,
+    })
 
 def invoice_print(request, invoice_id):
-    invoice = get_object_or_404(SalesInvoice.objects.prefetch_related('items'), id=invoice_id)
-    return render(request, 'sales/invoice_print.html', {'invoice': invoice})
+    invoice = get_object_or_404(SalesInvoice.objects.only('id', 'invoice_number', 'updated_at'), id=invoice_id)
+    receipt = render_receipts([(invoice.id, invoice.updated_at)])[0]
+    return render(request, 'sales/invoice_print.html', {'invoice': invoice, 'receipt': mark_safe(receipt)})
+
+def invoice_reprint(request):
+    """Print every receipt from ``start`` to ``end`` (inclusive dates) on one page."""
+    today = timezone.localdate()
+    try:
+        start = parse_date(request.GET.get('start', '')) or today
+        end = parse_date(request.GET.get('end', '')) or start
+    except ValueError:
+        start = end = today
+    invoices = list(
+        SalesInvoice.objects.filter(**on_day('date', start, end)).order_by('date', 'id').values_list('id', 'updated_at')[:MAX_REPRINT + 1]
+    )
+    truncated = len(invoices) > MAX_REPRINT
+    receipts = [mark_safe(html) for html in render_receipts(invoices[:MAX_REPRINT])]
+    context = {'receipts': receipts, 'start': start, 'end': end, 'truncated': truncated, 'max_reprint': MAX_REPRINT}
+    return render(request, 'sales/invoice_reprint.html', context)
 
 def product_search_api(request):
     query = request.GET.get('q', '')
-    products = Product.objects.filter(
-        Q(name__icontains=query) | 
-        Q(brand__name__icontains=query) |
-        Q(category__name__icontains=query)
-    )[:20]
-    
-    results = []
-    for p in products:
-        # Get available stock
-        batches = p.batches.filter(quantity__gt=0).order_by('expiry_date')
-        total_qty = sum(b.quantity for b in batches)
-        
-        # Get price (use latest purchase price or manual sale price)
-        # For simplicity, using the sale_price of the first available batch or a default
-        price = 0
-        if batches.exists():
-            price = batches.first().sale_price or 0
-        
-        results.append({
-            'id': p.id,
-            'name': p.name,
-            'brand': p.brand.name,
-            'stock': total_qty,
-            'price': float(price),
-            'tax': float(p.tax_percentage)
-        })
-    
-    return JsonResponse({'results': results})
+    # FEFO price and expiry come from the batch cache, so the result set costs
+    # a fixed number of queries however many products match (none when cached).
+    products = batch_cache.annotate(search_products(query, queryset=Product.objects.select_related('brand'), limit=20))
+
+    return JsonResponse({'results': [_product_row(p) for p in products]})
+
+def _product_row(p):
+    return {
+        'id': p.id,
+        'name': p.name,
+        'brand': p.brand.name,
+        'stock': p.stock,
+        'price': float(p.fefo_price or 0),
+        'expiry': p.fefo_expiry.isoformat() if p.fefo_expiry else None,
+        'tax': float(p.tax_percentage)
+    }
+
+def scan_api(request):
+    """Resolve a scanned barcode (plain GTIN or GS1 with lot/expiry) in one query."""
+    scan, product = resolve_scan(request.GET.get('code', ''))
+    if product is None:
+        return JsonResponse({'status': 'error', 'message': f'No product has barcode {scan.code or "(empty)"}.'}, status=404)
+    row = _product_row(product)
+    row.update(pack_quantity=product.pack_quantity, batch_id=product.fefo_batch)
+    if scan.lot:
+        expiry = product.lot_expiry or scan.expiry
+        row['lot'] = {
+            'batch_number': scan.lot,
+            'batch_id': product.lot_batch,
+            'quantity': product.lot_quantity,
+            'expiry': expiry.isoformat() if expiry else None,
+            'expired': bool(expiry and expiry < timezone.localdate()),
+        }
+    return JsonResponse({'status': 'success', 'product': row})
+
+def catalog_api(request):
+    """Catalog rows changed since ``since``; the POS searches its local copy."""
+    try:
+        since = catalog.parse_cursor(request.GET.get('since'))
+        after = max(int(request.GET.get('after', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', catalog.PAGE_SIZE)), 1), 5000)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    catalog.purge_tombstones()
+    return JsonResponse(catalog.catalog_page(since=since, after=after, limit=limit))
 
 @csrf_exempt
-@transaction.atomic
 def create_sale_api(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             print("Received sale data:", data) # Debug log
-            
-            # Handle Customer
-            customer_name = data.get('customer_name')
-            customer_phone = data.get('customer_phone')
-            customer = None
-            if customer_phone:
-                customer, created = Customer.objects.get_or_create(
-                    phone=customer_phone,
-                    defaults={'name': customer_name, 'address': ''}
-                )
-                if not created and customer_name:
-                     customer.name = customer_name
-                     customer.save()
-            elif customer_name:
-                 customer = Customer.objects.create(name=customer_name)
 
-            # Create Invoice
-            invoice = SalesInvoice.objects.create(
-                customer=customer,
-                payment_mode=data.get('payment_mode', 'CASH'),
-                discount_percentage=data.get('discount_percentage', 0),
-                discount_amount=data.get('discount_amount', 0),
-                sub_total=data.get('sub_total', 0),
-                tax_amount=data.get('tax_total', 0),
-                grand_total=data.get('grand_total', 0),
-                amount_paid=data.get('amount_paid', 0),
-                change_amount=data.get('change_amount', 0)
-            )
-            
-            items_data = data.get('items', [])
-            for item in items_data:
-                # CHECK IF MANUAL ITEM
-                if item.get('type') == 'manual':
-                     SaleItem.objects.create(
-                        invoice=invoice,
-                        product=None,
-                        batch=None,
-                        item_name=item['name'],
-                        quantity=int(item['quantity']),
-                        unit_price=item['price'],
-                        total_amount=float(item['quantity']) * float(item['price'])
-                     )
-                     continue
+            # A retried request replays the original response instead of selling twice
+            key = idempotency.request_key(request, data)
+            if key:
+                idempotency.purge_expired()
+                invoice_id = idempotency.lookup(key)
+                if invoice_id:
+                    return JsonResponse({'status': 'success', 'invoice_id': invoice_id, 'replayed': True})
+
+            with write_atomic():
+                customer = resolve_customer(data)
+                invoice = invoice_from_payload(data, customer)
+                invoice.save()
+
+                # FEFO allocation: batches are loaded, split and written in bulk.
+                allocate_sale(invoice, data.get('items', []))
+                if key:
+                    idempotency.remember(key, invoice)
 
-                # NORMAL INVENTORY ITEM
-                product = Product.objects.get(id=item['product_id'])
-                qty_needed = int(item['quantity'])
-                
-                # FIFO Strategy: Find batches
-                batches = product.batches.filter(quantity__gt=0).order_by('expiry_date')
-                
-                qty_remaining = qty_needed
-                
-                for batch in batches:
-                    if qty_remaining <= 0:
-                        break
-                    
-                    take_qty = min(batch.quantity, qty_remaining)
-                    
-                    # Create Sale Item for this batch
-                    SaleItem.objects.create(
-                        invoice=invoice,
-                        product=product,
-                        batch=batch,
-                        quantity=take_qty,
-                        unit_price=item['price'],
-                        discount_percentage=item.get('discount_percentage', 0),
-                        discount_amount=item.get('discount_amount', 0),
-                        tax_amount=item.get('tax_amount', 0),
-                        total_amount=item.get('total', 0) # This might need splitting if multiple batches
-                    )
-                    
-                    # Updates stock
-                    batch.quantity -= take_qty
-                    batch.save()
-                    
-                    qty_remaining -= take_qty
-                
-                # Handle case where stock was insufficient (Negative stock? Or just error?)
-                # Requirement said: "Products can be sold even if: Not in inventory"
-                if qty_remaining > 0:
-                     # Create a dummy or separate logic for negative stock. 
-                     # For now, we just sell what we have or error?
-                     # User explicitly said "even if Not in inventory".
-                     # So we might need a dummy batch or allow negative on the last batch.
-                     # Let's pick the last batch and go negative.
-                     if batches.exists():
-                         last_batch = batches.last()
-                         SaleItem.objects.create(
-                            invoice=invoice,
-                            product=product,
-                            batch=last_batch,
-                            quantity=qty_remaining,
-                            unit_price=item['price']
-                         )
-                         last_batch.quantity -= qty_remaining
-                         last_batch.save()
-            
             return JsonResponse({'status': 'success', 'invoice_id': invoice.id})
+        except IntegrityError as e:
+            # The same key committed on a concurrent retry; answer with that sale.
+            invoice_id = idempotency.lookup(key) if key else None
+            if invoice_id:
+                return JsonResponse({'status': 'success', 'invoice_id': invoice_id, 'replayed': True})
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
         except Exception as e:
             import traceback
             traceback.print_exc() # Print full stack trace
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     return JsonResponse({'status': 'error', 'message': 'Invalid method'}, status=405)
 
-def sales_return_create(request, invoice_id):
-    invoice = get_object_or_404(
-        SalesInvoice.objects.select_related('customer').prefetch_related('items', 'items__product', 'items__batch'),
-        id=invoice_id
-    )
-    sale_items = invoice.items.select_related('product', 'batch').annotate(
-        returned_qty=Sum('return_items__quantity')
-    )
-
-    return_rows = []
-    for item in sale_items:
-        returned_qty = item.returned_qty or 0
-        available_qty = item.quantity - returned_qty
-        if item.quantity and item.total_amount:
-            unit_refund = (item.total_amount / item.quantity).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        else:
-            unit_refund = Decimal(item.unit_price or 0).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        display_name = item.item_name or (item.product.name if item.product else "Item")
-        return_rows.append({
-            'item': item,
-            'display_name': display_name,
-            'returned_qty': returned_qty,
-            'available_qty': available_qty,
-            'unit_refund': unit_refund,
-        })
-
-    if request.method == 'POST':
-        reason = request.POST.get('reason', '').strip()
-        errors = []
-        return_lines = []
-
-        for row in return_rows:
-            field_name = f"return_qty_{row['item'].id}"
-            qty_raw = request.POST.get(field_name, '').strip()
-            if not qty_raw:
-                continue
-            try:
-                qty = int(qty_raw)
-            except ValueError:
-                errors.append(f"Invalid return quantity for {row['display_name']}.")
-                continue
-            if qty <= 0:
-                continue
-            if qty > row['available_qty']:
-                errors.append(f"Return quantity for {row['display_name']} exceeds available.")
-                continue
+@csrf_exempt
+def sync_sales_api(request):
+    """Accept a backlog of sales queued by a POS terminal while it was offline."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    sales = data.get('sales') if isinstance(data, dict) else None
+    if not isinstance(sales, list):
+        return JsonResponse({'status': 'error', 'message': 'Expected a "sales" list'}, status=400)
+    return JsonResponse({'status': 'success', 'results': sync_sales(sales)})
 
-            total_amount = (row['unit_refund'] * Decimal(qty)).quantize(
-                Decimal('0.01'),
-                rounding=ROUND_HALF_UP
-            )
-            return_lines.append((row['item'], qty, row['unit_refund'], total_amount))
+def _posted_return_quantities(request, rows):
+    """Read ``return_qty_<sale item id>`` fields; returns ``(quantities, errors)``."""
+    quantities = {}
+    errors = []
+    for row in rows:
+        qty_raw = request.POST.get(f"return_qty_{row['item'].id}", '').strip()
+        if not qty_raw:
+            continue
+        try:
+            quantities[row['item'].id] = int(qty_raw)
+        except ValueError:
+            errors.append(f"Invalid return quantity for {row['display_name']}.")
+    return quantities, errors
 
-        if errors:
-            for error in errors:
-                messages.error(request, error)
+def _process_posted_returns(request, rows, restock=True):
+    """Validate and write the posted return; returns the SalesReturns or ``None`` on errors."""
+    quantities, errors = _posted_return_quantities(request, rows)
+    if not errors:
+        try:
+            with write_atomic():
+                return process_returns(quantities, request.POST.get('reason', '').strip(), restock)
+        except ValueError as e:
+            errors = e.args
+    for error in errors:
+        messages.error(request, error)
+    return None
 
-        if not return_lines:
-            if not errors:
-                messages.error(request, 'Select at least one item to return.')
-        else:
-            with transaction.atomic():
-                sales_return = SalesReturn.objects.create(
-                    invoice=invoice,
-                    reason=reason,
-                    refund_amount=Decimal('0.00')
-                )
-                refund_total = Decimal('0.00')
-                for item, qty, unit_refund, total_amount in return_lines:
-                    SalesReturnItem.objects.create(
-                        sales_return=sales_return,
-                        sale_item=item,
-                        quantity=qty,
-                        unit_refund=unit_refund,
-                        total_amount=total_amount
-                    )
-                    refund_total += total_amount
-                    if item.batch_id:
-                        item.batch.quantity += qty
-                        item.batch.save(update_fields=['quantity'])
-                sales_return.refund_amount = refund_total
-                sales_return.save(update_fields=['refund_amount'])
+def sales_return_create(request, invoice_id):
+    invoice = get_object_or_404(SalesInvoice.objects.select_related('customer'), id=invoice_id)
+    rows = return_rows(invoice.items.all())
 
-            messages.success(request, 'Return processed successfully.')
-            return redirect(f"{reverse('daily_sales')}?date={invoice.date.date().isoformat()}")
+    if request.method == 'POST' and _process_posted_returns(request, rows):
+        messages.success(request, 'Return processed successfully.')
+        return redirect(f"{reverse('daily_sales')}?date={invoice.date.date().isoformat()}")
 
     return_history = SalesReturn.objects.filter(invoice=invoice).order_by('-date')
     context = {
         'invoice': invoice,
-        'return_rows': return_rows,
+        'return_rows': rows,
         'return_history': return_history,
     }
     return render(request, 'sales/return_form.html', context)
+
+def batch_recall_return(request, batch_id):
+    """Return every unreturned sale of one batch (e.g. a recall) across all its invoices.
+
+    Recalled units are refunded but never restocked, so they cannot be sold again.
+    """
+    batch = get_object_or_404(Batch.objects.select_related('product'), id=batch_id)
+    rows = [
+        row for row in return_rows(
+            SaleItem.objects.filter(batch=batch).select_related('invoice', 'invoice__customer').order_by('invoice__date', 'id')
+        )
+        if row['available_qty'] > 0
+    ]
+
+    if request.method == 'POST':
+        sales_returns = _process_posted_returns(request, rows, restock=False)
+        if sales_returns:
+            messages.success(request, f'Returned {batch} from {len(sales_returns)} invoice(s).')
+            return redirect('batch_recall_return', batch_id=batch.id)
+
+    context = {
+        'batch': batch,
+        'return_rows': rows,
+        'total_available': sum(row['available_qty'] for row in rows),
+    }
+    return render(request, 'sales/batch_recall_return.html', context)
@@ -8,9 +8,20 @@ document.addEventListener('DOMContentLoaded', function () {
     const discountInput = document.getElementById('bill-discount');
     const checkoutBtn = document.getElementById('btn-checkout');
     const minSearchLength = 2;
+    const SALE_TIMEOUT_MS = 8000;
+    const SALE_MAX_ATTEMPTS = 4;
+    const SALE_RETRY_DELAY_MS = 500;
+    const OFFLINE_QUEUE_KEY = 'pos.offlineSales';
+    const FAILED_QUEUE_KEY = 'pos.failedSales';
+    const SYNC_BATCH_SIZE = 50;
+    const SYNC_INTERVAL_MS = 30000;
+    const CATALOG_KEY = 'pos.catalog';
+    const CATALOG_REFRESH_MS = 60000;
+    const RESULT_LIMIT = 20;
 
     let cart = [];
     let initialResults = null;
+    let pendingSaleKey = null;
 
     const manualAddBtn = document.getElementById('manualAddBtn');
     const manualNameInput = document.getElementById('manualName');
@@ -18,22 +29,46 @@ document.addEventListener('DOMContentLoaded', function () {
     const manualQtyInput = document.getElementById('manualQty');
     const customerPhoneInput = document.getElementById('customerPhone');
 
-    // Init Customers
+    // Customers are looked up as the cashier types; the server keeps a prefix index
     const customerList = document.getElementById('customerList');
-    const customerRecords = Array.isArray(window.customersData) ? window.customersData : [];
-    if (customerList && customerRecords.length) {
-        customerRecords.forEach(c => {
+    const customerRecords = new Map();  // customer id -> customer
+    const customerOptions = new Map();  // datalist value -> customer id
+    const minCustomerSearchLength = 2;
+    let customerSearchSeq = 0;
+
+    function renderCustomerOptions(customers) {
+        if (!customerList) return;
+        customerList.innerHTML = '';
+        customerOptions.clear();
+        customers.forEach(c => {
+            customerRecords.set(c.id, c);
+            // Customers without a phone are listed by name
+            const value = c.phone || c.name;
+            if (customerOptions.has(value)) return;
+            customerOptions.set(value, c.id);
             const option = document.createElement('option');
-            option.value = c.phone;
-            option.textContent = `${c.name} (${c.phone})`;
+            option.value = value;
+            option.textContent = c.phone ? `${c.name} (${c.phone})` : `${c.name} (no phone)`;
             customerList.appendChild(option);
         });
     }
 
-    function fillCustomerDetails(phone) {
-        const customer = customerRecords.find(c => c.phone === phone);
+    function fetchCustomers(query) {
+        const seq = ++customerSearchSeq;
+        return fetch(`/sales/api/customers/?q=${encodeURIComponent(query)}&limit=10`)
+            .then(res => res.json())
+            .then(data => {
+                // Ignore answers to queries the cashier has already typed past
+                if (seq === customerSearchSeq) renderCustomerOptions(data.results || []);
+            })
+            .catch(() => {});
+    }
+
+    function fillCustomerDetails(value) {
+        const customer = customerRecords.get(customerOptions.get(value));
         if (customer) {
             document.getElementById('customerName').value = customer.name;
+            if (!customer.phone) customerPhoneInput.value = '';
         }
     }
 
@@ -83,6 +118,14 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     });
     if (customerPhoneInput) {
+        customerPhoneInput.addEventListener('input', debounce(() => {
+            const query = customerPhoneInput.value.trim();
+            if (customerOptions.has(query)) {
+                fillCustomerDetails(query);
+                return;
+            }
+            if (query.length >= minCustomerSearchLength) fetchCustomers(query);
+        }, 250));
         customerPhoneInput.addEventListener('change', () => fillCustomerDetails(customerPhoneInput.value));
     }
 
@@ -135,12 +178,136 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
-    // Load initial products so the list isn't empty
-    loadInitialResults();
+    // Local catalog: the sellable products kept in localStorage and refreshed
+    // with deltas from /sales/api/catalog/, so typing never waits on the server.
+    const catalog = { cursor: null, fields: null, products: new Map(), ready: false };
+    let catalogSync = null;
+
+    function catalogProduct(fields, row) {
+        const product = {};
+        fields.forEach((field, i) => { product[field] = row[i]; });
+        product.searchText = `${product.name} ${product.brand}`.toLowerCase();
+        return product;
+    }
+
+    function loadStoredCatalog() {
+        try {
+            const stored = JSON.parse(localStorage.getItem(CATALOG_KEY));
+            if (!stored || !Array.isArray(stored.rows)) return;
+            stored.rows.forEach(row => catalog.products.set(row[0], catalogProduct(stored.fields, row)));
+            catalog.cursor = stored.cursor;
+            catalog.fields = stored.fields;
+            catalog.ready = true;
+        } catch (e) {
+            localStorage.removeItem(CATALOG_KEY);
+        }
+    }
+
+    function saveCatalog() {
+        const rows = [];
+        catalog.products.forEach(p => rows.push(catalog.fields.map(field => p[field])));
+        try {
+            localStorage.setItem(CATALOG_KEY, JSON.stringify({ cursor: catalog.cursor, fields: catalog.fields, rows }));
+        } catch (e) {
+            // Over the storage quota: keep the catalog for this session only
+            localStorage.removeItem(CATALOG_KEY);
+        }
+    }
+
+    function syncCatalog() {
+        if (catalogSync) return catalogSync;
+        const since = catalog.cursor;
+        const reloaded = new Map();
+        let cursor = null;
+        let reset = false;
+
+        function fetchPage(after) {
+            const params = new URLSearchParams({ after });
+            if (since) params.set('since', since);
+            return fetch(`/sales/api/catalog/?${params}`)
+                .then(res => {
+                    if (!res.ok) throw new Error(`Catalog sync failed (${res.status})`);
+                    return res.json();
+                })
+                .then(data => {
+                    if (!after) {
+                        cursor = data.cursor;
+                        reset = data.reset;
+                    }
+                    const target = reset ? reloaded : catalog.products;
+                    data.products.forEach(row => target.set(row[0], catalogProduct(data.fields, row)));
+                    data.deleted.forEach(id => catalog.products.delete(id));
+                    catalog.fields = data.fields;
+                    if (data.next_after) return fetchPage(data.next_after);
+                });
+        }
+
+        catalogSync = fetchPage(0)
+            .then(() => {
+                if (reset) catalog.products = reloaded;
+                catalog.cursor = cursor;
+                catalog.ready = true;
+                saveCatalog();
+                refreshResults();
+            })
+            .catch(err => console.warn('Catalog sync failed, will retry:', err))
+            .finally(() => { catalogSync = null; });
+        return catalogSync;
+    }
+
+    function searchCatalog(query) {
+        const terms = query.toLowerCase().split(/\s+/).filter(Boolean);
+        if (terms.length === 0) {
+            return Array.from(catalog.products.values()).sort((a, b) => a.id - b.id).slice(0, RESULT_LIMIT);
+        }
+        const matches = [];
+        catalog.products.forEach(p => {
+            if (terms.every(term => p.searchText.includes(term))) matches.push(p);
+        });
+        // Names starting with the query first, then word-prefix matches, then substrings
+        const first = terms[0];
+        const rank = p => {
+            if (p.name.toLowerCase().startsWith(first)) return 0;
+            return p.searchText.split(' ').some(word => word.startsWith(first)) ? 1 : 2;
+        };
+        matches.sort((a, b) => rank(a) - rank(b) || a.name.localeCompare(b.name));
+        return matches.slice(0, RESULT_LIMIT);
+    }
+
+    function deductLocalStock(items) {
+        (items || []).forEach(item => {
+            const product = catalog.products.get(Number(item.product_id));
+            if (product) product.stock = Math.max(product.stock - item.quantity, 0);
+        });
+        if (catalog.ready) saveCatalog();
+    }
+
+    function refreshResults() {
+        const query = searchInput.value.trim();
+        if (query.length === 0) {
+            renderResults(searchCatalog(''), 'No products available.');
+        } else if (query.length >= minSearchLength) {
+            renderResults(searchCatalog(query), 'No matching products.');
+        }
+    }
+
+    loadStoredCatalog();
+    if (catalog.ready) {
+        refreshResults();
+    } else {
+        // Load initial products so the list isn't empty while the catalog downloads
+        loadInitialResults();
+    }
+    syncCatalog();
+    setInterval(syncCatalog, CATALOG_REFRESH_MS);
 
     // Search Logic
     searchInput.addEventListener('input', debounce(function (e) {
         const query = e.target.value.trim();
+        if (catalog.ready) {
+            refreshResults();
+            return;
+        }
         if (query.length === 0) {
             if (initialResults) {
                 renderResults(initialResults, 'No products available.');
@@ -152,23 +319,61 @@ document.addEventListener('DOMContentLoaded', function () {
         if (query.length < minSearchLength) return;
 
         fetchProducts(query, 'No matching products.');
-    }, 400));
+    }, 150));
 
-    function addToCart(product) {
+    function addToCart(product, quantity = 1) {
         const existing = cart.find(item => item.id === product.id);
         if (existing) {
-            existing.quantity++;
+            existing.quantity += quantity;
         } else {
             cart.push({
                 ...product,
-                quantity: 1,
+                quantity: quantity,
                 userPrice: product.price // Allow override later
             });
         }
         renderCart();
     }
 
+    // Barcode scanners type the code and press Enter: plain GTINs or GS1 strings with lot/expiry
+    function looksLikeBarcode(value) {
+        return /^(\][A-Za-z]\d)?(\(\d{2,4}\)|\d{8,})/.test(value);
+    }
+
+    function scanProduct(code) {
+        return fetch(`/sales/api/scan/?code=${encodeURIComponent(code)}`)
+            .then(res => res.json().then(data => ({ ok: res.ok, data })))
+            .then(({ ok, data }) => {
+                if (!ok) {
+                    alert(data.message || 'Unknown barcode.');
+                    return;
+                }
+                const product = data.product;
+                if (product.lot && product.lot.expired &&
+                    !confirm(`Lot ${product.lot.batch_number} of ${product.name} expired on ${product.lot.expiry}. Add it anyway?`)) {
+                    return;
+                }
+                addToCart(product, product.pack_quantity || 1);
+            })
+            .catch(() => {
+                // Offline: the local catalog has no barcodes, fall back to a text search
+                searchInput.value = code;
+                refreshResults();
+            });
+    }
+
+    searchInput.addEventListener('keydown', function (event) {
+        if (event.key !== 'Enter') return;
+        const code = searchInput.value.trim();
+        if (!looksLikeBarcode(code)) return;
+        event.preventDefault();
+        searchInput.value = '';
+        scanProduct(code);
+    });
+
     function renderCart() {
+        // A changed cart is a different sale
+        pendingSaleKey = null;
         cartContainer.innerHTML = '';
         let subtotal = 0;
         let taxTotal = 0;
@@ -251,28 +456,26 @@ document.addEventListener('DOMContentLoaded', function () {
         const cName = document.getElementById('customerName') ? document.getElementById('customerName').value : '';
         const cPhone = document.getElementById('customerPhone') ? document.getElementById('customerPhone').value : '';
 
+        // One key per sale: retries (and the offline sync) reuse it so the server never sells twice
+        if (!pendingSaleKey) pendingSaleKey = newIdempotencyKey();
+
         const payload = {
             ...window.currentCartData,
             customer_name: cName,
             customer_phone: cPhone,
             payment_mode: document.getElementById('payment-mode').value,
-            discount_amount: document.getElementById('bill-discount').value
+            discount_amount: document.getElementById('bill-discount').value,
+            idempotency_key: pendingSaleKey
         };
+        const soldAt = new Date().toISOString();
 
         console.log("Sending payload:", payload);
 
-        fetch('/sales/api/create/', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(payload)
-        })
-            .then(res => {
-                console.log("Response status:", res.status);
-                return res.json();
-            })
+        postSale(payload, pendingSaleKey, 0)
             .then(data => {
                 console.log("Response data:", data);
                 if (data.status === 'success') {
+                    pendingSaleKey = null;
                     // Redirect to Print
                     window.location.href = `/sales/invoice/${data.invoice_id}/print/`;
                 } else {
@@ -283,12 +486,159 @@ document.addEventListener('DOMContentLoaded', function () {
             })
             .catch(err => {
                 console.error("Fetch error:", err);
-                alert('Network error: ' + err);
+                // Server unreachable: keep the sale locally and sync it later, dated when it was rung up
+                queueOfflineSale({ ...payload, date: soldAt });
+                deductLocalStock(payload.items);
+                pendingSaleKey = null;
+                cart = [];
+                renderCart();
+                alert('Server unreachable. The sale was saved on this terminal and will sync automatically.');
                 checkoutBtn.innerText = originalText;
                 checkoutBtn.disabled = false;
             });
     });
 
+    // Offline queue: sales that could not reach the server, flushed in batches
+    function readQueue(name) {
+        try {
+            return JSON.parse(localStorage.getItem(name)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function writeQueue(name, entries) {
+        localStorage.setItem(name, JSON.stringify(entries));
+    }
+
+    function queueOfflineSale(payload) {
+        const queue = readQueue(OFFLINE_QUEUE_KEY);
+        queue.push(payload);
+        writeQueue(OFFLINE_QUEUE_KEY, queue);
+        updateQueueStatus();
+    }
+
+    function updateQueueStatus() {
+        const statusEl = document.getElementById('offline-queue-status');
+        if (statusEl) {
+            const count = readQueue(OFFLINE_QUEUE_KEY).length;
+            statusEl.textContent = count ? `${count} sale(s) waiting to sync` : '';
+            statusEl.style.display = count ? 'block' : 'none';
+        }
+        renderFailedSales();
+    }
+
+    // Sales the server rejected are kept until the cashier has seen them
+    function renderFailedSales() {
+        const failedEl = document.getElementById('failed-sales');
+        if (!failedEl) return;
+        const failed = readQueue(FAILED_QUEUE_KEY);
+        failedEl.style.display = failed.length ? 'block' : 'none';
+        failedEl.innerHTML = '';
+        if (!failed.length) return;
+
+        const title = document.createElement('strong');
+        title.textContent = `${failed.length} offline sale(s) could not be saved:`;
+        failedEl.appendChild(title);
+        const list = document.createElement('ul');
+        failed.forEach(sale => {
+            const row = document.createElement('li');
+            const when = sale.date ? new Date(sale.date).toLocaleString() : 'unknown time';
+            row.textContent = `${when}, Rs. ${Number(sale.grand_total || 0).toFixed(2)}: ${sale.error}`;
+            list.appendChild(row);
+        });
+        failedEl.appendChild(list);
+        const dismiss = document.createElement('button');
+        dismiss.type = 'button';
+        dismiss.className = 'btn btn-outline btn-sm';
+        dismiss.textContent = 'Dismiss';
+        dismiss.addEventListener('click', () => {
+            if (!confirm('Remove these sales from this terminal? Re-enter any that should be kept first.')) return;
+            writeQueue(FAILED_QUEUE_KEY, []);
+            renderFailedSales();
+        });
+        failedEl.appendChild(dismiss);
+    }
+
+    let syncing = false;
+    function flushOfflineQueue() {
+        const batch = readQueue(OFFLINE_QUEUE_KEY).slice(0, SYNC_BATCH_SIZE);
+        if (syncing || batch.length === 0) return Promise.resolve();
+        syncing = true;
+        return fetch('/sales/api/sync/', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ sales: batch })
+        })
+            .then(res => res.json().catch(() => {
+                throw new Error(`Server error (${res.status})`);
+            }))
+            .then(data => {
+                const done = new Set();
+                const failed = [];
+                let retrying = false;
+                (data.results || []).forEach((result, i) => {
+                    if (result.status === 'retry') {
+                        // The server could not write it this time: it stays queued
+                        console.warn('Offline sale not synced yet:', result.message);
+                        retrying = true;
+                        return;
+                    }
+                    done.add(result.idempotency_key);
+                    if (result.status !== 'success') {
+                        console.warn('Offline sale rejected:', result.message);
+                        failed.push({ ...batch[i], error: result.message });
+                    }
+                });
+                if (failed.length) writeQueue(FAILED_QUEUE_KEY, readQueue(FAILED_QUEUE_KEY).concat(failed));
+                const remaining = readQueue(OFFLINE_QUEUE_KEY).filter(sale => !done.has(sale.idempotency_key));
+                writeQueue(OFFLINE_QUEUE_KEY, remaining);
+                syncing = false;
+                updateQueueStatus();
+                if (!retrying && done.size && remaining.length) return flushOfflineQueue();
+            })
+            .catch(err => {
+                console.warn('Offline sync failed, will retry:', err);
+                syncing = false;
+                updateQueueStatus();
+                const statusEl = document.getElementById('offline-queue-status');
+                if (statusEl && statusEl.textContent) statusEl.textContent += ` (last sync failed: ${err.message})`;
+            });
+    }
+
+    updateQueueStatus();
+    flushOfflineQueue();
+    window.addEventListener('online', flushOfflineQueue);
+    setInterval(flushOfflineQueue, SYNC_INTERVAL_MS);
+
+    function newIdempotencyKey() {
+        if (window.crypto && window.crypto.randomUUID) return window.crypto.randomUUID();
+        return 'sale-' + Date.now() + '-' + Math.random().toString(16).slice(2);
+    }
+
+    function postSale(payload, key, attempt) {
+        const controller = new AbortController();
+        const timer = setTimeout(() => controller.abort(), SALE_TIMEOUT_MS);
+        return fetch('/sales/api/create/', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key },
+            body: JSON.stringify(payload),
+            signal: controller.signal
+        })
+            .then(res => {
+                clearTimeout(timer);
+                console.log("Response status:", res.status);
+                // The server answered: an error page is shown to the cashier, never queued as offline
+                return res.json().catch(() => ({ status: 'error', message: `Server error (${res.status})` }));
+            }, err => {
+                clearTimeout(timer);
+                if (attempt + 1 >= SALE_MAX_ATTEMPTS) throw err;
+                const backoff = SALE_RETRY_DELAY_MS * (attempt + 1);
+                return new Promise(resolve => setTimeout(resolve, backoff))
+                    .then(() => postSale(payload, key, attempt + 1));
+            });
+    }
+
     function debounce(func, wait) {
         let timeout;
         return function executedFunction(...args) {
@@ -0,0 +1,104 @@
+document.addEventListener('DOMContentLoaded', function () {
+    // Product pickers search the product index as the user types; the page
+    // never carries the catalog, so it stays small however many products exist
+    const minSearchLength = 2;
+
+    document.querySelectorAll('.product-autocomplete').forEach(function (input) {
+        const hidden = document.getElementById(input.dataset.target);
+        const list = document.createElement('datalist');
+        list.id = input.dataset.target + '-options';
+        input.setAttribute('list', list.id);
+        input.after(list);
+
+        const products = new Map();
+        let searchSeq = 0;
+        let timer;
+
+        function renderOptions(results) {
+            list.innerHTML = '';
+            products.clear();
+            results.forEach(p => {
+                products.set(p.label, p.id);
+                const option = document.createElement('option');
+                option.value = p.label;
+                list.appendChild(option);
+            });
+        }
+
+        input.addEventListener('input', function () {
+            // A typed name only counts once it is picked from the list
+            const previous = hidden.value;
+            hidden.value = products.get(input.value) || '';
+            if (hidden.value !== previous) {
+                input.dispatchEvent(new CustomEvent('product-selected', { bubbles: true }));
+            }
+            const query = input.value.trim();
+            clearTimeout(timer);
+            if (hidden.value || query.length < minSearchLength) return;
+            timer = setTimeout(() => {
+                const seq = ++searchSeq;
+                fetch(`${input.dataset.url}?q=${encodeURIComponent(query)}`)
+                    .then(res => res.json())
+                    .then(data => {
+                        // Ignore answers to queries the user has already typed past
+                        if (seq === searchSeq) renderOptions(data.results || []);
+                    })
+                    .catch(() => {});
+            }, 200);
+        });
+    });
+});
+
+document.addEventListener('DOMContentLoaded', function () {
+    // What was last paid the selected supplier for each product, from a cached lookup
+    const table = document.getElementById('purchase-items');
+    const supplier = document.getElementById('id_supplier');
+    if (!table || !supplier) return;
+    let lookupSeq = 0;
+
+    function rows() {
+        return Array.from(table.querySelectorAll('tbody tr')).map(row => ({
+            product: row.querySelector('input[type=hidden][name$="-product"]'),
+            unitPrice: row.querySelector('input[name$="-unit_price"]'),
+            cell: row.querySelector('.last-cost'),
+        })).filter(row => row.product && row.cell);
+    }
+
+    function historyLink(productId) {
+        const url = table.dataset.historyUrl.replace('/0/', `/${productId}/`);
+        return `${url}?supplier=${encodeURIComponent(supplier.value)}`;
+    }
+
+    function showCosts(costs) {
+        rows().forEach(row => {
+            const cost = costs[row.product.value];
+            row.cell.textContent = '';
+            if (!row.product.value) return;
+            const link = document.createElement('a');
+            link.href = historyLink(row.product.value);
+            link.target = '_blank';
+            link.textContent = cost ? `${cost.unit_price} (${cost.date})` : 'History';
+            row.cell.appendChild(link);
+            if (cost && row.unitPrice && !row.unitPrice.value) row.unitPrice.value = cost.unit_price;
+        });
+    }
+
+    function refresh() {
+        const ids = rows().map(row => row.product.value).filter(Boolean);
+        if (!supplier.value || !ids.length) {
+            showCosts({});
+            return;
+        }
+        const seq = ++lookupSeq;
+        fetch(`${table.dataset.lastCostUrl}?supplier=${supplier.value}&products=${ids.join(',')}`)
+            .then(res => res.json())
+            .then(data => {
+                if (seq === lookupSeq) showCosts(data.results || {});
+            })
+            .catch(() => {});
+    }
+
+    supplier.addEventListener('change', refresh);
+    table.addEventListener('product-selected', refresh);
+    refresh();
+});